@@ -0,0 +1,269 @@
+import threading
+import time
+
+import numpy as np
+
+from backend import DeviceError
+from metrics import Metrics
+
+
+class SampleRing:
+    """タイムスタンプ付きサンプルのリングバッファ（書き込み1スレッド・読み出し複数）
+
+    書き込み側は配列に書いてから head を進めるだけなのでロックを使わない。
+    読み出し側はそれぞれ自分のカーソルを持ち、コピーした後に書き込み位置を見直して
+    上書きされてしまった分を捨てる（取りこぼしとして数える）。
+    """
+
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+        self.times = np.zeros(self.capacity)
+        self.values = np.zeros(self.capacity)
+        self.head = 0          # これまでに書き込みを終えた総サンプル数
+        self._reserved = 0     # 書き込み中の領域の終わり
+
+    def write(self, times, values):
+        n = len(values)
+        if n == 0:
+            return
+        if n > self.capacity:
+            # 容量を超える分は古いほうを捨てる
+            self.head += n - self.capacity
+            times, values, n = times[-self.capacity:], values[-self.capacity:], self.capacity
+        self._reserved = self.head + n
+        start = self.head % self.capacity
+        first = min(n, self.capacity - start)
+        self.times[start:start + first] = times[:first]
+        self.values[start:start + first] = values[:first]
+        if first < n:
+            self.times[:n - first] = times[first:]
+            self.values[:n - first] = values[first:]
+        self.head += n
+
+    def _copy(self, start, stop):
+        """総サンプル番号 [start, stop) をコピーして返す"""
+        i, j = start % self.capacity, stop % self.capacity
+        if stop - start == 0:
+            return np.empty(0), np.empty(0)
+        if i < j:
+            return self.times[i:j].copy(), self.values[i:j].copy()
+        return (np.concatenate((self.times[i:], self.times[:j])),
+                np.concatenate((self.values[i:], self.values[:j])))
+
+    def read(self, cursor, max_samples=None):
+        """cursor 以降のサンプルを返す: (times, values, 新しい cursor, 取りこぼし数)"""
+        head = self.head
+        lost = 0
+        oldest = head - self.capacity
+        if cursor < oldest:
+            lost, cursor = oldest - cursor, oldest
+        stop = head if max_samples is None else min(head, cursor + max_samples)
+        times, values = self._copy(cursor, stop)
+        # コピー中に上書きされた分を捨てる
+        overwritten = min(self._reserved - self.capacity - cursor, len(values))
+        if overwritten > 0:
+            times, values = times[overwritten:], values[overwritten:]
+            lost += overwritten
+        return times, values, stop, lost
+
+    def latest(self, n):
+        """最新の n サンプルを返す"""
+        head = self.head
+        n = min(n, head, self.capacity)
+        times, values, _, _ = self.read(head - n)
+        return times, values
+
+
+class AcquisitionWorker(threading.Thread):
+    """デバイスの連続取得（レコードモード）を回し、リングバッファへ書き込むスレッド
+
+    タイムスタンプはストリーム開始時刻とサンプル番号から計算するので、
+    GUI の負荷や読み出しの間隔によってずれない。listeners に登録した関数は
+    ブロックごとに (times, values) を受け取り、このスレッド上で呼ばれる（停止判定など）。
+    channel に (1, 2) のようなタプルを渡すと、ring もチャンネルごとのリストにし、
+    listeners には (チャンネル数, サンプル数) の values を渡す。
+    stream_read とリスナー全体の処理時間、取りこぼしは metrics（metrics.Metrics）に記録する。
+    set_sampling_frequency で周波数を変えると、次のブロックの前にストリームを開き直し、
+    rate_listeners に (新しいストリームの開始時刻, 周波数) を渡す（開き直す間のサンプルは取得しない）。
+    その途切れ（前のストリームの最後のサンプルから新しいストリームの開始まで）は metrics.rate_gap に記録する。
+    """
+
+    def __init__(self, device, ring, sampling_frequency=10e3, channel=1, poll_interval=1e-3, metrics=None):
+        super().__init__(daemon=True)
+        self.device = device
+        self.ring = ring
+        self.sampling_frequency = sampling_frequency
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.samples = 0       # 取得したサンプル数
+        self.lost = 0          # デバイス側で取りこぼしたサンプル数
+        self.errors = 0
+        self.metrics = metrics or Metrics()
+        self.listeners = []
+        self.rate_listeners = []
+        self._rate_request = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        fs = self.sampling_frequency
+        start = self.device.stream_start(fs, channel=self.channel)
+        if start is None:
+            start = time.perf_counter()
+        index = 0
+        metrics = self.metrics
+        try:
+            while not self._stop_event.is_set():
+                request, self._rate_request = self._rate_request, None
+                if request is not None and request != fs:
+                    end = start + index / fs     # 前のストリームで次に来るはずだったサンプルの時刻
+                    start, fs = self._restart(request)
+                    metrics.rate_gap.observe(max(start - end, 0.0))
+                    index = 0
+                t0 = time.perf_counter()
+                try:
+                    values, lost = self.device.stream_read()
+                except DeviceError as e:
+                    print(f"Data acquisition error: {str(e)}")
+                    self.errors += 1
+                    metrics.errors.inc()
+                    self._stop_event.wait(self.poll_interval)
+                    continue
+                # 取りこぼした分はサンプル番号だけ進め、時刻がずれないようにする
+                index += lost
+                self.lost += lost
+                if lost:
+                    metrics.dropped.inc(lost)
+                n = values.shape[-1]
+                if n == 0:
+                    self._stop_event.wait(self.poll_interval)
+                    continue
+                times = start + (index + np.arange(n)) / fs
+                if values.ndim == 1:
+                    self.ring.write(times, values)
+                else:
+                    for ring, row in zip(self.ring, values):
+                        ring.write(times, row)
+                index += n
+                self.samples += n
+                metrics.samples.inc(n)
+                t1 = time.perf_counter()
+                metrics.acquire.observe(t1 - t0)
+                for listener in self.listeners:
+                    try:
+                        listener(times, values)
+                    except DeviceError as e:
+                        print(f"Listener error: {str(e)}")
+                        self.errors += 1
+                        metrics.errors.inc()
+                    except Exception as e:
+                        # 1つのリスナーの不具合で取得（とほかのリスナーの停止判定）を止めない
+                        print(f"Listener error: {type(e).__name__}: {str(e)}")
+                        self.errors += 1
+                        metrics.errors.inc()
+                metrics.listeners.observe(time.perf_counter() - t1)
+        finally:
+            self.device.stream_stop()
+
+    def set_sampling_frequency(self, sampling_frequency):
+        """サンプリング周波数を変える（実際の変更は取得スレッドで行う）"""
+        self._rate_request = sampling_frequency
+
+    def _restart(self, sampling_frequency):
+        self.device.stream_stop()
+        start = self.device.stream_start(sampling_frequency, channel=self.channel)
+        if start is None:
+            start = time.perf_counter()
+        self.sampling_frequency = sampling_frequency
+        for listener in self.rate_listeners:
+            listener(start, sampling_frequency)
+        return start, sampling_frequency
+
+    def add_listener(self, listener):
+        # 取得スレッドが走査中のリストを書き換えないよう、新しいリストに差し替える
+        self.listeners = self.listeners + [listener]
+
+    def remove_listener(self, listener):
+        self.listeners = [l for l in self.listeners if l != listener]
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+
+
+# 1区間（avg_window サンプル）を1つの値にまとめる方法。引数は (区間数, avg_window) の配列
+REDUCERS = {
+    '|mean|': lambda x: np.abs(x.mean(axis=1)),
+    'mean': lambda x: x.mean(axis=1),
+    'rms': lambda x: np.sqrt(np.einsum('ij,ij->i', x, x) / x.shape[1]),
+    'median': lambda x: np.median(x, axis=1),
+    'min': lambda x: x.min(axis=1),
+    'max': lambda x: x.max(axis=1),
+}
+
+
+class Averager:
+    """連続したサンプルを window 個ずつ区切り、NumPy でまとめて縮約する
+
+    端数のサンプルは次の呼び出しまで固定長のバッファに保持する。
+    method は REDUCERS のキーか、(区間数, window) のサンプルと時刻を受け取る関数
+    （dsp.LockIn.reduce など、時刻が必要な縮約用）。
+    """
+
+    def __init__(self, window, method='|mean|'):
+        self.set_method(method)
+        self.set_window(window)
+
+    def set_window(self, window):
+        self.window = max(int(window), 1)
+        self._pending_times = np.zeros(self.window)
+        self._pending_values = np.zeros(self.window)
+        self._pending = 0
+
+    def set_method(self, method):
+        if callable(method):
+            self._reduce = method
+        elif method in REDUCERS:
+            reduce = REDUCERS[method]
+            self._reduce = lambda x, t: reduce(x)
+        else:
+            raise ValueError(f"Unknown reduction: {method}")
+        self.method = method
+
+    def reset(self):
+        self._pending = 0
+
+    def __reduce__(self):
+        # 別プロセスへは設定だけを渡す（縮約の関数はラムダなので pickle できない）
+        return Averager, (self.window, self.method)
+
+    def feed(self, times, values):
+        """サンプルを追加し、完成した区間の (最後のサンプルの時刻, 縮約値) を返す"""
+        w = self.window
+        reduce = self._reduce
+        out_times, out_values = [], []
+        # 前回の端数を埋める
+        if self._pending:
+            k = min(w - self._pending, len(values))
+            self._pending_times[self._pending:self._pending + k] = times[:k]
+            self._pending_values[self._pending:self._pending + k] = values[:k]
+            self._pending += k
+            times, values = times[k:], values[k:]
+            if self._pending < w:
+                return np.empty(0), np.empty(0)
+            out_times.append(self._pending_times[-1:].copy())
+            out_values.append(reduce(self._pending_values[np.newaxis, :], self._pending_times[np.newaxis, :]))
+            self._pending = 0
+        # 区間ごとにまとめて縮約する
+        blocks = len(values) // w
+        if blocks:
+            out_times.append(times[w - 1:blocks * w:w])
+            out_values.append(reduce(values[:blocks * w].reshape(blocks, w), times[:blocks * w].reshape(blocks, w)))
+        rest = len(values) - blocks * w
+        if rest:
+            self._pending_times[:rest] = times[blocks * w:]
+            self._pending_values[:rest] = values[blocks * w:]
+            self._pending = rest
+        if not out_values:
+            return np.empty(0), np.empty(0)
+        return np.concatenate(out_times), np.concatenate(out_values)
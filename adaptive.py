@@ -0,0 +1,106 @@
+import math
+import threading
+
+import numpy as np
+
+from acquisition import Averager
+
+
+class RateScheduler:
+    """電流の傾向から取得のサンプリング周波数を選ぶ
+
+    rates は (エッチング中の安定時, 通常, ドロップオフ直前) の周波数 [Hz]。
+    停止判定と同じ縮約（window, method）の値を使い、しきい値との比と、下がる速さから求めた
+    しきい値に届くまでの時間を見る。しきい値の near_ratio 倍を下回るか near_time 秒以内に届きそうなら
+    すぐに速くし、far_ratio 倍以上かつ far_time 秒以上かかりそうな状態が hold 秒続いたら遅くする。
+    周波数を変えるたびにストリームを開き直してサンプルが途切れるので、ドロップオフ直前の周波数に上げたあとは
+    reset（エッチングの停止）まで変えない（しきい値の近くで途切れないように）。
+    process は取得スレッドから呼ばれる。しきい値が 0 のとき（自動停止なし）は通常の周波数のままにする。
+    configure の変更は StopEngine と同じく、取得スレッドで次のブロックの前に反映する。
+    """
+
+    def __init__(self, rates=(2e3, 10e3, 50e3), window=1000, method='|mean|', near_ratio=1.5, near_time=3.0,
+                 far_ratio=3.0, far_time=30.0, hold=2.0, smoothing=0.2):
+        self.rates = tuple(rates)
+        self.near_ratio = near_ratio
+        self.near_time = near_time
+        self.far_ratio = far_ratio
+        self.far_time = far_time
+        self.hold = hold
+        self.smoothing = smoothing        # 傾きの指数移動平均の係数
+        self.averager = Averager(window, method)
+        self._pending_config = {}
+        self._config_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.rate = self.rates[1]
+        self.averager.reset()
+        self.slope = 0.0              # 縮約した電流の傾き [A/s]
+        self._last = None
+        self._lower_since = None
+
+    def configure(self, window=None, method=None):
+        with self._config_lock:
+            self._pending_config.update((k, v) for k, v in (('window', window), ('method', method)) if v is not None)
+
+    def _apply_config(self):
+        with self._config_lock:
+            config, self._pending_config = self._pending_config, {}
+        if 'window' in config:
+            self.averager.set_window(config['window'])
+        if 'method' in config:
+            self.averager.set_method(config['method'])
+
+    def _update_slope(self, t, level):
+        if self._last is not None and t > self._last[0]:
+            slope = (level - self._last[1]) / (t - self._last[0])
+            self.slope += self.smoothing * (slope - self.slope)
+        self._last = (t, level)
+
+    def time_to_threshold(self, level, threshold):
+        """今の傾きのまましきい値に届くまでの時間 [s]（下がっていなければ inf）"""
+        if self.slope >= 0:
+            return math.inf
+        return max(level - threshold, 0.0) / -self.slope
+
+    def target(self, level, threshold):
+        """この値のときに選ぶ周波数"""
+        low, normal, high = self.rates
+        remaining = self.time_to_threshold(level, threshold)
+        if level < self.near_ratio * threshold or remaining < self.near_time:
+            return high
+        if level > self.far_ratio * threshold and remaining > self.far_time:
+            return low
+        return normal
+
+    def process(self, times, currents, threshold):
+        """電流 [A] のブロックを受け取り、選んだ周波数を返す"""
+        if self._pending_config:
+            self._apply_config()
+        if threshold <= 0:
+            self.rate = self.rates[1]
+            return self.rate
+        avg_times, levels = self.averager.feed(times, currents)
+        if self.rate == self.rates[2]:
+            # 傾きだけは追い続ける（ドロップオフ直前の周波数のまま）
+            for t, level in zip(avg_times.tolist(), np.abs(levels).tolist()):
+                self._update_slope(t, level)
+            return self.rate
+        for t, level in zip(avg_times.tolist(), np.abs(levels).tolist()):
+            self._update_slope(t, level)
+            target = self.target(level, threshold)
+            if target > self.rate:
+                # 速くするのはすぐに行う
+                self.rate = target
+                self._lower_since = None
+            elif target < self.rate:
+                # 遅くするのは、その状態が hold 秒続いてから
+                if self._lower_since is None:
+                    self._lower_since = t
+                elif t - self._lower_since >= self.hold:
+                    self.rate = target
+                    self._lower_since = None
+            else:
+                self._lower_since = None
+        return self.rate
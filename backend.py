@@ -0,0 +1,535 @@
+import os
+import threading
+import time
+from ctypes import POINTER, byref, c_bool, c_byte, c_double, c_int
+
+import numpy as np
+
+
+class DeviceError(Exception):
+    """デバイス操作のエラー"""
+
+
+class DeviceBackend:
+    """スコープ・波形発生器・デジタルIOをまとめたデバイスのインターフェース"""
+
+    name = ""
+
+    def open(self):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    # スコープ
+    def scope_open(self, sampling_frequency=20e06, buffer_size=0, amplitude_range=10.0):
+        raise NotImplementedError
+
+    def scope_record(self, channel=1):
+        """1レコード分のデータを取得する（numpy配列, 単位: V）"""
+        raise NotImplementedError
+
+    # 連続取得（レコードモード）
+    def stream_start(self, sampling_frequency, channel=1):
+        """取得を開始し、最初のサンプルの時刻（time.perf_counter 基準）を返す
+
+        channel に (1, 2) のようなタプルを渡すと複数チャンネルを同時に取得する。
+        """
+        raise NotImplementedError
+
+    def stream_read(self):
+        """前回の呼び出し以降に取得したサンプルと、取りこぼしたサンプル数を返す
+
+        複数チャンネルのときのサンプルは (チャンネル数, サンプル数) の配列。
+        """
+        raise NotImplementedError
+
+    def stream_stop(self):
+        raise NotImplementedError
+
+    # 波形発生器
+    def wavegen_dc(self, channel, offset):
+        raise NotImplementedError
+
+    def wavegen_sine(self, channel, frequency, amplitude, offset):
+        raise NotImplementedError
+
+    def wavegen_custom(self, channel, data, frequency, amplitude, offset, repeat=0):
+        """-1..1 のデータを offset + amplitude * data として、1秒に frequency 回の速さで再生する
+
+        repeat 回再生したら offset の電圧を保つ（0 なら止めるまで繰り返す）。
+        """
+        raise NotImplementedError
+
+    def wavegen_buffer_size(self, channel):
+        """カスタム波形に使えるサンプル数"""
+        return 4096
+
+    # デジタルIO
+    def dio_enable(self, mask):
+        raise NotImplementedError
+
+    def dio_set(self, value):
+        raise NotImplementedError
+
+
+class WFSDKBackend(DeviceBackend):
+    """WF_SDK を使った Analog Discovery 2/3 用のバックエンド
+
+    on_close はデバイスを閉じたとき（プロセスが落ちてハンドルが閉じられたときも含む）の動作で、
+    DwfParamOnClose の 0: 出力を続ける, 1: 止める, 2: 電源を切る。止めるだけではカスタム波形の
+    オフセット電圧が残るので、既定では電源を切る。
+    """
+
+    def __init__(self, device_name="", on_close=2):
+        self.device_name = device_name
+        self.on_close = on_close
+        self.device_data = None
+        self.amplitude_range = 10.0
+
+    def open(self):
+        # WF_SDK は実機のドライバが必要なので、使うときだけ読み込む
+        from ctypes import cdll
+        from WF_SDK import device, scope, wavegen, error
+        self._device, self._scope, self._wavegen, self._error = device, scope, wavegen, error
+        try:
+            self.device_data = device.open(self.device_name) if self.device_name else device.open()
+        except error as e:
+            raise DeviceError(str(e))
+        self.name = self.device_data.name
+        self.hdwf = self.device_data.handle
+        self.dwf = cdll.dwf
+        self.dwf.FDwfDeviceParamSet(self.hdwf, c_int(4), c_int(self.on_close))  # DwfParamOnClose
+
+    def close(self):
+        try:
+            self._scope.close(self.device_data)
+            self._device.close(self.device_data)
+        except self._error as e:
+            raise DeviceError(str(e))
+
+    def scope_open(self, sampling_frequency=20e06, buffer_size=0, amplitude_range=10.0):
+        self.amplitude_range = amplitude_range
+        try:
+            self._scope.open(self.device_data, sampling_frequency=sampling_frequency, buffer_size=buffer_size)
+            self._scope.trigger(self.device_data, enable=False)
+        except self._error as e:
+            raise DeviceError(str(e))
+        self.dwf.FDwfAnalogInChannelEnableSet(self.hdwf, c_int(0), c_bool(True))
+        self.dwf.FDwfAnalogInChannelRangeSet(self.hdwf, c_int(0), c_double(amplitude_range))  # CH1 の入力レンジ
+
+    def scope_record(self, channel=1):
+        try:
+            return np.asarray(self._scope.record(self.device_data, channel=channel), dtype=float)
+        except self._error as e:
+            raise DeviceError(str(e))
+
+    def stream_start(self, sampling_frequency, channel=1):
+        channels = (channel,) if isinstance(channel, int) else tuple(channel)
+        self._stream_single = isinstance(channel, int)
+        self._stream_channels = [c_int(c - 1) for c in channels]
+        self._stream_buffer = (c_double * max(int(sampling_frequency), 8192))()
+        for c in self._stream_channels:
+            self.dwf.FDwfAnalogInChannelEnableSet(self.hdwf, c, c_bool(True))
+            self.dwf.FDwfAnalogInChannelRangeSet(self.hdwf, c, c_double(self.amplitude_range))
+        self.dwf.FDwfAnalogInAcquisitionModeSet(self.hdwf, c_int(3))  # acqmodeRecord
+        self.dwf.FDwfAnalogInFrequencySet(self.hdwf, c_double(sampling_frequency))
+        self.dwf.FDwfAnalogInRecordLengthSet(self.hdwf, c_double(0))  # 0: 停止するまで取得し続ける
+        self.dwf.FDwfAnalogInConfigure(self.hdwf, c_int(1), c_int(1))
+        return time.perf_counter()
+
+    def stream_read(self):
+        status = c_byte()
+        if not self.dwf.FDwfAnalogInStatus(self.hdwf, c_int(1), byref(status)):
+            raise DeviceError("FDwfAnalogInStatus failed")
+        available, lost, corrupted = c_int(), c_int(), c_int()
+        self.dwf.FDwfAnalogInStatusRecord(self.hdwf, byref(available), byref(lost), byref(corrupted))
+        count = available.value
+        values = np.empty((len(self._stream_channels), count))
+        if count > len(self._stream_buffer):
+            self._stream_buffer = (c_double * count)()
+        for row, c in zip(values, self._stream_channels):
+            if count:
+                self.dwf.FDwfAnalogInStatusData(self.hdwf, c, self._stream_buffer, c_int(count))
+                row[:] = np.frombuffer(self._stream_buffer, dtype=float, count=count)
+        return (values[0] if self._stream_single else values), lost.value + corrupted.value
+
+    def stream_stop(self):
+        self.dwf.FDwfAnalogInConfigure(self.hdwf, c_int(0), c_int(0))
+        self.dwf.FDwfAnalogInAcquisitionModeSet(self.hdwf, c_int(0))  # acqmodeSingle に戻す
+
+    def wavegen_dc(self, channel, offset):
+        try:
+            self._wavegen.generate(self.device_data, channel=channel, function=self._wavegen.function.dc,
+                                   offset=offset, amplitude=0)
+        except self._error as e:
+            raise DeviceError(str(e))
+
+    def wavegen_sine(self, channel, frequency, amplitude, offset):
+        try:
+            self._wavegen.generate(self.device_data, channel=channel, function=self._wavegen.function.sine,
+                                   frequency=frequency, amplitude=amplitude, offset=offset)
+        except self._error as e:
+            raise DeviceError(str(e))
+
+    def wavegen_custom(self, channel, data, frequency, amplitude, offset, repeat=0):
+        ch, node = c_int(channel - 1), c_int(0)    # AnalogOutNodeCarrier
+        data = np.ascontiguousarray(data, dtype=float)
+        self.dwf.FDwfAnalogOutNodeEnableSet(self.hdwf, ch, node, c_bool(True))
+        self.dwf.FDwfAnalogOutNodeFunctionSet(self.hdwf, ch, node, c_byte(30))  # funcCustom
+        self.dwf.FDwfAnalogOutNodeDataSet(self.hdwf, ch, node, data.ctypes.data_as(POINTER(c_double)), c_int(len(data)))
+        self.dwf.FDwfAnalogOutNodeFrequencySet(self.hdwf, ch, node, c_double(frequency))
+        self.dwf.FDwfAnalogOutNodeAmplitudeSet(self.hdwf, ch, node, c_double(amplitude))
+        self.dwf.FDwfAnalogOutNodeOffsetSet(self.hdwf, ch, node, c_double(offset))
+        # repeat 回分の時間だけ1回再生し、終わったらオフセットの電圧を保つ
+        self.dwf.FDwfAnalogOutRunSet(self.hdwf, ch, c_double(repeat / frequency if repeat else 0))
+        self.dwf.FDwfAnalogOutRepeatSet(self.hdwf, ch, c_int(1 if repeat else 0))
+        self.dwf.FDwfAnalogOutIdleSet(self.hdwf, ch, c_int(1))  # DwfAnalogOutIdleOffset
+        if not self.dwf.FDwfAnalogOutConfigure(self.hdwf, ch, c_int(1)):
+            raise DeviceError("FDwfAnalogOutConfigure failed")
+
+    def wavegen_buffer_size(self, channel):
+        low, high = c_int(), c_int()
+        self.dwf.FDwfAnalogOutNodeDataInfo(self.hdwf, c_int(channel - 1), c_int(0), byref(low), byref(high))
+        return high.value
+
+    def dio_enable(self, mask):
+        self.dwf.FDwfDigitalIOOutputEnableSet(self.hdwf, c_int(mask))
+        self.dwf.FDwfDigitalIOConfigure(self.hdwf)
+
+    def dio_set(self, value):
+        self.dwf.FDwfDigitalIOOutputSet(self.hdwf, c_int(value))
+        # 変更を確定する
+        self.dwf.FDwfDigitalIOConfigure(self.hdwf)
+
+
+class EtchModel:
+    """電解エッチングの簡易モデル
+
+    ネックが細くなるにつれて電流が減少し、ネックが切れた瞬間（ドロップオフ）に
+    電流が急激に落ちる。進行度 progress は印加電圧の絶対値に比例して進み、1 でドロップオフ。
+    """
+
+    def __init__(self, conductance=2e-3, etch_time=60.0, reference_voltage=5.0,
+                 neck_exponent=0.5, dropoff_ratio=0.4, residual_ratio=0.05, noise=2e-5, seed=None):
+        self.conductance = conductance            # 初期コンダクタンス [A/V]
+        self.etch_time = etch_time                # reference_voltage を印加したときのドロップオフまでの時間 [s]
+        self.reference_voltage = reference_voltage
+        self.neck_exponent = neck_exponent        # 電流の減り方 (1-progress)**neck_exponent
+        self.dropoff_ratio = dropoff_ratio        # ドロップオフ直前の電流の割合
+        self.residual_ratio = residual_ratio      # ドロップオフ後に残る電流の割合
+        self.noise = noise                        # 電流ノイズの標準偏差 [A]
+        self.rng = np.random.default_rng(seed)
+        self.reset()
+
+    def reset(self):
+        self.progress = 0.0
+        self.dropped_at = None
+
+    def conductance_at(self, progress):
+        """進行度に対するコンダクタンス（配列可）"""
+        progress = np.asarray(progress, dtype=float)
+        remaining = np.clip(1.0 - progress, 0.0, 1.0)
+        g = self.conductance * (self.dropoff_ratio + (1 - self.dropoff_ratio) * remaining ** self.neck_exponent)
+        return np.where(progress >= 1.0, self.conductance * self.residual_ratio, g)
+
+    def rate(self, mean_abs_voltage):
+        """進行度の増加速度 [1/s]"""
+        return mean_abs_voltage / (self.reference_voltage * self.etch_time)
+
+
+class SimulatedBackend(DeviceBackend):
+    """電解エッチングを模擬する Analog Discovery
+
+    波形発生器 CHn の出力電圧に応じて models[n]（EtchModel）の電流を計算し、
+    amp_gain 倍した電圧をスコープ CHn に返す（1台で2本の探針を模擬できる）。
+    realtime=True のときは実機と同じくレコード時間だけ待つ。
+    """
+
+    name = "Simulated Analog Discovery"
+
+    def __init__(self, model=None, gain=100, clock=time.perf_counter, realtime=True, model2=None):
+        self.models = {
+            1: model if model is not None else EtchModel(),
+            2: model2 if model2 is not None else EtchModel(),
+        }
+        self.model = self.models[1]
+        self.gain = gain
+        self.clock = clock
+        self.realtime = realtime
+        self.sampling_frequency = 20e06
+        self.buffer_size = 8192
+        self.amplitude_range = 10.0
+        self.output = {1: (0.0, 0.0, 0.0), 2: (0.0, 0.0, 0.0)}   # (offset, amplitude, frequency)
+        self.custom = {1: None, 2: None}   # カスタム波形 (data, frequency, repeat, 開始時刻)
+        self.buffer_sizes = {1: 4096, 2: 4096}
+        self.dio = 0
+        self.dio_mask = 0
+        self.output_changed_at = None
+        self.dio_changed_at = None
+        self._lock = threading.Lock()
+        self._last_time = {1: None, 2: None}
+        self._rate = {1: 0.0, 2: 0.0}
+        self._stream = None
+
+    def open(self):
+        now = self.clock()
+        self._last_time = {1: now, 2: now}
+
+    def close(self):
+        pass
+
+    def scope_open(self, sampling_frequency=20e06, buffer_size=0, amplitude_range=10.0):
+        self.sampling_frequency = sampling_frequency
+        self.buffer_size = buffer_size if buffer_size > 0 else 8192
+        self.amplitude_range = amplitude_range
+
+    def _advance(self, now):
+        """前回からの経過時間分だけエッチングを進める"""
+        for channel, model in self.models.items():
+            last, rate = self._last_time[channel], self._rate[channel]
+            if last is None:
+                last = now
+            before = model.progress
+            model.progress = before + rate * (now - last)
+            if before < 1.0 <= model.progress:
+                model.dropped_at = last + (1.0 - before) / rate
+            self._last_time[channel] = now
+
+    def _update_rate(self, channel):
+        offset, amplitude, frequency = self.output[channel]
+        custom = self.custom[channel]
+        if custom is not None:
+            # 1周期の平均で近似する（1回だけ再生する波形も、再生中の平均の速さで進める）
+            mean_abs = float(np.mean(np.abs(offset + amplitude * custom[0])))
+        elif amplitude == 0:
+            mean_abs = abs(offset)
+        else:
+            phase = np.linspace(0, 2 * np.pi, 64, endpoint=False)
+            mean_abs = float(np.mean(np.abs(offset + amplitude * np.sin(phase))))
+        self._rate[channel] = self.models[channel].rate(mean_abs)
+
+    def voltage(self, t, channel=1):
+        """時刻 t（配列可）の波形発生器の出力電圧"""
+        offset, amplitude, frequency = self.output[channel]
+        t = np.asarray(t, dtype=float)
+        custom = self.custom[channel]
+        if custom is None:
+            return offset + amplitude * np.sin(2 * np.pi * frequency * t)
+        data, frequency, repeat, start = custom
+        cycles = np.maximum(t - start, 0.0) * frequency
+        voltage = offset + amplitude * data[(np.mod(cycles, 1.0) * len(data)).astype(int)]
+        if repeat:
+            voltage = np.where(cycles >= repeat, offset, voltage)
+        return voltage
+
+    def current(self, t, channel=1):
+        """時刻 t（配列可）の電流値 [A]"""
+        model = self.models[channel]
+        t = np.asarray(t, dtype=float)
+        voltage = self.voltage(t, channel)
+        progress = model.progress + self._rate[channel] * (t - self._last_time[channel])
+        current = model.conductance_at(progress) * voltage
+        if model.noise > 0:
+            current = current + model.rng.normal(0.0, model.noise, size=current.shape)
+        return current
+
+    def _scope(self, t, channel):
+        v = self.current(t, channel) * self.gain
+        return np.clip(v, -self.amplitude_range, self.amplitude_range)
+
+    def scope_record(self, channel=1):
+        duration = self.buffer_size / self.sampling_frequency
+        start = self.clock()
+        if self.realtime:
+            # 実機と同様にレコード時間だけ待つ
+            while self.clock() - start < duration:
+                time.sleep(min(duration, 1e-3))
+        with self._lock:
+            end = start + duration
+            self._advance(end)
+            t = end - (np.arange(self.buffer_size)[::-1]) / self.sampling_frequency
+            return self._scope(t, channel)
+
+    def stream_start(self, sampling_frequency, channel=1):
+        start = self.clock()
+        # (開始時刻, サンプリング周波数, 読み出し済みサンプル数, チャンネル)
+        self._stream = (start, float(sampling_frequency), 0, channel)
+        return start
+
+    def stream_read(self):
+        start, fs, count, channel = self._stream
+        with self._lock:
+            now = self.clock()
+            total = int((now - start) * fs)
+            if total <= count:
+                return (np.empty(0) if isinstance(channel, int) else np.empty((len(channel), 0))), 0
+            self._advance(now)
+            t = start + np.arange(count, total) / fs
+            self._stream = (start, fs, total, channel)
+            if isinstance(channel, int):
+                return self._scope(t, channel), 0
+            return np.array([self._scope(t, c) for c in channel]), 0
+
+    def stream_stop(self):
+        self._stream = None
+
+    def _set_output(self, channel, offset, amplitude, frequency, custom=None):
+        with self._lock:
+            now = self.clock()
+            self._advance(now)
+            self.output[channel] = (float(offset), float(amplitude), float(frequency))
+            if custom is not None:
+                data, repeat = custom
+                custom = (np.asarray(data, dtype=float), float(frequency), repeat, now)
+            self.custom[channel] = custom
+            self._update_rate(channel)
+            self.output_changed_at = self.clock()
+
+    def wavegen_dc(self, channel, offset):
+        self._set_output(channel, offset, 0.0, 0.0)
+
+    def wavegen_sine(self, channel, frequency, amplitude, offset):
+        self._set_output(channel, offset, amplitude, frequency)
+
+    def wavegen_custom(self, channel, data, frequency, amplitude, offset, repeat=0):
+        if len(data) > self.buffer_sizes[channel]:
+            raise DeviceError(f"Custom waveform longer than {self.buffer_sizes[channel]} samples")
+        self._set_output(channel, offset, amplitude, frequency, (data, repeat))
+
+    def wavegen_buffer_size(self, channel):
+        return self.buffer_sizes[channel]
+
+    def dio_enable(self, mask):
+        self.dio_mask = mask
+
+    def dio_set(self, value):
+        self.dio = value & self.dio_mask if self.dio_mask else value
+        self.dio_changed_at = self.clock()
+
+
+class RecordedBackend(DeviceBackend):
+    """ログ（datalog の .bin）に保存した信号を、取得したサンプルとして再生する
+
+    平均化前のデータ (.raw.bin) があればそれを、なければ平均化した電流に gain を掛けた電圧を使う。
+    サンプルは stream_start で指定したサンプリング周波数で1つずつ返し、末尾まで再生したら先頭に戻る。
+    realtime=False のときは時刻を待たずに、呼ばれるたびに block サンプルずつ返す（処理速度の測定用）。
+    出力の操作は記録するだけで、信号には影響しない。
+    """
+
+    name = "Recorded signal"
+
+    def __init__(self, path, gain=100, clock=time.perf_counter, realtime=True, block=4096):
+        self.path = path
+        self.gain = gain
+        self.clock = clock
+        self.realtime = realtime
+        self.block = block
+        self.values = None
+        self.output = {1: (0.0, 0.0, 0.0), 2: (0.0, 0.0, 0.0)}
+        self.dio = 0
+        self.output_changed_at = None
+        self.dio_changed_at = None
+        self._stream = None
+
+    def open(self):
+        from datalog import read_log, read_meta, raw_path
+        meta = read_meta(self.path)
+        if os.path.exists(raw_path(self.path)) and meta.get('raw_samples'):
+            self.values = np.array(read_log(self.path, raw=True)['value'])
+        else:
+            self.values = np.array(read_log(self.path)['value']) * self.gain
+        if len(self.values) == 0:
+            raise DeviceError(f"No samples in {self.path}")
+
+    def close(self):
+        pass
+
+    def scope_open(self, sampling_frequency=20e06, buffer_size=0, amplitude_range=10.0):
+        self.buffer_size = buffer_size if buffer_size > 0 else 8192
+
+    def _take(self, start, stop):
+        return np.take(self.values, np.arange(start, stop), mode='wrap')
+
+    def scope_record(self, channel=1):
+        return self._take(0, self.buffer_size)
+
+    def stream_start(self, sampling_frequency, channel=1):
+        start = self.clock()
+        self._stream = (start, float(sampling_frequency), 0, channel)
+        return start
+
+    def stream_read(self):
+        start, fs, count, channel = self._stream
+        if self.realtime:
+            total = int((self.clock() - start) * fs)
+        else:
+            total = count + self.block
+        if total <= count:
+            return (np.empty(0) if isinstance(channel, int) else np.empty((len(channel), 0))), 0
+        self._stream = (start, fs, total, channel)
+        values = self._take(count, total)
+        if isinstance(channel, int):
+            return values, 0
+        return np.tile(values, (len(channel), 1)), 0
+
+    def stream_stop(self):
+        self._stream = None
+
+    def wavegen_dc(self, channel, offset):
+        self.output[channel] = (float(offset), 0.0, 0.0)
+        self.output_changed_at = self.clock()
+
+    def wavegen_sine(self, channel, frequency, amplitude, offset):
+        self.output[channel] = (float(offset), float(amplitude), float(frequency))
+        self.output_changed_at = self.clock()
+
+    def wavegen_custom(self, channel, data, frequency, amplitude, offset, repeat=0):
+        self.output[channel] = (float(offset), float(amplitude), float(frequency))
+        self.output_changed_at = self.clock()
+
+    def dio_enable(self, mask):
+        pass
+
+    def dio_set(self, value):
+        self.dio = value
+        self.dio_changed_at = self.clock()
+
+
+BACKENDS = {
+    'wfsdk': WFSDKBackend,
+    'sim': SimulatedBackend,
+    'recorded': RecordedBackend,
+}
+
+
+def open_backend(kind='wfsdk', **kwargs):
+    """名前を指定してバックエンドを作成し、接続する"""
+    try:
+        backend = BACKENDS[kind](**kwargs)
+    except KeyError:
+        raise DeviceError(f"Unknown backend: {kind}")
+    backend.open()
+    return backend
+
+
+def enumerate_devices():
+    """接続されている Digilent のデバイスを列挙する: [{'index', 'name', 'serial', 'opened'}, ...]
+
+    WF_SDK の device.open は使用中でない最初のデバイスを開くので、
+    複数台を使うときは台数分だけ順に open すれば別々のデバイスにつながる。
+    """
+    from ctypes import cdll, create_string_buffer
+    dwf = cdll.dwf
+    count = c_int()
+    if not dwf.FDwfEnum(c_int(0), byref(count)):   # enumfilterAll
+        raise DeviceError("FDwfEnum failed")
+    devices = []
+    for i in range(count.value):
+        name, serial, opened = create_string_buffer(64), create_string_buffer(16), c_bool()
+        dwf.FDwfEnumDeviceName(c_int(i), name)
+        dwf.FDwfEnumSN(c_int(i), serial)
+        dwf.FDwfEnumDeviceIsOpened(c_int(i), byref(opened))
+        devices.append({'index': i, 'name': name.value.decode(), 'serial': serial.value.decode(),
+                        'opened': opened.value})
+    return devices
@@ -0,0 +1,367 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from backend import EtchModel, RecordedBackend, SimulatedBackend
+from acquisition import SampleRing, AcquisitionWorker, Averager
+from detectors import ThresholdDetector
+from stop import StopEngine
+from display import ScrollBuffer, MinMaxPyramid
+from datalog import LOG_DTYPE, LogWriter
+from station import StationHost
+
+
+# GUI と同じ初期値
+GAIN = 100
+SAMPLING_FREQUENCY = 10000
+AVG_WINDOW = 1000
+DATA_BUFFER_SIZE = 1000
+POLL_INTERVAL = 0.1
+
+
+class StageTimer:
+    """関数を包んで、呼び出しごとの処理時間 [s] を記録する"""
+
+    def __init__(self):
+        self.durations = []
+
+    def wrap(self, function):
+        durations = self.durations
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                durations.append(time.perf_counter() - start)
+        return timed
+
+
+def percentiles(durations):
+    """処理時間 [s] の分布を ms でまとめる"""
+    if len(durations) == 0:
+        return {'n': 0}
+    d = np.asarray(durations) * 1000
+    return {'n': int(len(d)), 'p50_ms': float(np.percentile(d, 50)), 'p99_ms': float(np.percentile(d, 99)),
+            'max_ms': float(d.max())}
+
+
+def make_device(source, seed=0, etch_time=60.0):
+    """'sim' ならシミュレータ、それ以外はログのパスとして再生する"""
+    if source == 'sim':
+        device = SimulatedBackend(EtchModel(etch_time=etch_time, seed=seed), gain=GAIN)
+    else:
+        device = RecordedBackend(source, gain=GAIN)
+    device.open()
+    device.scope_open(amplitude_range=10.0)
+    return device
+
+
+def bench_acquisition(source, seconds, sampling_frequency):
+    """取得スレッド・停止判定・GUI 側の平均化（acquire_and_average_data 相当）の処理時間"""
+    device = make_device(source)
+    device.wavegen_dc(1, 5.0)
+    ring = SampleRing(sampling_frequency * 10)
+    stream_read, stop_process, poll = StageTimer(), StageTimer(), StageTimer()
+    device.stream_read = stream_read.wrap(device.stream_read)
+    # しきい値 0 A では止まらないので、判定の処理だけを測れる
+    engine = StopEngine(device, window=AVG_WINDOW, gain=GAIN, threshold=0.0, alert=None)
+    worker = AcquisitionWorker(device, ring, sampling_frequency=sampling_frequency)
+    worker.add_listener(stop_process.wrap(engine.process))
+    averager = Averager(AVG_WINDOW)
+
+    def acquire_and_average(cursor):
+        times, values, cursor, _ = ring.read(cursor)
+        averager.feed(times, values)
+        return cursor
+    acquire_and_average = poll.wrap(acquire_and_average)
+
+    worker.start()
+    engine.arm()
+    start = time.perf_counter()
+    cursor = 0
+    while time.perf_counter() - start < seconds:
+        time.sleep(POLL_INTERVAL)
+        cursor = acquire_and_average(cursor)
+    worker.stop()
+    elapsed = time.perf_counter() - start
+    busy = sum(stream_read.durations) + sum(stop_process.durations)
+    return {
+        'samples_per_s': worker.samples / elapsed,
+        'lost': int(worker.lost),
+        'worker_busy_fraction': busy / elapsed,
+        'stream_read': percentiles(stream_read.durations),
+        'stop_process': percentiles(stop_process.durations),
+        'acquire_and_average': percentiles(poll.durations),
+    }
+
+
+def bench_stop(source, trials, sampling_frequency, threshold=2e-3, window=10):
+    """しきい値を下回ってから出力を止めるまでの時間
+
+    detect_to_cutoff: 判定から出力停止まで, crossing_to_cutoff: しきい値を下回った区間の最後のサンプルから出力停止まで,
+    dropoff_to_cutoff: シミュレータのドロップオフの瞬間から出力停止まで（取得の遅れと平均化の幅を含む）。
+    """
+    detect, crossing, dropoff = [], [], []
+    for trial in range(trials):
+        device = make_device(source, seed=trial, etch_time=0.3)
+        ring = SampleRing(sampling_frequency * 10)
+        engine = StopEngine(device, ThresholdDetector(threshold, window), window=window, gain=GAIN,
+                            threshold=threshold, alert=None)
+        worker = AcquisitionWorker(device, ring, sampling_frequency=sampling_frequency)
+        worker.add_listener(engine.process)
+        worker.start()
+        device.wavegen_dc(1, 5.0)
+        engine.arm()
+        deadline = time.perf_counter() + 5.0
+        while not engine.events and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        worker.stop()
+        if not engine.events:
+            continue
+        event = engine.events[0]
+        detect.append(event.cutoff_at - event.detected_at)
+        crossing.append(event.cutoff_at - event.sample_time)
+        dropped_at = getattr(getattr(device, 'model', None), 'dropped_at', None)
+        if dropped_at is not None:
+            dropoff.append(event.cutoff_at - dropped_at)
+    return {
+        'trials': trials,
+        'stopped': len(detect),
+        'detect_to_cutoff': percentiles(detect),
+        'crossing_to_cutoff': percentiles(crossing),
+        'dropoff_to_cutoff': percentiles(dropoff),
+    }
+
+
+def bench_watchdog(trials, sampling_frequency, timeout=0.1):
+    """取得スレッドを止めてから、ウォッチドッグが出力を止めるまでの時間
+
+    stall_to_cutoff は取得スレッドのリスナーで処理を止めた瞬間から出力停止まで（timeout を含む）、
+    beat_to_cutoff は最後の心拍から出力停止まで。どちらも最悪で timeout + 見張りの間隔 + 出力を止める時間。
+    """
+    device = make_device('sim', etch_time=3600.0)
+    events = []
+    host = StationHost(device, (1,), sampling_frequency=sampling_frequency, ring_seconds=2, gain=GAIN,
+                       avg_window=AVG_WINDOW, threshold=1e-4, watchdog_timeout=timeout, alert=None,
+                       on_stop=lambda index, event: events.append(event))
+    stalled = threading.Event()
+
+    def stall(times, values):
+        while stalled.is_set():
+            time.sleep(0.001)
+
+    host.worker.add_listener(stall)
+    host.start()
+    station = host.stations[0]
+    stall_to_cutoff, beat_to_cutoff = [], []
+    try:
+        for trial in range(trials):
+            station.start_etching(1000.0, 0.0, 5.0)
+            time.sleep(0.2)
+            if not station.etching:
+                continue
+            stalled_at = time.perf_counter()
+            stalled.set()
+            deadline = stalled_at + timeout + 5.0
+            while station.etching and time.perf_counter() < deadline:
+                time.sleep(0.0005)
+            stalled.clear()
+            if events and events[-1].detector == 'watchdog':
+                stall_to_cutoff.append(events[-1].cutoff_at - stalled_at)
+                beat_to_cutoff.append(events[-1].cutoff_at - events[-1].sample_time)
+            time.sleep(0.05)
+    finally:
+        host.close()
+    return {
+        'timeout_ms': timeout * 1000,
+        'trials': trials,
+        'stopped': len(stall_to_cutoff),
+        'stall_to_cutoff': percentiles(stall_to_cutoff),
+        'beat_to_cutoff': percentiles(beat_to_cutoff),
+    }
+
+
+def bench_redraw(sizes, frames):
+    """data_buffer_size ごとの、1回の表示更新（extend と setData と再描画）の処理時間"""
+    try:
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        from PyQt5.QtWidgets import QApplication
+        import pyqtgraph as pg
+    except ImportError as e:
+        return {'skipped': str(e)}
+    app = QApplication.instance() or QApplication([])
+    rng = np.random.default_rng(0)
+    results = {}
+    for size in sizes:
+        widget = pg.PlotWidget()
+        widget.resize(800, 300)
+        # GUI と同じ設定
+        widget.setClipToView(True)
+        widget.setDownsampling(auto=True, mode='peak')
+        curve = widget.plot(pen=pg.mkPen(color=(0, 0, 255), width=2))
+        widget.show()
+        buffer = ScrollBuffer(size, scale=1.0 / GAIN)
+        times = np.linspace(-size * AVG_WINDOW / SAMPLING_FREQUENCY, 0, size)
+        widget.setXRange(times[0], times[-1])
+        buffer.extend(rng.normal(size=size))
+        timer = StageTimer()
+
+        @timer.wrap
+        def redraw():
+            buffer.extend(rng.normal(size=10))
+            curve.setData(times, buffer.view())
+            widget.viewport().repaint()
+            app.processEvents()
+        redraw()
+        timer.durations.clear()
+        for _ in range(frames):
+            redraw()
+        widget.close()
+        results[str(size)] = percentiles(timer.durations)
+    return results
+
+
+def bench_pyramid(samples, block=100, max_points=2000, queries=100):
+    """MinMaxPyramid の追加の速さと、全体・一部を表示するときの取り出しの時間
+
+    GUI と同じく、ピラミッドには AVG_WINDOW サンプルごとに平均化した値を追加する。
+    query_screen は Follow latest で表示する幅（DATA_BUFFER_SIZE 点分。追加した範囲より長ければ全体）。
+    """
+    rng = np.random.default_rng(0)
+    pyramid = MinMaxPyramid()
+    interval = AVG_WINDOW / SAMPLING_FREQUENCY
+    times = np.arange(samples) * interval
+    values = rng.normal(size=samples)
+    start = time.perf_counter()
+    for k in range(0, samples, block):
+        pyramid.extend(times[k:k + block], values[k:k + block])
+    elapsed = time.perf_counter() - start
+    results = {'extend_samples_per_s': samples / elapsed}
+    end = times[-1]
+    screen = min(DATA_BUFFER_SIZE * interval, end)
+    for name, width in (('query_all', end), ('query_1pct', end / 100), ('query_screen', screen)):
+        timer = StageTimer()
+        query = timer.wrap(pyramid.query)
+        for t0 in rng.uniform(0, end - width, queries):
+            query(t0, t0 + width, max_points)
+        results[name] = percentiles(timer.durations)
+    return results
+
+
+def bench_logging(samples, block, raw):
+    """LogWriter の書き込み速度と、put の呼び出しにかかる時間"""
+    log_dir = tempfile.mkdtemp()
+    try:
+        writer = LogWriter(os.path.join(log_dir, 'bench.bin'), raw=raw)
+        writer.start()
+        put = StageTimer()
+        put_data = put.wrap(writer.put_raw if raw else writer.put)
+        times = np.arange(block) / SAMPLING_FREQUENCY
+        values = np.random.default_rng(0).normal(size=block)
+        start = time.perf_counter()
+        for k in range(samples // block):
+            put_data(times + k * block / SAMPLING_FREQUENCY, values)
+        writer.close()
+        elapsed = time.perf_counter() - start
+        return {
+            'bytes_per_s': writer.bytes_written / elapsed,
+            'samples_per_s': writer.bytes_written / LOG_DTYPE.itemsize / elapsed,
+            'put': percentiles(put.durations),
+        }
+    finally:
+        shutil.rmtree(log_dir, ignore_errors=True)
+
+
+def flatten(results, prefix=''):
+    """{'a': {'b': 1}} を {'a.b': 1} にする（比較用）"""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(results, baseline, tolerance):
+    """基準の結果より tolerance の割合以上悪くなった項目を返す
+
+    '_per_s' で終わる項目は大きいほど、'_ms' で終わる項目は小さいほど良いとする（ばらつきの大きい最大値は比べない）。
+    """
+    current, base = flatten(results), flatten(baseline)
+    regressions = []
+    for key, value in current.items():
+        old = base.get(key)
+        if not old:
+            continue
+        if key.endswith('_per_s') and value < old * (1 - tolerance):
+            regressions.append((key, old, value))
+        elif key.endswith('_ms') and not key.endswith('max_ms') and value > old * (1 + tolerance):
+            regressions.append((key, old, value))
+    return regressions
+
+
+def print_results(results):
+    for key, value in flatten(results).items():
+        print(f"{key:<48} {value:>14.4g}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tip Etcher benchmarks (headless)')
+    parser.add_argument('--source', default='sim', help="'sim'（シミュレータ）または再生するログ (.bin)")
+    parser.add_argument('--only', default='acquisition,stop,watchdog,redraw,pyramid,logging', help='実行するベンチマーク')
+    parser.add_argument('--seconds', type=float, default=5.0, help='取得のベンチマークの時間 [s]')
+    parser.add_argument('--sampling-frequency', type=int, default=SAMPLING_FREQUENCY)
+    parser.add_argument('--trials', type=int, default=10, help='停止のベンチマークの回数')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='表示のベンチマークの data_buffer_size')
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--pyramid-samples', type=int, default=5000000, help='表示のピラミッドに追加する（平均化した）値の数')
+    parser.add_argument('--log-samples', type=int, default=2000000)
+    parser.add_argument('--json', help='結果を JSON で保存する')
+    parser.add_argument('--compare', help='基準の結果 (JSON) と比べ、悪くなっていれば終了コード 1 で終わる')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    only = args.only.split(',')
+    results = {}
+    if 'acquisition' in only:
+        results['acquisition'] = bench_acquisition(args.source, args.seconds, args.sampling_frequency)
+    if 'stop' in only:
+        results['stop'] = bench_stop(args.source, args.trials, args.sampling_frequency)
+    if 'watchdog' in only:
+        results['watchdog'] = bench_watchdog(args.trials, args.sampling_frequency)
+    if 'redraw' in only:
+        results['redraw'] = bench_redraw([int(s) for s in args.sizes.split(',')], args.frames)
+    if 'pyramid' in only:
+        results['pyramid'] = bench_pyramid(args.pyramid_samples)
+    if 'logging' in only:
+        results['logging'] = bench_logging(args.log_samples, 1000, raw=False)
+        results['logging_raw'] = bench_logging(args.log_samples, 10000, raw=True)
+    print_results(results)
+
+    report = {
+        'timestamp': time.time(),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'source': args.source,
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f)['results'], args.tolerance)
+        for key, old, new in regressions:
+            print(f"REGRESSION {key}: {old:.4g} -> {new:.4g}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,284 @@
+import argparse
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+
+from datalog import meta_path, raw_path, read_log, read_meta
+from replay import find_logs, load_session
+from config import log_dir
+
+
+CATALOG_NAME = 'catalog.sqlite3'
+CATALOG_VERSION = 1
+
+# sessions の列（path 以外）。時刻はエッチング開始からの秒数
+COLUMNS = (
+    ('mtime', 'REAL'), ('size', 'INTEGER'),                     # 差分インデックス用
+    ('raw_path', 'TEXT'),
+    ('started_at', 'REAL'),                                      # UNIX 時刻
+    ('station', 'INTEGER'), ('device', 'TEXT'),
+    ('frequency', 'REAL'), ('amplitude', 'REAL'), ('dc_offset', 'REAL'),
+    ('stop_current_mA', 'REAL'), ('gain', 'REAL'), ('sampling_frequency', 'REAL'),
+    ('avg_window', 'INTEGER'), ('avg_method', 'TEXT'),
+    ('detector', 'TEXT'), ('detector_parameter', 'TEXT'),
+    ('recipe', 'TEXT'), ('adaptive', 'INTEGER'),
+    ('outcome', 'TEXT'),                                         # stop, manual_stop, recipe_end, none, legacy
+    ('samples', 'INTEGER'),
+    ('duration_s', 'REAL'),
+    ('peak_current_mA', 'REAL'), ('mean_current_mA', 'REAL'),
+    ('dropoff_s', 'REAL'),                                       # ドロップオフの時刻
+    ('stop_s', 'REAL'),                                          # 出力を止めた時刻
+    ('stop_latency_s', 'REAL'),                                  # ドロップオフ（見つからなければ判定したサンプル）から出力を止めるまで
+    ('cutoff_s', 'REAL'),                                        # 停止条件を満たしたサンプルから出力を止めるまで
+)
+NAMES = [name for name, _ in COLUMNS]
+OUTCOMES = ('stop', 'manual_stop', 'recipe_end')
+
+
+def catalog_path(log_dir):
+    return os.path.join(log_dir, CATALOG_NAME)
+
+
+def _float(value):
+    """GUI の入力（文字列）なども数値にする（変換できなければ None）"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _file_state(path):
+    """ログが変わったかどうかの目印（.bin と .json の新しい方の mtime と .bin のサイズ）"""
+    stat = os.stat(path)
+    mtime = stat.st_mtime
+    if os.path.exists(meta_path(path)) and not path.endswith('.log'):
+        mtime = max(mtime, os.path.getmtime(meta_path(path)))
+    return mtime, stat.st_size
+
+
+def summarize(path):
+    """1つのログから sessions の1行分の値を求める"""
+    session = load_session(path)
+    mtime, size = _file_state(path)
+    row = dict.fromkeys(NAMES)
+    row.update(mtime=mtime, size=size)
+    if path.endswith('.log'):
+        # 従来の CSV には測定条件がない
+        times, currents = session.times, session.values
+        row.update(outcome='legacy', started_at=float(times[0]) if len(times) else None)
+        start, end = session.start, times[-1] if len(times) else session.start
+    else:
+        meta = read_meta(path)
+        records = read_log(path)
+        times, currents = records['t'], records['value']
+        row.update({key: _float(meta.get(key)) for key in
+                    ('frequency', 'amplitude', 'dc_offset', 'stop_current_mA', 'gain', 'sampling_frequency')})
+        row.update(station=meta.get('station'), device=meta.get('device'),
+                   avg_window=meta.get('avg_window'), avg_method=meta.get('avg_method'),
+                   detector=meta.get('detector'), detector_parameter=meta.get('detector_parameter'),
+                   adaptive=int(bool(meta.get('adaptive_rates'))),
+                   raw_path=os.path.abspath(raw_path(path)) if meta.get('raw_samples') else None)
+        if row['avg_window'] is not None:
+            row['avg_window'] = int(_float(row['avg_window']) or 0) or None
+        if row['detector_parameter'] is not None:
+            row['detector_parameter'] = str(row['detector_parameter'])
+        events = meta.get('events', [])
+        starts = [e for e in events if e.get('name') == 'start']
+        recipe = meta.get('recipe') or (starts[0].get('recipe') if starts else None)
+        row['recipe'] = recipe if recipe is None or isinstance(recipe, str) else json.dumps(recipe)
+        start = session.start
+        row['started_at'] = meta['wall_start'] + (start - meta['monotonic_start'])
+        ends = [e for e in events if e.get('name') in OUTCOMES and e['t'] >= start]
+        if ends:
+            row['outcome'] = ends[0]['name']
+            end = ends[0]['t']
+        else:
+            row['outcome'] = 'none'
+            end = times[-1] if len(times) else start
+        stop = ends[0] if ends and ends[0]['name'] == 'stop' else None
+        if stop is not None:
+            # 停止のイベントの t は出力を止め終わった時刻、sample_time は停止条件を満たしたサンプルの時刻
+            row['stop_s'] = stop['t'] - start
+            detected = stop.get('sample_time')
+            if detected is not None:
+                row['cutoff_s'] = stop['t'] - detected
+            reference = session.dropoff if session.dropoff is not None else detected
+            if reference is not None:
+                row['stop_latency_s'] = stop['t'] - reference
+    i, j = np.searchsorted(times, start), np.searchsorted(times, end, side='right')
+    etching = np.abs(np.asarray(currents[i:j], dtype=float))
+    row['samples'] = int(len(times))
+    row['duration_s'] = float(end - start)
+    if len(etching):
+        row['peak_current_mA'] = float(etching.max()) * 1000
+        row['mean_current_mA'] = float(etching.mean()) * 1000
+    if session.dropoff is not None:
+        row['dropoff_s'] = session.dropoff - start
+    return row
+
+
+class Catalog:
+    """ログの一覧（SQLite）
+
+    セッションごとに測定条件・統計値・ログのパスを1行にまとめ、条件で絞り込めるようにする。
+    ログ自体は log/ に残したままで、ここにはその要約だけを持つ。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=10.0)
+        self.db.row_factory = sqlite3.Row
+        self._create()
+
+    def _create(self):
+        columns = ', '.join(f"{name} {kind}" for name, kind in COLUMNS)
+        with self.db:
+            self.db.execute(f"CREATE TABLE IF NOT EXISTS sessions (path TEXT PRIMARY KEY, {columns})")
+            for index in ('dc_offset, amplitude', 'stop_current_mA', 'started_at', 'outcome', 'frequency'):
+                name = 'sessions_' + index.replace(', ', '_')
+                self.db.execute(f"CREATE INDEX IF NOT EXISTS {name} ON sessions ({index})")
+            self.db.execute(f"PRAGMA user_version = {CATALOG_VERSION}")
+
+    def close(self):
+        self.db.close()
+
+    def add(self, path):
+        """ログを要約して登録する（同じパスがあれば置き換える）"""
+        row = summarize(path)
+        names = ['path'] + NAMES
+        with self.db:
+            self.db.execute(f"INSERT OR REPLACE INTO sessions ({', '.join(names)}) "
+                            f"VALUES ({', '.join('?' * len(names))})",
+                            [os.path.abspath(path)] + [row[name] for name in NAMES])
+        return row
+
+    def index(self, paths):
+        """ログを差分で登録する（変わっていないものは読まない）。(追加・更新した数, 削除した数) を返す
+
+        フォルダを指定した場合は、そこにあったログのうち消えたものを一覧からも消す。
+        """
+        known = {row['path']: (row['mtime'], row['size'])
+                 for row in self.db.execute("SELECT path, mtime, size FROM sessions")}
+        added = removed = 0
+        for path in find_logs(paths):
+            try:
+                if known.get(os.path.abspath(path)) == _file_state(path):
+                    continue
+                self.add(path)
+                added += 1
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Skipped {path}: {str(e)}")
+        for folder in (os.path.abspath(p) for p in paths if os.path.isdir(p)):
+            for path in known:
+                if os.path.dirname(path) == folder and not os.path.exists(path):
+                    with self.db:
+                        self.db.execute("DELETE FROM sessions WHERE path = ?", (path,))
+                    removed += 1
+        return added, removed
+
+    def query(self, where=(), params=(), order='started_at', limit=None):
+        """where（SQL の条件のリスト）をすべて満たすセッションを返す"""
+        sql = "SELECT * FROM sessions"
+        if where:
+            sql += " WHERE " + " AND ".join(f"({w})" for w in where)
+        sql += f" ORDER BY {order}"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return self.db.execute(sql, list(params)).fetchall()
+
+
+def record_session(path):
+    """閉じたログを、同じフォルダの一覧に登録する（失敗してもエッチングには影響させない）"""
+    try:
+        catalog = Catalog(catalog_path(os.path.dirname(os.path.abspath(path))))
+        try:
+            catalog.add(path)
+        finally:
+            catalog.close()
+    except (sqlite3.Error, OSError, ValueError, KeyError) as e:
+        print(f"Catalog error: {str(e)}")
+
+
+def _filters(args):
+    """query の引数を SQL の条件にする（数値は 1e-6 の幅で一致とみなす）"""
+    where, params = [], []
+    for column, value in (('dc_offset', args.offset), ('amplitude', args.amplitude),
+                          ('frequency', args.frequency), ('stop_current_mA', args.stop_current)):
+        if value is not None:
+            where.append(f"{column} BETWEEN ? AND ?")
+            params += [value - 1e-6, value + 1e-6]
+    if args.stop_below is not None:
+        where.append("stop_current_mA < ?")
+        params.append(args.stop_below)
+    if args.stop_above is not None:
+        where.append("stop_current_mA > ?")
+        params.append(args.stop_above)
+    for column, value in (('outcome', args.outcome), ('avg_method', args.method), ('detector', args.detector)):
+        if value is not None:
+            where.append(f"{column} = ?")
+            params.append(value)
+    if args.since:
+        where.append("started_at >= ?")
+        params.append(datetime.strptime(args.since, '%Y-%m-%d').timestamp())
+    if args.where:
+        where.append(args.where)
+    return where, params
+
+
+def _format(value, spec):
+    return format(value, spec) if value is not None else '-'.rjust(int(spec.split('.')[0]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ログの一覧（SQLite）を作って検索する')
+    parser.add_argument('--db', help=f'一覧のファイル（既定: log/{CATALOG_NAME}）')
+    sub = parser.add_subparsers(dest='command', required=True)
+    index = sub.add_parser('index', help='ログを一覧に登録する（変わっていないものは読み飛ばす）')
+    index.add_argument('logs', nargs='*', default=[log_dir], help='ログファイルまたはフォルダ（既定: log/）')
+    query = sub.add_parser('query', help='条件に合うセッションを表示する')
+    query.add_argument('--offset', type=float, help='DC offset [V]')
+    query.add_argument('--amplitude', type=float, help='AC amplitude [V]（DC のみは 0）')
+    query.add_argument('--frequency', type=float, help='周波数 [Hz]')
+    query.add_argument('--stop-current', type=float, help='Stop current [mA]')
+    query.add_argument('--stop-below', type=float, help='Stop current がこれ未満 [mA]')
+    query.add_argument('--stop-above', type=float, help='Stop current がこれより大きい [mA]')
+    query.add_argument('--outcome', choices=OUTCOMES + ('none', 'legacy'))
+    query.add_argument('--method', help='平均化の方法')
+    query.add_argument('--detector', help='検出方法')
+    query.add_argument('--since', help='この日以降（YYYY-MM-DD）')
+    query.add_argument('--where', help='SQL の条件（例: "stop_latency_s < 0.5"）')
+    query.add_argument('--limit', type=int)
+    query.add_argument('--json', action='store_true', help='JSON で出力する')
+    args = parser.parse_args()
+
+    db_path = args.db
+    if db_path is None:
+        folders = [p for p in getattr(args, 'logs', []) if os.path.isdir(p)]
+        db_path = catalog_path(folders[0] if folders else log_dir)
+    catalog = Catalog(db_path)
+    if args.command == 'index':
+        added, removed = catalog.index(args.logs)
+        total = catalog.db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        print(f"{added} indexed, {removed} removed, {total} sessions in {db_path}")
+    else:
+        where, params = _filters(args)
+        rows = catalog.query(where, params, limit=args.limit)
+        if args.json:
+            print(json.dumps([dict(row) for row in rows], indent=1))
+        else:
+            print(f"{'started':<16} {'V dc':>6} {'V ac':>6} {'f[Hz]':>7} {'stop[mA]':>8} {'outcome':<11} "
+                  f"{'dur[s]':>7} {'peak[mA]':>8} {'mean[mA]':>8} {'drop[s]':>7} {'lat[s]':>6}  file")
+            for r in rows:
+                started = datetime.fromtimestamp(r['started_at']).strftime('%Y-%m-%d %H:%M') \
+                    if r['started_at'] is not None else '-'
+                print(f"{started:<16} {_format(r['dc_offset'], '6.2f')} {_format(r['amplitude'], '6.2f')} "
+                      f"{_format(r['frequency'], '7.0f')} {_format(r['stop_current_mA'], '8.3f')} "
+                      f"{r['outcome'] or '-':<11} {_format(r['duration_s'], '7.1f')} "
+                      f"{_format(r['peak_current_mA'], '8.3f')} {_format(r['mean_current_mA'], '8.3f')} "
+                      f"{_format(r['dropoff_s'], '7.2f')} {_format(r['stop_latency_s'], '6.3f')}  "
+                      f"{os.path.basename(r['path'])}")
+        print(f"{len(rows)} sessions")
+    catalog.close()
@@ -0,0 +1,16 @@
+import os
+
+
+# 初期値
+amp_gain = 100  # アンプのゲイン v(t)=R*i(t)
+avg_number = 1000  # 平均数（1つの値にまとめるサンプル数）
+avg_method = '|mean|'  # 平均化の方法（acquisition.REDUCERS のキー、'lock-in' または 'band'）
+band_power_range = (100.0, 1000.0)  # Reduction が 'band' のときの帯域 [Hz]
+daq_base_interval = 100 #ms
+daq_sampling_frequency = 10000  # 連続取得のサンプリング周波数 [Hz]
+daq_adaptive_rates = (2000, 10000, 50000)  # Adaptive rate のときの (安定時, 通常, ドロップオフ直前) の周波数 [Hz]
+daq_ring_seconds = 10  # 取得データを保持するリングバッファの長さ [s]
+watchdog_timeout = 0.5  # 取得スレッドの心拍がこの秒数途切れたら、ウォッチドッグが出力を止める [s]（0: 使わない）
+guardian_timeout = 2.0  # --guardian のとき、プロセス全体が固まったとみなすまでの秒数 [s]
+data_buffer_size = 1000  # 表示しているグラフのデータ数
+log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'log')  # ログの保存先
@@ -0,0 +1,185 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from metrics import Metrics
+
+
+# ログ1行分: 時刻 [s]（time.perf_counter 基準の単調増加）と値
+LOG_DTYPE = np.dtype([('t', '<f8'), ('value', '<f8')])
+LOG_FORMAT_VERSION = 1
+
+
+def new_log_path(log_dir, suffix='.bin'):
+    """yyMMddHHmm.bin のパスを作る（同じ名前があれば _1, _2, ... をつける）"""
+    stamp = datetime.now().strftime('%y%m%d%H%M')
+    path = os.path.join(log_dir, stamp + suffix)
+    n = 1
+    while os.path.exists(path):
+        path = os.path.join(log_dir, f"{stamp}_{n}{suffix}")
+        n += 1
+    return path
+
+
+def meta_path(path):
+    return os.path.splitext(path)[0] + '.json'
+
+
+def raw_path(path):
+    return os.path.splitext(path)[0] + '.raw.bin'
+
+
+class LogWriter(threading.Thread):
+    """サンプルブロックをキューから受け取り、まとめてバイナリで書き込むスレッド
+
+    値は LOG_DTYPE の並びとして追記し、セッションの情報は同じ名前の .json に保存する。
+    ファイルへの書き出しは flush_interval 秒ごと、または flush_bytes たまったときにまとめて行う。
+    raw=True のときは平均化前のスコープのデータも .raw.bin に保存する。
+    書き出しの時間とバイト数は metrics（metrics.Metrics）に記録する。
+    """
+
+    def __init__(self, path, meta=None, flush_interval=1.0, flush_bytes=1 << 20, raw=False, metrics=None):
+        super().__init__(daemon=True)
+        self.path = path
+        self.raw = raw
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.meta = {
+            'format_version': LOG_FORMAT_VERSION,
+            'dtype': LOG_DTYPE.descr,
+            'value': 'current [A]',
+            # perf_counter の時刻を日時に直すための基準
+            'monotonic_start': time.perf_counter(),
+            'wall_start': time.time(),
+            'samples': 0,
+            'raw_samples': 0,
+            'events': [],     # エッチングの開始・停止など（時刻は perf_counter 基準）
+        }
+        self.meta.update(meta or {})
+        self.bytes_written = 0
+        self.metrics = metrics or Metrics()
+        self._queue = queue.SimpleQueue()
+
+    def put(self, times, values):
+        """平均化した値を書き込みキューに入れる（呼び出し側はブロックしない）"""
+        self._queue.put(('data', times, values))
+
+    def put_raw(self, times, values):
+        if self.raw:
+            self._queue.put(('raw', times, values))
+
+    def event(self, name, **fields):
+        """開始・停止などのイベントを記録する"""
+        fields.setdefault('t', time.perf_counter())
+        self._queue.put(('event', name, fields))
+
+    def close(self, **meta):
+        """残りを書き出してファイルを閉じる。meta はセッション情報に追記される"""
+        self._queue.put(('close', meta, None))
+        if self.is_alive():
+            self.join()
+
+    def _write(self, f, blocks, key):
+        count = sum(len(v) for _, v in blocks)
+        if count == 0:
+            return
+        t0 = time.perf_counter()
+        records = np.empty(count, dtype=LOG_DTYPE)
+        i = 0
+        for t, v in blocks:
+            records['t'][i:i + len(v)] = t
+            records['value'][i:i + len(v)] = v
+            i += len(v)
+        f.write(records.tobytes())
+        f.flush()
+        self.bytes_written += records.nbytes
+        self.meta[key] += count
+        self.metrics.log_flush.observe(time.perf_counter() - t0)
+        self.metrics.log_bytes.inc(records.nbytes)
+
+    def _write_meta(self):
+        with open(meta_path(self.path), 'w') as f:
+            json.dump(self.meta, f, indent=1)
+
+    def run(self):
+        self._write_meta()
+        data_file = open(self.path, 'ab')
+        raw_file = open(raw_path(self.path), 'ab') if self.raw else None
+        pending = {'data': [], 'raw': []}
+        pending_bytes = 0
+        last_flush = time.monotonic()
+        closing = False
+        try:
+            while not closing:
+                timeout = max(self.flush_interval - (time.monotonic() - last_flush), 0.0)
+                try:
+                    kind, a, b = self._queue.get(timeout=timeout)
+                    if kind == 'close':
+                        self.meta.update(a)
+                        closing = True
+                    elif kind == 'event':
+                        self.meta['events'].append(dict(b, name=a))
+                        self._write_meta()
+                    else:
+                        pending[kind].append((a, b))
+                        pending_bytes += len(b) * LOG_DTYPE.itemsize
+                except queue.Empty:
+                    pass
+                if closing or pending_bytes >= self.flush_bytes or time.monotonic() - last_flush >= self.flush_interval:
+                    self._write(data_file, pending['data'], 'samples')
+                    if raw_file:
+                        self._write(raw_file, pending['raw'], 'raw_samples')
+                    pending = {'data': [], 'raw': []}
+                    pending_bytes = 0
+                    last_flush = time.monotonic()
+        finally:
+            data_file.close()
+            if raw_file:
+                raw_file.close()
+            self.meta['wall_end'] = time.time()
+            self._write_meta()
+
+
+def read_meta(path):
+    with open(meta_path(path)) as f:
+        return json.load(f)
+
+
+def read_log(path, raw=False):
+    """ログをメモリマップで開く（LOG_DTYPE の配列）"""
+    if raw:
+        path = raw_path(path)
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=LOG_DTYPE)
+    return np.memmap(path, dtype=LOG_DTYPE, mode='r')
+
+
+def export_csv(path, csv_path=None):
+    """バイナリログを従来の CSV（Timestamp,Current）に変換する"""
+    meta = read_meta(path)
+    records = read_log(path)
+    csv_path = csv_path or os.path.splitext(path)[0] + '.csv'
+    wall = meta['wall_start'] + (records['t'] - meta['monotonic_start'])
+    with open(csv_path, 'w') as f:
+        f.write("Timestamp,Current\n")
+        for t, value in zip(wall, records['value']):
+            timestamp = datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+            f.write(f"{timestamp},{value:.6f}\n")
+    return csv_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tip Etcher log tools')
+    sub = parser.add_subparsers(dest='command', required=True)
+    export = sub.add_parser('export', help='バイナリログを CSV に変換する')
+    export.add_argument('logs', nargs='+')
+    args = parser.parse_args()
+    if args.command == 'export':
+        for log in args.logs:
+            print(export_csv(log))
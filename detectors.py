@@ -0,0 +1,232 @@
+import bisect
+import math
+from collections import deque
+
+import numpy as np
+
+from acquisition import Averager
+
+
+class Detector:
+    """ドロップオフのストリーミング判定
+
+    電流 [A] のサンプルを1つずつ update に渡し、停止すべきときに True を返す。
+    update は1サンプルあたり定数時間で、過去のサンプルを配列として持ち直さない。
+    holdoff 秒の間は電圧印加直後の過渡応答で誤動作しないよう判定しない。
+    parameter は GUI で編集する引数の (表示名, 既定値)。
+    """
+
+    name = ''
+    parameter = None
+
+    def __init__(self, holdoff=0.5):
+        self.holdoff = holdoff
+        self.reset()
+
+    def reset(self):
+        self._start = None
+
+    def _ready(self, t):
+        if self._start is None:
+            self._start = t
+        return t - self._start >= self.holdoff
+
+    def update(self, t, x):
+        raise NotImplementedError
+
+    def process(self, times, currents):
+        """ブロックを順に判定し、最初に停止条件を満たした (時刻, 電流) を返す（なければ None）"""
+        update = self.update
+        for t, x in zip(times.tolist(), currents.tolist()):
+            if update(t, x):
+                return t, x
+        return None
+
+
+class ThresholdDetector(Detector):
+    """avg_window サンプルごとに縮約した電流が threshold を下回ったら止める（従来の判定）"""
+
+    name = 'threshold'
+
+    def __init__(self, threshold=0.0, window=1, method='|mean|'):
+        self.threshold = threshold
+        self.averager = Averager(window, method)
+        super().__init__(holdoff=0.0)
+
+    def reset(self):
+        super().reset()
+        self.averager.reset()
+
+    def set_window(self, window):
+        self.averager.set_window(window)
+
+    def set_method(self, method):
+        self.averager.set_method(method)
+
+    def process(self, times, currents):
+        # 区間ごとにまとめて縮約できるので、1サンプルずつは回さない
+        reading_times, readings = self.averager.feed(times, currents)
+        below = np.flatnonzero(readings < self.threshold)
+        if len(below):
+            return reading_times[below[0]], readings[below[0]]
+        return None
+
+    def update(self, t, x):
+        return self.process(np.array([t]), np.array([x])) is not None
+
+
+class _Smoothed(Detector):
+    """時定数 tau の指数移動平均 (EMA) で平滑化した電流を使う判定の共通部分"""
+
+    def __init__(self, tau=0.005, holdoff=0.5):
+        self.tau = tau
+        super().__init__(holdoff)
+
+    def reset(self):
+        super().reset()
+        self.level = None
+        self._last_t = None
+
+    def smooth(self, t, x):
+        x = abs(x)
+        if self.level is None:
+            self.level = x
+        else:
+            a = 1.0 - math.exp(-(t - self._last_t) / self.tau) if self.tau > 0 else 1.0
+            self.level += a * (x - self.level)
+        self._last_t = t
+        return self.level
+
+
+class DropRateDetector(_Smoothed):
+    """平滑化した電流の減少率 −(dI/dt)/I [1/s] が rate を超えたら止める
+
+    ドロップオフでは電流が一気に落ちるので、ネックが細くなる間のゆっくりした減少とは区別できる。
+    減少率は電流で割っているので、探針ごとの電流の大きさによらない。
+    """
+
+    name = 'drop_rate'
+    parameter = ('Drop rate [1/s]', 20.0)
+
+    def __init__(self, rate=20.0, tau=0.005, slope_tau=0.005, holdoff=0.5):
+        self.rate = rate
+        self.slope_tau = slope_tau
+        super().__init__(tau, holdoff)
+
+    def reset(self):
+        super().reset()
+        self.slope = 0.0
+
+    def update(self, t, x):
+        last_t, last_level = self._last_t, self.level
+        level = self.smooth(t, x)
+        if last_level is None or t <= last_t:
+            return False
+        dt = t - last_t
+        a = 1.0 - math.exp(-dt / self.slope_tau)
+        self.slope += a * ((level - last_level) / dt - self.slope)
+        return self._ready(t) and level > 0 and -self.slope / level > self.rate
+
+
+class RelativeDropDetector(_Smoothed):
+    """平滑化した電流が、それまでのピークの percent % を下回ったら止める"""
+
+    name = 'relative_drop'
+    parameter = ('Drop to [% of peak]', 20.0)
+
+    def __init__(self, percent=20.0, tau=0.005, holdoff=0.5):
+        self.fraction = percent / 100.0
+        super().__init__(tau, holdoff)
+
+    def reset(self):
+        super().reset()
+        self.peak = 0.0
+
+    def update(self, t, x):
+        level = self.smooth(t, x)
+        if not self._ready(t):
+            return False
+        if level > self.peak:
+            self.peak = level
+        return level < self.fraction * self.peak
+
+
+class CusumDetector(Detector):
+    """下向きの CUSUM による変化点検出
+
+    ゆっくり追従するベースライン m（時定数 baseline_tau）からの相対的な下ずれ (m - |x|)/m を
+    drift を差し引いて積算し、h を超えたら止める。ノイズによる小さな下ずれは drift で打ち消される。
+    """
+
+    name = 'cusum'
+    parameter = ('CUSUM limit h', 5.0)
+
+    def __init__(self, h=5.0, drift=0.2, baseline_tau=0.05, holdoff=0.5):
+        self.h = h
+        self.drift = drift
+        self.baseline_tau = baseline_tau
+        super().__init__(holdoff)
+
+    def reset(self):
+        super().reset()
+        self.baseline = None
+        self.g = 0.0
+        self._last_t = None
+
+    def update(self, t, x):
+        x = abs(x)
+        if self.baseline is None:
+            self.baseline, self._last_t = x, t
+            return False
+        m = self.baseline
+        if m > 0:
+            self.g = max(0.0, self.g + (m - x) / m - self.drift)
+        # 変化を検出している間はベースラインを更新しない
+        if self.g == 0.0:
+            a = 1.0 - math.exp(-(t - self._last_t) / self.baseline_tau)
+            self.baseline += a * (x - m)
+        self._last_t = t
+        return self._ready(t) and self.g > self.h
+
+
+class RunningMedianDetector(Detector):
+    """直近 window サンプルの移動中央値が、それまでの最大値の percent % を下回ったら止める
+
+    気泡などによる単発のスパイクに強い。中央値はソート済みのリストを二分探索で更新する。
+    挿入と削除はリストをずらすので1サンプルあたり O(window) だが、ずらすのは C の memmove なので
+    既定の window=15 では 2 つのヒープ（O(log window)）より速い（1000 でも同程度）。
+    """
+
+    name = 'median'
+    parameter = ('Drop to [% of peak]', 20.0)
+
+    def __init__(self, percent=20.0, window=15, holdoff=0.5):
+        self.fraction = percent / 100.0
+        self.window = window
+        super().__init__(holdoff)
+
+    def reset(self):
+        super().reset()
+        self._fifo = deque()
+        self._sorted = []
+        self.peak = 0.0
+
+    def update(self, t, x):
+        x = abs(x)
+        self._fifo.append(x)
+        bisect.insort(self._sorted, x)
+        if len(self._fifo) > self.window:
+            old = self._fifo.popleft()
+            del self._sorted[bisect.bisect_left(self._sorted, old)]
+        if len(self._fifo) < self.window or not self._ready(t):
+            return False
+        median = self._sorted[len(self._sorted) // 2]
+        if median > self.peak:
+            self.peak = median
+        return median < self.fraction * self.peak
+
+
+DETECTORS = {
+    cls.name: cls
+    for cls in (ThresholdDetector, DropRateDetector, RelativeDropDetector, CusumDetector, RunningMedianDetector)
+}
@@ -0,0 +1,180 @@
+import numpy as np
+
+
+class ScrollBuffer:
+    """グラフ表示用の固定長バッファ
+
+    同じ値を長さ 2*size の配列の2か所に書き込むことで、最新 size 点が常に連続した領域になり、
+    描画にはコピーせずにビューを渡せる。スケーリングは書き込み時に一度だけ行う。
+    """
+
+    def __init__(self, size, scale=1.0):
+        self.size = int(size)
+        self.scale = scale
+        self._data = np.zeros(2 * self.size)
+        self._pos = 0          # 次に書き込む位置（= 最も古い点）
+        self.version = 0       # 書き込みのたびに増える（再描画が必要かの判定用）
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return
+        if len(values) > self.size:
+            values = values[-self.size:]
+        values = values * self.scale
+        n, size, pos = len(values), self.size, self._pos
+        first = min(n, size - pos)
+        self._data[pos:pos + first] = values[:first]
+        self._data[pos + size:pos + size + first] = values[:first]
+        if first < n:
+            self._data[:n - first] = values[first:]
+            self._data[size:size + n - first] = values[first:]
+        self._pos = (pos + n) % size
+        self.version += 1
+
+    def view(self):
+        """古い順に並んだ最新 size 点（読み取り専用のビュー）"""
+        view = self._data[self._pos:self._pos + self.size]
+        view.flags.writeable = False
+        return view
+
+
+class _Level:
+    """ピラミッドの1段: 区間ごとの (最初の時刻, 最小値, 最大値) のリングバッファ
+
+    区間には追加順の通し番号をつけ、容量を超えると古いものから上書きする。
+    """
+
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+        self.t = np.zeros(self.capacity)
+        self.lo = np.zeros(self.capacity)
+        self.hi = np.zeros(self.capacity)
+        self.count = 0         # これまでに追加した区間の総数
+
+    @property
+    def first(self):
+        """残っている最も古い区間の番号"""
+        return max(self.count - self.capacity, 0)
+
+    def append(self, t, lo, hi):
+        n = len(t)
+        if n > self.capacity:
+            t, lo, hi = t[-self.capacity:], lo[-self.capacity:], hi[-self.capacity:]
+            self.count += n - self.capacity
+            n = self.capacity
+        start = self.count % self.capacity
+        first = min(n, self.capacity - start)
+        for array, values in ((self.t, t), (self.lo, lo), (self.hi, hi)):
+            array[start:start + first] = values[:first]
+            array[:n - first] = values[first:]
+        self.count += n
+
+    def search(self, value):
+        """時刻が value 以上になる最初の区間の番号"""
+        first = self.first
+        start = first % self.capacity
+        stop = min(start + self.count - first, self.capacity)
+        k = np.searchsorted(self.t[start:stop], value)
+        if k == stop - start and start > 0 and self.count > self.capacity:
+            k += np.searchsorted(self.t[:start], value)
+        return first + int(k)
+
+    def read(self, i, j):
+        """番号 [i, j) の区間の (t, lo, hi)"""
+        p, n = i % self.capacity, j - i
+        if p + n <= self.capacity:
+            return self.t[p:p + n], self.lo[p:p + n], self.hi[p:p + n]
+        rest = p + n - self.capacity
+        return tuple(np.concatenate((a[p:], a[:rest])) for a in (self.t, self.lo, self.hi))
+
+
+class MinMaxPyramid:
+    """セッション全体の表示用の、最小値・最大値による多段の間引き
+
+    0段目は追加した値そのもの、k 段目は factor**k 点ごとの (最小値, 最大値) を持つ。
+    extend では各段の端数を持ち越しながら NumPy でまとめて上の段を作るので、1点あたりの処理は
+    段数によらず定数（全段合わせて factor/(factor-1) 倍）で済む。各段は capacity 区間のリングバッファなので
+    メモリは一定で、細かい段ほど古い部分から消え、粗い段がセッションの最初から残る。
+    k 段目の容量は capacity / factor**k 区間（最低 min_capacity）なので、全段合わせても 0段目の約 factor/(factor-1) 倍に収まる。
+    query は表示範囲の点数が max_points 以下になる最も細かい段を選ぶ（最小値・最大値を両方描くのでスパイクは消えない）。
+    """
+
+    def __init__(self, factor=4, capacity=1 << 18, levels=12, scale=1.0, min_capacity=1 << 10):
+        self.factor = int(factor)
+        self.scale = scale
+        self.min_capacity = min_capacity
+        self.levels = [_Level(max(capacity // self.factor ** k, min_capacity)) for k in range(levels)]
+        # k 段目にまだまとめていない、1つ下の段の区間
+        self._pending = [(np.empty(0), np.empty(0), np.empty(0)) for _ in range(levels)]
+        self.version = 0
+
+    def clear(self):
+        self.__init__(self.factor, self.levels[0].capacity, len(self.levels), self.scale, self.min_capacity)
+
+    @property
+    def count(self):
+        return self.levels[0].count
+
+    def start_of_last(self, n):
+        """最新の n 点のうち最も古い点の時刻（0段目に残っている点が n 点より少なければ残っている最も古い点）"""
+        level = self.levels[0]
+        i = max(level.count - n, level.first)
+        return float(level.t[i % level.capacity])
+
+    def extend(self, times, values):
+        if len(values) == 0:
+            return
+        times = np.asarray(times, dtype=float)
+        values = np.asarray(values, dtype=float) * self.scale
+        carry = (times, values, values)
+        self.levels[0].append(*carry)
+        f = self.factor
+        for k in range(1, len(self.levels)):
+            t, lo, hi = (np.concatenate((p, c)) for p, c in zip(self._pending[k], carry))
+            groups = len(t) // f
+            m = groups * f
+            self._pending[k] = (t[m:], lo[m:], hi[m:])
+            if groups == 0:
+                break
+            carry = (t[:m:f], lo[:m].reshape(groups, f).min(axis=1), hi[:m].reshape(groups, f).max(axis=1))
+            self.levels[k].append(*carry)
+        self.version += 1
+
+    def _tail(self, k):
+        """k 段目にまだ入っていない最新の部分（下の段の端数を古い順につないだもの）"""
+        if k == 0:
+            return np.empty(0), np.empty(0), np.empty(0)
+        parts = [self._pending[level] for level in range(k, 0, -1)]
+        return tuple(np.concatenate([part[a] for part in parts]) for a in range(3))
+
+    def query(self, t0, t1, max_points=2000):
+        """表示範囲 [t0, t1] の (times, values) を返す
+
+        1段目以上では区間ごとに最小値・最大値の2点を並べる。範囲の外側の1区間ずつも含めて、
+        線が表示範囲の端まで届くようにする。どの段でも max_points を超える場合は最も粗い段を使う。
+        """
+        chosen = None
+        last = len(self.levels) - 1
+        for k, level in enumerate(self.levels):
+            if level.count == 0:
+                break
+            # 表示範囲の始まりが上書きで消えている段は使わない（最も粗い段は使う）
+            if level.first > 0 and level.t[level.first % level.capacity] > t0 and k < last:
+                continue
+            i = max(level.search(t0) - 1, level.first)
+            j = min(level.search(t1) + 1, level.count)
+            tail = self._tail(k) if j == level.count else None
+            n = (j - i) + (0 if tail is None else len(tail[0]))
+            chosen = (k, i, j, tail)
+            if n * (1 if k == 0 else 2) <= max_points:
+                break
+        if chosen is None:
+            return np.empty(0), np.empty(0)
+        k, i, j, tail = chosen
+        t, lo, hi = self.levels[k].read(i, j)
+        if tail is not None and len(tail[0]):
+            t, lo, hi = (np.concatenate(pair) for pair in zip((t, lo, hi), tail))
+        if k == 0:
+            return t.copy(), lo.copy()
+        return np.repeat(t, 2), np.column_stack((lo, hi)).ravel()
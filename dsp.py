@@ -0,0 +1,258 @@
+import math
+import threading
+import time
+
+import numpy as np
+
+
+class LockIn:
+    """デジタルロックイン（I/Q 復調）
+
+    サンプルに基準信号 exp(-j2πft) を掛けて平均し、励起周波数 frequency の成分の振幅と位相、
+    および直流成分を区間ごとにまとめて求める。基準信号は区間の長さごとに一度だけ計算して使い回し、
+    区間ごとの違いは先頭サンプルの時刻の位相を掛けるだけにする。
+    区間には励起の周期がなるべく多く（できれば整数個）入るようにする。
+    """
+
+    def __init__(self, frequency, sampling_frequency):
+        self.sampling_frequency = sampling_frequency
+        self.set_frequency(frequency)
+        self.dc = self.amplitude = self.phase = np.empty(0)   # 最後に復調した区間の結果
+
+    def set_frequency(self, frequency):
+        self.frequency = float(frequency)
+        self._reference = {}
+
+    def set_sampling_frequency(self, sampling_frequency):
+        self.sampling_frequency = sampling_frequency
+        self._reference = {}
+
+    def _base(self, n):
+        """長さ n の基準信号（cos, sin）"""
+        reference = self._reference.get(n)
+        if reference is None:
+            phase = 2 * math.pi * self.frequency * np.arange(n) / self.sampling_frequency
+            reference = (np.cos(phase), np.sin(phase))
+            self._reference = {n: reference}
+        return reference
+
+    def demodulate(self, values, times):
+        """(区間数, n) のサンプルと時刻から、区間ごとの (直流成分, 振幅, 位相) を返す"""
+        values = np.atleast_2d(values)
+        times = np.atleast_2d(times)
+        n = values.shape[1]
+        dc = values.mean(axis=1)
+        cos, sin = self._base(n)
+        # 直流成分を除いてから復調する（区間が周期の整数倍でないときの漏れを抑える）
+        c = (values @ cos - dc * cos.sum()) * (2.0 / n)
+        s = (values @ sin - dc * sin.sum()) * (2.0 / n)
+        # 区間の先頭の時刻に合わせて位相を回す
+        start = 2 * math.pi * self.frequency * times[:, 0]
+        i = c * np.cos(start) - s * np.sin(start)
+        q = -(c * np.sin(start) + s * np.cos(start))
+        return dc, np.hypot(i, q), np.arctan2(q, i)
+
+    def reduce(self, values, times):
+        """Averager 用: 区間ごとの交流振幅を返す（位相と直流成分は属性に残す）"""
+        self.dc, self.amplitude, self.phase = self.demodulate(values, times)
+        return self.amplitude
+
+
+# スペクトルの窓関数
+WINDOWS = {
+    'hann': np.hanning,
+    'hamming': np.hamming,
+    'blackman': np.blackman,
+    'rect': np.ones,
+}
+
+
+def _rfft(x, out):
+    """out に rfft を書き込む（NumPy 1.x には out 引数がないので、そのときはコピーする）"""
+    try:
+        return np.fft.rfft(x, axis=-1, out=out)
+    except TypeError:
+        out[...] = np.fft.rfft(x, axis=-1)
+        return out
+
+
+class Spectrum:
+    """窓をかけた rfft による片側の電力スペクトル密度 [V²/Hz]（Welch 法）
+
+    長さ nfft で半分ずつ重ねた segments 個の区間をまとめて1回の rfft で変換し、平均する。
+    窓と作業用の配列は最初に確保して使い回すので、compute は新しい配列をほとんど作らない。
+    各区間の平均は引いてから変換する（DC の印加電流の漏れで低い周波数が埋もれないように）。
+    """
+
+    def __init__(self, sampling_frequency, nfft=4096, segments=8, window='hann'):
+        self.sampling_frequency = sampling_frequency
+        self.nfft = int(nfft)
+        self.segments = int(segments)
+        self.window_name = window
+        self.window = WINDOWS[window](self.nfft)
+        self.frequencies = np.fft.rfftfreq(self.nfft, 1.0 / sampling_frequency)
+        self.samples = (self.segments + 1) * (self.nfft // 2)   # compute に必要なサンプル数
+        # 窓のエネルギーで割り、片側にするため2倍する（直流とナイキスト周波数は除く）
+        self._scale = np.full(len(self.frequencies), 2.0 / (sampling_frequency * np.sum(self.window ** 2)))
+        self._scale[0] /= 2
+        if self.nfft % 2 == 0:
+            self._scale[-1] /= 2
+        self._scratch = np.empty((self.segments, self.nfft))
+        self._bins = np.empty((self.segments, len(self.frequencies)), dtype=complex)
+        self._power = np.empty((self.segments, len(self.frequencies)))
+        self.psd = np.zeros(len(self.frequencies))
+
+    def compute(self, values):
+        """最新の samples 個のサンプルから psd を求める（足りなければ None）"""
+        if len(values) < self.samples:
+            return None
+        hop = self.nfft // 2
+        segments = np.lib.stride_tricks.sliding_window_view(values[-self.samples:], self.nfft)[::hop]
+        scratch = self._scratch
+        np.subtract(segments, segments.mean(axis=1, keepdims=True), out=scratch)
+        scratch *= self.window
+        _rfft(scratch, self._bins)
+        np.abs(self._bins, out=self._power)
+        np.square(self._power, out=self._power)
+        np.mean(self._power, axis=0, out=self.psd)
+        self.psd *= self._scale
+        return self.psd
+
+    def band_power(self, low, high, psd=None):
+        """low〜high Hz の電力 [V²]（psd を積分する）"""
+        psd = self.psd if psd is None else psd
+        i, j = np.searchsorted(self.frequencies, (low, high))
+        return float(psd[i:j + 1].sum() * (self.frequencies[1] - self.frequencies[0]))
+
+
+class BandPower:
+    """Averager 用: 区間ごとの low〜high Hz の成分の実効値 [V]
+
+    avg_window サンプルの区間ごとに窓をかけた rfft を行い、帯域内の電力の平方根を返す
+    （気泡などの雑音の大きさを停止判定やグラフに使う）。窓と帯域の位置は区間の長さごとに一度だけ求める。
+    """
+
+    def __init__(self, low, high, sampling_frequency, window='hann'):
+        self.low = low
+        self.high = high
+        self.sampling_frequency = sampling_frequency
+        self.window_name = window
+        self._plan = None
+
+    def set_band(self, low, high):
+        self.low, self.high = low, high
+        self._plan = None
+
+    def set_sampling_frequency(self, sampling_frequency):
+        self.sampling_frequency = sampling_frequency
+        self._plan = None
+
+    def _get_plan(self, blocks, n):
+        plan = self._plan
+        if plan is None or plan[0] != n:
+            window = WINDOWS[self.window_name](n)
+            frequencies = np.fft.rfftfreq(n, 1.0 / self.sampling_frequency)
+            i, j = np.searchsorted(frequencies, (self.low, self.high))
+            j = max(j, i + 1)
+            # 片側の電力 [V²] にする係数（正弦波の振幅 A なら A²/2 になる）
+            scale = 2.0 / (n * np.sum(window ** 2))
+            plan = self._plan = (n, window, slice(i, j + 1), scale, None, None)
+        if plan[4] is None or plan[4].shape[0] < blocks:
+            scratch = np.empty((blocks, n))
+            bins = np.empty((blocks, n // 2 + 1), dtype=complex)
+            plan = self._plan = plan[:4] + (scratch, bins)
+        return plan
+
+    def reduce(self, values, times):
+        values = np.atleast_2d(values)
+        blocks, n = values.shape
+        _, window, band, scale, scratch, bins = self._get_plan(blocks, n)
+        scratch, bins = scratch[:blocks], bins[:blocks]
+        np.subtract(values, values.mean(axis=1, keepdims=True), out=scratch)
+        scratch *= window
+        _rfft(scratch, bins)
+        power = np.abs(bins[:, band]) ** 2
+        return np.sqrt(power.sum(axis=1) * scale)
+
+
+class SpectrumWorker(threading.Thread):
+    """リングバッファの最新のサンプルから、一定の間隔でスペクトルとスペクトログラムを求めるスレッド
+
+    取得スレッドとは別に動き、SampleRing を読むだけなので取得や停止判定を待たせない。
+    interval 秒ごとの時刻に合わせて計算するので、計算時間によって更新の間隔がずれない。
+    スペクトログラムは直近 history 回分の psd [dB] を固定長の配列に持つ。
+    取得の周波数が変わった場合（adaptive.RateScheduler）は、サンプルの時刻の間隔から求め直した周波数で
+    spectrum を作り直し、変わる前後をまたぐデータでは計算しない（スペクトログラムも消す）。
+    """
+
+    def __init__(self, ring, spectrum, interval=0.2, history=300, metrics=None):
+        super().__init__(daemon=True)
+        self.ring = ring
+        self.spectrum = spectrum
+        self.interval = interval
+        self.metrics = metrics
+        self.spectrogram = np.full((int(history), len(spectrum.frequencies)), np.nan)
+        self.rows = 0           # これまでに計算した回数
+        self._psd = np.zeros(len(spectrum.frequencies))
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        next_time = time.perf_counter()
+        while not self._stop_event.is_set():
+            next_time += self.interval
+            t0 = time.perf_counter()
+            self.update(*self.ring.latest(self.spectrum.samples))
+            if self.metrics is not None:
+                self.metrics.spectrum.observe(time.perf_counter() - t0)
+            # 遅れたときは追いつこうとせず、次の時刻から数え直す
+            delay = next_time - time.perf_counter()
+            if delay < 0:
+                next_time = time.perf_counter()
+                delay = 0
+            self._stop_event.wait(delay)
+
+    def update(self, times, values):
+        """最新のサンプルから psd を求め、スペクトログラムに1行足す（計算できなければ何もしない）"""
+        if not self._check_rate(times):
+            return
+        psd = self.spectrum.compute(values)
+        if psd is None:
+            return
+        with self._lock:
+            self._psd[:] = psd
+            row = self.spectrogram[self.rows % len(self.spectrogram)]
+            np.log10(np.maximum(psd, 1e-30), out=row)
+            row *= 10
+            self.rows += 1
+
+    def _check_rate(self, times):
+        """サンプルの間隔が一定で、spectrum の周波数と合っているか（合っていなければ作り直す）"""
+        if len(times) < 2:
+            return False
+        steps = np.diff(times)
+        if steps.max() > steps.min() * 1.01:
+            return False
+        fs = 1.0 / steps.mean()
+        spectrum = self.spectrum
+        if abs(fs - spectrum.sampling_frequency) > spectrum.sampling_frequency * 0.01:
+            fs = round(fs)
+            with self._lock:
+                self.spectrum = Spectrum(fs, spectrum.nfft, spectrum.segments, spectrum.window_name)
+                self.spectrogram[:] = np.nan
+                self._psd[:] = 0
+            return False
+        return True
+
+    def snapshot(self):
+        """(周波数, psd, 古い順に並べたスペクトログラム [dB]) のコピーを返す"""
+        with self._lock:
+            history = len(self.spectrogram)
+            k = self.rows % history
+            spectrogram = np.concatenate((self.spectrogram[k:], self.spectrogram[:k]))
+            return self.spectrum.frequencies, self._psd.copy(), spectrogram
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
@@ -0,0 +1,951 @@
+from PyQt5.QtWidgets import *
+from PyQt5.QtCore import QTimer, Qt, pyqtSignal
+import pyqtgraph as pg
+import numpy as np
+import sys
+import os
+import time
+from backend import DeviceError, WFSDKBackend, SimulatedBackend
+from acquisition import REDUCERS
+from detectors import DETECTORS
+from dsp import Spectrum, SpectrumWorker
+from display import ScrollBuffer, MinMaxPyramid
+from station import StationHost, StationManager
+from recipe import load_recipe
+from metrics import Metrics, MetricsServer
+from live import LiveServer
+from config import (amp_gain, avg_number, avg_method, daq_adaptive_rates, daq_base_interval, daq_sampling_frequency,
+                    daq_ring_seconds, data_buffer_size, guardian_timeout, log_dir)
+
+
+class AD2Monitor(QMainWindow):
+    # 停止判定は取得スレッドで行うので、GUI への通知はシグナル経由にする
+    etching_stopped = pyqtSignal(object)
+    recipe_finished = pyqtSignal()
+
+    def __init__(self, backend=None, live=None, watchdog_timeout=0.0, guardian=None):
+        super().__init__()
+        self.setWindowTitle('Tip Etcher: Chemical Etching Software for STM Probes')
+        self.setGeometry(100, 100, 1200, 600)
+        
+        print("Program starting initialization...")
+
+        # 初期設定値
+        self.avg_window = avg_number
+        self.base_interval = daq_base_interval
+        self.recipe = None  # 読み込んだレシピ（recipe.Step のリスト）。None なら入力欄の電圧を使う
+        self.is_logging = False
+        self.log_dir = log_dir
+        self.live = live    # 遠隔表示用の LiveServer（なければ None）
+        
+        # タイマーの初期化
+        print("Connecting timers...")
+        self.data_timer = QTimer(self)
+        self.display_timer = QTimer(self)
+        
+        # タイマーの接続
+        self.data_timer.timeout.connect(self.acquire_and_average_data)
+        self.display_timer.timeout.connect(self.update_graph_data)
+        
+        # データ取得の基本間隔を設定（100ms）
+        self.base_data_interval = 100  # ミリ秒
+        self.last_data_tick = None      # data_timer の遅れを測るための前回の時刻
+        self.shown_rate = None
+        # ※ここでタイマーは開始しない
+
+        try:
+            # デバイスへの接続（backend を渡さない場合は実機の WF_SDK を使う）
+            self.device = backend if backend is not None else WFSDKBackend()
+            self.device.open()
+            print(f"Connected to: {self.device.name}")
+
+            # 取得・停止判定・ログは StationHost にまとめてある
+            # （スコープ CH1 を ±10V、DIO の0番目を出力、CH1 を 0V に初期化する）
+            self.host = StationHost(self.device, (1,), sampling_frequency=daq_sampling_frequency,
+                                    ring_seconds=daq_ring_seconds, adaptive_rates=daq_adaptive_rates,
+                                    gain=amp_gain, avg_window=self.avg_window,
+                                    avg_method=avg_method, watchdog_timeout=watchdog_timeout, guardian=guardian,
+                                    guardian_timeout=guardian_timeout,
+                                    on_stop=lambda index, event: self.etching_stopped.emit(event),
+                                    on_recipe_end=lambda index: self.recipe_finished.emit())
+            self.station = self.host.stations[0]
+            self.metrics = self.station.metrics
+            self.device.wavegen_dc(2, 0)
+
+        except DeviceError as e:
+            QMessageBox.critical(self, "Error", str(e))
+            sys.exit(1)
+            
+        # データバッファの初期化
+        self.display_buffer_size = data_buffer_size
+        # 表示用の値はセッション全体を間引きのピラミッドに保持する（追加時に電流 (A) に換算しておく）。
+        # 横軸は起動からの秒数で、Follow latest のときは最新の display_buffer_size 点分を表示する
+        self.display_values = MinMaxPyramid(scale=1.0 / amp_gain)
+        self.session_start = time.perf_counter()
+        self.latest_time = 0.0
+        self.drawn_version = -1
+        self.drawn_range = None
+        self.update_time_axis()
+        # 停止判定は取得スレッド上で動き、しきい値を下回ったらすぐに出力を止める
+        self.etching_stopped.connect(self.stop_etching_process)
+        self.recipe_finished.connect(self.recipe_finished_process)
+        
+        # UIのセットアップ
+        self.setup_ui()
+        
+        # 初期設定のリフレッシュ
+        self.avg_slider.setValue(self.avg_window)  # averaging の初期値を UI に反映
+        self.avg_value_label.setText(f"Average Points: {self.avg_window}")
+        # Y Scale の初期値を反映
+        self.change_y_scale(self.y_scale_combo.currentText())
+
+        # 連続取得スレッドの開始（GUI とは独立にリングバッファへ書き込む）
+        self.host.start()
+
+        # タイマーの開始（UIセットアップ後に一度だけ開始）
+        print("Starting timers...")
+        self.display_timer.start(40)
+        self.data_timer.start(self.base_data_interval)
+        # 計測値のオーバーレイは1秒ごとに更新する
+        self.metrics_timer = QTimer(self)
+        self.metrics_timer.timeout.connect(self.update_metrics_overlay)
+        self.metrics_timer.start(1000)
+        print("Timers started")
+
+    def acquire_and_average_data(self):
+        """リングバッファから新しいサンプルを読み出し、指定回数ごとに平均化する"""
+        # 設定した間隔の 1.5 倍より遅れて呼ばれたら、GUI が詰まっているとみなして数える
+        now = time.perf_counter()
+        if self.last_data_tick is not None:
+            interval = now - self.last_data_tick
+            self.metrics.timer_interval.observe(interval)
+            if interval > 1.5 * self.data_timer.interval() / 1000:
+                self.metrics.timer_overruns.inc()
+        self.last_data_tick = now
+        try:
+            # 前回以降に取得されたサンプルを avg_window サンプルごとに縮約する
+            # （端数は次回に持ち越し、ログが有効なら書き込みスレッドに渡す）
+            avg_times, avg_values = self.station.poll()
+            rate = self.host.worker.sampling_frequency
+            if rate != self.shown_rate:
+                self.shown_rate = rate
+                self.rate_label.setText(f"Sampling: {rate / 1000:g} kHz")
+            if len(avg_values) == 0:
+                return
+            if self.live:
+                self.live.publish_samples(0, avg_times, avg_values / amp_gain)
+
+            # 最新の値を表示し、グラフ用バッファに追加
+            avg_value = avg_values[-1]
+            if self.station.averager.method == self.station.lockin.reduce:
+                phase = np.degrees(self.station.lockin.phase[-1])
+                self.current_avg_label.setText(f"Current Value: {avg_value:.3f} V (AC, {phase:.0f}°)")
+            elif self.station.averager.method == self.station.band.reduce:
+                self.current_avg_label.setText(f"Current Value: {avg_value:.3f} V (band RMS)")
+            else:
+                self.current_avg_label.setText(f"Current Value: {avg_value:.3f} V")
+            self.display_values.extend(avg_times - self.session_start, avg_values)
+            self.latest_time = avg_times[-1] - self.session_start
+
+        except DeviceError as e:
+            print(f"Data acquisition error: {str(e)}")
+
+    def update_time_axis(self):
+        """Follow latest で、表示する点が display_buffer_size 点に満たない間の幅（avg_window が変わったとき）
+
+        点がそろったあとの幅は、ピラミッドに入っているサンプルの時刻から求める
+        （Adaptive rate で取得の周波数が変わっても、最新の display_buffer_size 点を表示する）。
+        """
+        effective_interval = self.avg_window / self.host.worker.sampling_frequency
+        self.display_span = effective_interval * self.display_buffer_size
+        self.drawn_version = -1
+
+    def follow_latest(self, checked):
+        self.drawn_version = -1
+
+    def range_changed_manually(self, *args):
+        # ズームやパンをしたら最新への追従をやめる（Follow latest で戻す）
+        self.follow_check.setChecked(False)
+
+    def update_graph_data(self):
+        """表示の更新: 表示範囲に合った段をピラミッドから取り出して描く"""
+        try:
+            if self.follow_check.isChecked():
+                if self.display_values.count >= self.display_buffer_size:
+                    x_range = (self.display_values.start_of_last(self.display_buffer_size), self.latest_time)
+                else:
+                    x_range = (0.0, max(self.latest_time, self.display_span))
+                # 新しいデータがなければ描き直さない
+                if self.drawn_version == self.display_values.version and self.drawn_range == x_range:
+                    return
+                self.plot_widget.setXRange(*x_range, padding=0)
+            else:
+                x_range = tuple(self.plot_widget.viewRange()[0])
+                if self.drawn_version == self.display_values.version and self.drawn_range == x_range:
+                    return
+            self.drawn_version = self.display_values.version
+            self.drawn_range = x_range
+            t0 = time.perf_counter()
+            # 画面の横の画素数の2倍程度の点数にする（最小値・最大値を残すのでスパイクは消えない）
+            times, values = self.display_values.query(*x_range, max_points=2 * max(self.plot_widget.width(), 500))
+            self.plot_curve.setData(times, values)
+            self.metrics.render.observe(time.perf_counter() - t0)
+        except DeviceError as e:
+            print(f"Display update error: {str(e)}")
+
+    def update_metrics_overlay(self):
+        if self.metrics_overlay.isVisible():
+            self.metrics_overlay.setText(self.metrics.summary())
+            self.metrics_overlay.adjustSize()
+
+    def setup_ui(self):
+        central_widget = QWidget()
+        self.setCentralWidget(central_widget)
+        
+        layout = QVBoxLayout(central_widget)
+        layout.setSpacing(10)
+        layout.setContentsMargins(10, 10, 10, 10)
+        
+        # プロットウィジェットの設定
+        self.plot_widget = pg.PlotWidget()
+        self.plot_widget.setBackground('w')
+        self.plot_widget.showGrid(x=True, y=True)
+        self.plot_widget.setLabel('left', 'Tip Current', units='A')
+        self.plot_widget.setLabel('bottom', 'Time', units='s')
+        self.plot_widget.setYRange(-5, 5)
+        self.plot_widget.setXRange(0, self.display_span, padding=0)
+        # 縦軸は Y Scale で決めるので、マウスでは横方向だけズーム・パンする
+        # （間引きは MinMaxPyramid が表示範囲に合わせて行う）
+        self.plot_widget.setMouseEnabled(x=True, y=False)
+        self.plot_widget.getViewBox().sigRangeChangedManually.connect(self.range_changed_manually)
+        self.plot_curve = self.plot_widget.plot(pen=pg.mkPen(color=(0, 0, 255), width=2))
+        self.plot_widget.setMinimumHeight(300)
+        layout.addWidget(self.plot_widget)
+        # 各段階の処理時間と取りこぼしをグラフの左上に重ねて表示する
+        self.metrics_overlay = QLabel(self.plot_widget)
+        self.metrics_overlay.setStyleSheet(
+            "background-color: rgba(255, 255, 255, 200); color: #333333; font-size: 9pt; padding: 3px;")
+        self.metrics_overlay.move(60, 5)
+        self.metrics_overlay.setAttribute(Qt.WA_TransparentForMouseEvents)
+        layout.addWidget(self.create_spectrum_panel())
+        
+        # コントロールレイアウトの作成
+        controls_layout = QHBoxLayout()
+        controls_layout.addWidget(self.create_Yscale_group())
+        controls_layout.addWidget(self.create_avg_group())
+        controls_layout.addWidget(self.create_start_stop_group())
+        controls_layout.addWidget(self.create_tip_voltage_group())
+        controls_layout.addWidget(self.create_log_group())
+        layout.addLayout(controls_layout)
+
+    def create_spectrum_panel(self):
+        """スコープのデータのスペクトルとスペクトログラム（Show spectrum のときだけ計算する）"""
+        self.spectrum_worker = None
+        self.spectrum_panel = pg.GraphicsLayoutWidget()
+        self.spectrum_panel.setBackground('w')
+        self.spectrum_panel.setMinimumHeight(250)
+        self.spectrum_plot = self.spectrum_panel.addPlot(title='Spectrum')
+        self.spectrum_plot.setLabel('left', 'PSD', units='V²/Hz')
+        self.spectrum_plot.setLabel('bottom', 'Frequency', units='Hz')
+        self.spectrum_plot.setLogMode(y=True)
+        self.spectrum_plot.showGrid(x=True, y=True)
+        self.spectrum_curve = self.spectrum_plot.plot(pen=pg.mkPen(color=(0, 0, 255), width=1))
+        self.spectrogram_plot = self.spectrum_panel.addPlot(title='Spectrogram [dB]')
+        self.spectrogram_plot.setLabel('left', 'Frequency', units='Hz')
+        self.spectrogram_plot.setLabel('bottom', 'Time', units='s')
+        self.spectrogram_image = pg.ImageItem()
+        self.spectrogram_image.setColorMap(pg.colormap.get('viridis'))
+        self.spectrogram_plot.addItem(self.spectrogram_image)
+        self.spectrum_panel.hide()
+        self.spectrum_timer = QTimer(self)
+        self.spectrum_timer.timeout.connect(self.update_spectrum)
+        return self.spectrum_panel
+
+    def toggle_spectrum(self, checked):
+        self.spectrum_panel.setVisible(checked)
+        if checked:
+            spectrum = Spectrum(daq_sampling_frequency)
+            self.spectrum_worker = SpectrumWorker(self.station.ring, spectrum, metrics=self.metrics)
+            self.spectrum_worker.start()
+            self.spectrum_timer.start(int(self.spectrum_worker.interval * 1000))
+        else:
+            self.spectrum_timer.stop()
+            if self.spectrum_worker is not None:
+                self.spectrum_worker.stop()
+                self.spectrum_worker = None
+
+    def update_spectrum(self):
+        if self.spectrum_worker is None or self.spectrum_worker.rows == 0:
+            return
+        frequencies, psd, spectrogram = self.spectrum_worker.snapshot()
+        # 直流成分は除いて描く（対数表示で 0 にならないように）
+        self.spectrum_curve.setData(frequencies[1:], np.maximum(psd[1:], 1e-30))
+        finite = spectrogram[np.isfinite(spectrogram[:, 0])]
+        if len(finite):
+            levels = np.percentile(finite[:, 1:], (5, 99.5))
+            self.spectrogram_image.setImage(np.nan_to_num(spectrogram, nan=levels[0]), levels=levels)
+            interval = self.spectrum_worker.interval
+            self.spectrogram_image.setRect(-len(spectrogram) * interval, 0.0, len(spectrogram) * interval,
+                                           frequencies[-1])
+
+    def create_Yscale_group(self):
+        scale_group = QGroupBox("Y Scale")
+        scale_layout = QVBoxLayout()        
+        self.y_scale_combo = QComboBox()
+        self.y_scale_combo.addItems(["0.5 mA/div", "1 mA/div", "2 mA/div", "5 mA/div", "10 mA/div", "20 mA/div", "50 mA/div"])
+        self.y_scale_combo.setCurrentText("2 mA/div")
+        self.y_scale_combo.currentTextChanged.connect(self.change_y_scale)
+        scale_layout.addWidget(QLabel("Select Scale:"))
+        scale_layout.addWidget(self.y_scale_combo)
+        # オフにするとマウスでセッション全体を見返せる
+        self.follow_check = QCheckBox("Follow latest")
+        self.follow_check.setChecked(True)
+        self.follow_check.toggled.connect(self.follow_latest)
+        scale_layout.addWidget(self.follow_check)
+        self.spectrum_check = QCheckBox("Show spectrum")
+        self.spectrum_check.toggled.connect(self.toggle_spectrum)
+        scale_layout.addWidget(self.spectrum_check)
+        scale_group.setLayout(scale_layout)
+        return scale_group
+
+    def change_y_scale(self, text):
+        try:
+            mA_div = float(text.split()[0])
+        except ValueError:
+            return
+        A_div = mA_div / 1000.0
+        self.plot_widget.setYRange(-5 * A_div, 5 * A_div)
+
+    def create_tip_voltage_group(self):
+        tip_voltage_group = QGroupBox("Anode (tip) Voltage")
+        tip_voltage_group.setMinimumWidth(250)
+        layout = QVBoxLayout()
+        
+        # 周波数入力（Hz）
+        freq_layout = QHBoxLayout()
+        freq_layout.addWidget(QLabel("Frequency [Hz]:"))
+        self.frequency_input = QLineEdit()
+        self.frequency_input.setAlignment(Qt.AlignCenter)
+        self.frequency_input.setText("1000")
+        freq_layout.addWidget(self.frequency_input)
+        layout.addLayout(freq_layout)
+        
+        # 振幅入力（V）
+        amp_layout = QHBoxLayout()
+        amp_layout.addWidget(QLabel("Amplitude [V]:"))
+        self.amplitude_input = QLineEdit()
+        self.amplitude_input.setAlignment(Qt.AlignCenter)
+        self.amplitude_input.setText("1.0")
+        amp_layout.addWidget(self.amplitude_input)
+        layout.addLayout(amp_layout)
+        
+        # DCオフセット入力（V）
+        offset_layout = QHBoxLayout()
+        offset_layout.addWidget(QLabel("DC Offset [V]:"))
+        self.dc_offset_input = QLineEdit()
+        self.dc_offset_input.setAlignment(Qt.AlignCenter)
+        self.dc_offset_input.setText("0")
+        offset_layout.addWidget(self.dc_offset_input)
+        layout.addLayout(offset_layout)
+
+        # レシピ（パルスやランプなどを波形発生器のカスタム波形で出力する）
+        recipe_layout = QHBoxLayout()
+        self.recipe_label = QLabel("Recipe: None")
+        recipe_layout.addWidget(self.recipe_label)
+        recipe_load_button = QPushButton("Load")
+        recipe_load_button.clicked.connect(self.load_recipe)
+        recipe_clear_button = QPushButton("Clear")
+        recipe_clear_button.clicked.connect(self.clear_recipe)
+        recipe_layout.addWidget(recipe_load_button)
+        recipe_layout.addWidget(recipe_clear_button)
+        layout.addLayout(recipe_layout)
+
+        tip_voltage_group.setLayout(layout)
+        return tip_voltage_group
+
+    def load_recipe(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Load Recipe", "", "Recipe (*.json)")
+        if not path:
+            return
+        try:
+            self.recipe = load_recipe(path)
+        except (OSError, ValueError, TypeError) as e:
+            QMessageBox.warning(self, "Error", f"Invalid recipe: {str(e)}")
+            return
+        self.recipe_label.setText(f"Recipe: {os.path.basename(path)} ({len(self.recipe)} steps)")
+
+    def clear_recipe(self):
+        self.recipe = None
+        self.recipe_label.setText("Recipe: None")
+
+    def tip_voltage(self):
+        """入力欄の (周波数, 振幅, DC オフセット)"""
+        return (float(self.frequency_input.text()), float(self.amplitude_input.text()),
+                float(self.dc_offset_input.text()))
+
+    def create_log_group(self):
+        log_group = QGroupBox("Data Logging")
+        log_group.setMinimumWidth(200)
+        log_layout = QVBoxLayout()
+        
+        self.log_status_label = QLabel("Logging: OFF")
+        self.log_status_label.setAlignment(Qt.AlignCenter)
+               
+        self.log_button = QPushButton("Start Logging")
+        self.log_button.setCheckable(True)
+        self.log_button.clicked.connect(self.toggle_logging)
+        self.log_button.setStyleSheet("background-color: lightblue; color: white;")
+        
+        self.current_log_label = QLabel("Current log: None")
+        self.current_log_label.setAlignment(Qt.AlignCenter)
+
+        # 平均化前のスコープのデータも保存するか
+        self.log_raw_check = QCheckBox("Log raw waveform")
+        
+        log_layout.addWidget(self.log_status_label)
+        log_layout.addWidget(self.log_button)
+        log_layout.addWidget(self.log_raw_check)
+        log_layout.addWidget(self.current_log_label)
+        self.metrics_check = QCheckBox("Show metrics")
+        self.metrics_check.setChecked(True)
+        self.metrics_check.toggled.connect(self.metrics_overlay.setVisible)
+        log_layout.addWidget(self.metrics_check)
+        log_group.setLayout(log_layout)
+        return log_group
+
+    def create_avg_group(self):
+        avg_group = QGroupBox("Average Control")
+        avg_group.setMinimumWidth(200)
+        avg_layout = QVBoxLayout()
+        
+        self.avg_slider = QSlider(Qt.Horizontal)
+        self.avg_slider.setRange(1, daq_sampling_frequency)  # 最大 1 秒分
+        self.avg_slider.setValue(self.avg_window)
+        self.avg_value_label = QLabel(f"Average Points: {self.avg_window}")
+        self.avg_value_label.setAlignment(Qt.AlignCenter)
+
+        # 平均化の方法
+        method_layout = QHBoxLayout()
+        method_layout.addWidget(QLabel("Reduction:"))
+        self.avg_method_combo = QComboBox()
+        self.avg_method_combo.addItems(list(REDUCERS) + ['lock-in', 'band'])
+        self.avg_method_combo.setCurrentText(avg_method)
+        self.avg_method_combo.currentTextChanged.connect(self.update_avg_method)
+        method_layout.addWidget(self.avg_method_combo)
+        
+        self.current_avg_label = QLabel("Current Value: 0.000 V")
+        self.current_avg_label.setAlignment(Qt.AlignCenter)
+        font = self.current_avg_label.font()
+        font.setPointSize(12)
+        font.setBold(True)
+        self.current_avg_label.setFont(font)
+        
+        self.avg_slider.valueChanged.connect(self.update_avg_window)
+        avg_layout.addWidget(self.avg_value_label)
+        avg_layout.addWidget(self.avg_slider)
+        avg_layout.addLayout(method_layout)
+        # ドロップオフが近づいたら取得の周波数を上げ、安定しているときは下げる
+        rate_layout = QHBoxLayout()
+        self.adaptive_check = QCheckBox("Adaptive rate")
+        self.adaptive_check.toggled.connect(self.host.set_adaptive)
+        self.rate_label = QLabel(f"Sampling: {daq_sampling_frequency / 1000:g} kHz")
+        rate_layout.addWidget(self.adaptive_check)
+        rate_layout.addWidget(self.rate_label)
+        avg_layout.addLayout(rate_layout)
+        avg_layout.addWidget(self.current_avg_label)
+        avg_group.setLayout(avg_layout)
+        return avg_group
+
+    def create_start_stop_group(self):
+        """エッチング開始・停止のUIを作成：Stop current, Etching Start/Stopボタン"""
+        start_stop_group = QGroupBox("Start / Stop")
+        start_stop_group.setMinimumWidth(250)
+        layout = QVBoxLayout()
+
+        # Stop current 入力（mA）
+        stop_current_layout = QHBoxLayout()
+        stop_current_layout.addWidget(QLabel("Stop current [mA]:"))
+        self.stop_current_input = QLineEdit()
+        self.stop_current_input.setAlignment(Qt.AlignCenter)
+        self.stop_current_input.setText("0")
+        self.stop_current_input.textChanged.connect(self.update_stop_threshold)
+        stop_current_layout.addWidget(self.stop_current_input)
+        layout.addLayout(stop_current_layout)
+
+        # 停止判定の方法と、その方法のパラメータ
+        detector_layout = QHBoxLayout()
+        detector_layout.addWidget(QLabel("Detector:"))
+        self.detector_combo = QComboBox()
+        self.detector_combo.addItems(list(DETECTORS))
+        detector_layout.addWidget(self.detector_combo)
+        layout.addLayout(detector_layout)
+
+        detector_param_layout = QHBoxLayout()
+        self.detector_param_label = QLabel("Parameter:")
+        detector_param_layout.addWidget(self.detector_param_label)
+        self.detector_param_input = QLineEdit()
+        self.detector_param_input.setAlignment(Qt.AlignCenter)
+        self.detector_param_input.editingFinished.connect(self.update_detector)
+        detector_param_layout.addWidget(self.detector_param_input)
+        layout.addLayout(detector_param_layout)
+        self.detector_combo.currentTextChanged.connect(self.change_detector)
+        self.change_detector(self.detector_combo.currentText())
+
+        # ボタンレイアウト：Etching Start / Etching Stop
+        button_layout = QHBoxLayout()
+        self.etching_start_button = QPushButton("Start")
+        self.etching_start_button.clicked.connect(self.start_etching)
+        self.etching_start_button.setStyleSheet(
+            "QPushButton { background-color: green; color: white; } "
+            "QPushButton:disabled { background-color: lightgray; color: gray; }"
+        )
+        self.etching_stop_button = QPushButton("Stop")
+        self.etching_stop_button.clicked.connect(self.stop_etching)
+        self.etching_stop_button.setStyleSheet(
+            "QPushButton { background-color: red; color: white; } "
+            "QPushButton:disabled { background-color: lightgray; color: gray; }"
+        )
+        self.etching_start_button.setEnabled(True)
+        self.etching_stop_button.setEnabled(False)
+        
+        button_layout.addWidget(self.etching_start_button)
+        button_layout.addWidget(self.etching_stop_button)
+        layout.addLayout(button_layout)
+
+        # 前回の停止にかかった時間（判定から出力停止まで）
+        self.stop_latency_label = QLabel("Stop latency: -")
+        self.stop_latency_label.setAlignment(Qt.AlignCenter)
+        layout.addWidget(self.stop_latency_label)
+
+        start_stop_group.setLayout(layout)
+        return start_stop_group
+
+    def start_etching(self):
+        #エッチング開始：ユーザ入力に基づいてCH1の出力を更新
+        print("start_etching called")
+        try:
+            voltage = self.tip_voltage()
+        except ValueError:
+            QMessageBox.warning(self, "Error", "Invalid CH1 voltage settings.")
+            return
+        try:
+            # CH1 の出力を入力値（またはレシピ）に基づいて更新し、DIO にゼロを送ってから停止判定を始める
+            if self.recipe:
+                self.station.start_recipe(self.recipe)
+            else:
+                self.station.start_etching(*voltage)
+            self.etching_start_button.setEnabled(False)
+            self.etching_stop_button.setEnabled(True)
+            self.publish_state()
+        except Exception as e:
+            QMessageBox.warning(self, "Error", f"Failed to start etching: {str(e)}")
+
+    def publish_state(self):
+        """遠隔表示に現在の設定と状態を送る"""
+        if not self.live:
+            return
+        try:
+            threshold = float(self.stop_current_input.text()) * 0.001
+        except ValueError:
+            threshold = 0.0
+        self.live.publish_state(0, name=self.station.name, etching=self.station.etching, threshold=threshold,
+                                avg_window=self.avg_window, avg_method=self.avg_method_combo.currentText(),
+                                detector=self.detector_combo.currentText(),
+                                frequency=self.frequency_input.text(), amplitude=self.amplitude_input.text(),
+                                dc_offset=self.dc_offset_input.text(),
+                                recipe=[step.to_dict() for step in self.recipe] if self.recipe else None)
+
+    def update_stop_threshold(self, text):
+        """Stop current の編集時にしきい値を更新する（判定のたびに入力欄を読まない）"""
+        try:
+            # Stop current 入力欄は mA なので、A に変換
+            self.station.configure(threshold=float(text) * 0.001)
+        except ValueError:
+            self.station.configure(threshold=0.0)  # 入力が無効な場合は 0 A とする
+        self.publish_state()
+
+    def change_detector(self, name):
+        """停止判定の方法を切り替え、パラメータ欄をその方法の既定値にする"""
+        parameter = DETECTORS[name].parameter
+        # しきい値による判定は Stop current 欄を使う
+        self.stop_current_input.setEnabled(parameter is None)
+        self.detector_param_input.setEnabled(parameter is not None)
+        if parameter is None:
+            self.detector_param_label.setText("Parameter:")
+            self.detector_param_input.setText("")
+        else:
+            self.detector_param_label.setText(f"{parameter[0]}:")
+            self.detector_param_input.setText(str(parameter[1]))
+        self.update_detector()
+
+    def update_detector(self):
+        cls = DETECTORS[self.detector_combo.currentText()]
+        if cls.parameter is None:
+            # しきい値・平均化の幅・縮約の方法は、切り替え時に StopEngine の設定が引き継がれる
+            detector = cls()
+        else:
+            try:
+                detector = cls(float(self.detector_param_input.text()))
+            except ValueError:
+                QMessageBox.warning(self, "Error", "Invalid detector parameter.")
+                return
+        self.station.configure(detector=detector)
+
+    def recipe_finished_process(self):
+        # レシピが最後まで終わって止まったとき（出力は取得スレッドで止めてある）
+        print("Recipe finished")
+        self.etching_start_button.setEnabled(True)
+        self.etching_stop_button.setEnabled(False)
+        self.publish_state()
+
+    def stop_etching_process(self, event):
+        #エッチング停止プロセス：出力の停止とビープ音は StopEngine が済ませているので、表示だけを更新する
+        print("stop_etching_process called")
+        print("Stop detected by {} at {:.6f} A (threshold {:.6f} A); stopped etching".format(event.detector, event.current, event.threshold))
+        latency_ms = (event.cutoff_at - event.detected_at) * 1000
+        print(f"Stop latency: {latency_ms:.3f} ms (detection to cutoff)")
+        self.stop_latency_label.setText(f"Stop latency: {latency_ms:.3f} ms")
+        self.etching_start_button.setEnabled(True)
+        self.etching_stop_button.setEnabled(False)
+        if self.live:
+            self.live.publish_stop(0, event)
+
+    def stop_etching(self):
+        """エッチング停止：CH1 の出力をすべて 0V にする"""
+        print("stop_etching called")
+        try:
+            self.station.stop_etching()
+            self.etching_start_button.setEnabled(True)
+            self.etching_stop_button.setEnabled(False)
+            self.publish_state()
+        except Exception as e:
+            QMessageBox.warning(self, "Error", f"Failed to stop etching: {str(e)}")
+
+    def update_avg_window(self, value):
+        self.avg_window = value
+        self.avg_value_label.setText(f"Average Points: {value}")
+        self.station.configure(window=value)
+        self.update_time_axis()
+        self.publish_state()
+
+    def update_avg_method(self, name):
+        self.station.configure(method=name)
+
+    def toggle_logging(self, checked):
+        if checked:
+            try:
+                log_path = self.station.start_logging(self.log_dir, meta={
+                    'avg_window': self.avg_window,
+                    'avg_method': self.avg_method_combo.currentText(),
+                    'frequency': self.frequency_input.text(),
+                    'amplitude': self.amplitude_input.text(),
+                    'dc_offset': self.dc_offset_input.text(),
+                    'stop_current_mA': self.stop_current_input.text(),
+                    'detector': self.detector_combo.currentText(),
+                    'detector_parameter': self.detector_param_input.text(),
+                }, raw=self.log_raw_check.isChecked(), suffix='.bin')
+                log_filename = os.path.basename(log_path)
+                self.log_raw_check.setEnabled(False)
+                self.is_logging = True
+                self.log_status_label.setText("Logging: ON")
+                self.log_button.setText("Stop Logging")
+                # ログボタンのスタイルを青色に（有効時も停止時も青）
+                self.log_button.setStyleSheet("background-color: blue; color: white;")
+                self.current_log_label.setText(f"Current log: {log_filename}")
+            except ValueError as e:
+                self.log_button.setChecked(False)
+                QMessageBox.warning(self, "Error", str(e))
+                return
+        else:
+            self.station.stop_logging()
+            self.log_raw_check.setEnabled(True)
+            self.is_logging = False
+            self.log_status_label.setText("Logging: OFF")
+            self.log_button.setText("Start Logging")
+            # ログボタンのスタイルも青色に設定
+            self.log_button.setStyleSheet("background-color: lightblue; color: white;")
+            self.current_log_label.setText("Current log: None")
+
+    def closeEvent(self, event):
+        if self.spectrum_worker is not None:
+            self.spectrum_worker.stop()
+        try:
+            self.device.wavegen_dc(2, 0)
+            # 取得を止め、ログを閉じて CH1 と DIO を 0 にしてから切断する
+            self.host.close()
+        except DeviceError as e:
+            print(f"Close error: {str(e)}")
+        event.accept()
+
+class StationPane(QGroupBox):
+    """複数ステーション表示の1枠（グラフと開始・停止ボタン）"""
+
+    def __init__(self, station, window):
+        super().__init__(f"Station {station.index + 1}: {station.name}")
+        self.station = station
+        self.window = window
+        self.values = ScrollBuffer(data_buffer_size, scale=1.0 / amp_gain)
+        self.times = ScrollBuffer(data_buffer_size)   # 各点の時刻（横軸は最新の点からの秒数）
+        self.filled = 0
+        self.drawn_version = -1
+        # process モードでは描画の時間だけがこのプロセスの計測値になる
+        self.metrics = getattr(station, 'metrics', None) or Metrics(station=str(station.index))
+        layout = QVBoxLayout(self)
+        self.plot_widget = pg.PlotWidget()
+        self.plot_widget.setBackground('w')
+        self.plot_widget.showGrid(x=True, y=True)
+        self.plot_widget.setLabel('left', 'Tip Current', units='A')
+        self.plot_widget.setLabel('bottom', 'Time', units='s')
+        self.plot_widget.setClipToView(True)
+        self.plot_widget.setDownsampling(auto=True, mode='peak')
+        self.plot_curve = self.plot_widget.plot(pen=pg.mkPen(color=(0, 0, 255), width=2))
+        layout.addWidget(self.plot_widget)
+        self.value_label = QLabel("Current Value: 0.000 V")
+        self.value_label.setAlignment(Qt.AlignCenter)
+        layout.addWidget(self.value_label)
+        button_layout = QHBoxLayout()
+        self.start_button = QPushButton("Start")
+        self.start_button.clicked.connect(lambda: self.window.start_station(self))
+        self.start_button.setStyleSheet("background-color: green; color: white;")
+        self.stop_button = QPushButton("Stop")
+        self.stop_button.clicked.connect(lambda: self.window.stop_station(self))
+        self.stop_button.setStyleSheet("background-color: red; color: white;")
+        self.stop_button.setEnabled(False)
+        self.log_check = QCheckBox("Log")
+        self.log_check.toggled.connect(lambda checked: self.window.toggle_station_logging(self, checked))
+        button_layout.addWidget(self.start_button)
+        button_layout.addWidget(self.stop_button)
+        button_layout.addWidget(self.log_check)
+        layout.addLayout(button_layout)
+        self.status_label = QLabel("Idle")
+        self.status_label.setAlignment(Qt.AlignCenter)
+        layout.addWidget(self.status_label)
+
+    def set_etching(self, etching):
+        self.start_button.setEnabled(not etching)
+        self.stop_button.setEnabled(etching)
+
+
+class MultiStationWindow(QMainWindow):
+    """複数のステーション（デバイス・チャンネル）を並べて表示する
+
+    電圧・平均化・停止判定の設定は全ステーション共通で、Start 時にそのステーションへ送る。
+    停止判定と出力の停止は各ステーションの取得スレッド（または子プロセス）で行い、
+    この画面は StationManager.poll で表示を更新するだけにする。
+    """
+
+    def __init__(self, manager, live=None):
+        super().__init__()
+        self.setWindowTitle('Tip Etcher: Multi-Station')
+        self.setGeometry(100, 100, 1400, 800)
+        self.manager = manager
+        self.live = live
+        self.avg_window = avg_number
+        self.log_dir = log_dir
+
+        central_widget = QWidget()
+        self.setCentralWidget(central_widget)
+        layout = QVBoxLayout(central_widget)
+        grid = QGridLayout()
+        columns = 2 if len(manager.stations) > 1 else 1
+        self.panes = []
+        for k, station in enumerate(manager.stations):
+            pane = StationPane(station, self)
+            grid.addWidget(pane, k // columns, k % columns)
+            self.panes.append(pane)
+        layout.addLayout(grid)
+        layout.addWidget(self.create_settings_group())
+        self.update_time_axis()
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.poll_stations)
+        self.timer.start(daq_base_interval)
+
+    def create_settings_group(self):
+        group = QGroupBox("Settings (all stations)")
+        layout = QHBoxLayout(group)
+        self.inputs = {}
+        for key, label, value in (('frequency', 'Frequency [Hz]:', '1000'), ('amplitude', 'Amplitude [V]:', '1.0'),
+                                  ('dc_offset', 'DC Offset [V]:', '0'), ('stop_current', 'Stop current [mA]:', '0'),
+                                  ('avg_window', 'Average Points:', str(avg_number))):
+            layout.addWidget(QLabel(label))
+            field = QLineEdit(value)
+            field.setAlignment(Qt.AlignCenter)
+            field.setMaximumWidth(80)
+            layout.addWidget(field)
+            self.inputs[key] = field
+        layout.addWidget(QLabel("Reduction:"))
+        self.avg_method_combo = QComboBox()
+        self.avg_method_combo.addItems(list(REDUCERS) + ['lock-in', 'band'])
+        self.avg_method_combo.setCurrentText(avg_method)
+        layout.addWidget(self.avg_method_combo)
+        layout.addWidget(QLabel("Detector:"))
+        self.detector_combo = QComboBox()
+        self.detector_combo.addItems(list(DETECTORS))
+        self.detector_combo.currentTextChanged.connect(self.change_detector)
+        layout.addWidget(self.detector_combo)
+        self.detector_param_input = QLineEdit()
+        self.detector_param_input.setMaximumWidth(80)
+        layout.addWidget(self.detector_param_input)
+        self.change_detector(self.detector_combo.currentText())
+        start_all = QPushButton("Start All")
+        start_all.clicked.connect(lambda: [self.start_station(p) for p in self.panes if p.start_button.isEnabled()])
+        stop_all = QPushButton("Stop All")
+        stop_all.clicked.connect(lambda: [self.stop_station(p) for p in self.panes])
+        layout.addWidget(start_all)
+        layout.addWidget(stop_all)
+        return group
+
+    def change_detector(self, name):
+        parameter = DETECTORS[name].parameter
+        self.inputs['stop_current'].setEnabled(parameter is None)
+        self.detector_param_input.setEnabled(parameter is not None)
+        self.detector_param_input.setText('' if parameter is None else str(parameter[1]))
+
+    def settings(self):
+        """入力欄から (電圧の設定, ステーションの設定) を作る"""
+        frequency = float(self.inputs['frequency'].text())
+        amplitude = float(self.inputs['amplitude'].text())
+        dc_offset = float(self.inputs['dc_offset'].text())
+        threshold = float(self.inputs['stop_current'].text()) * 0.001
+        window = max(int(self.inputs['avg_window'].text()), 1)
+        method = self.avg_method_combo.currentText()
+        cls = DETECTORS[self.detector_combo.currentText()]
+        # 縮約の方法は configure で検出方法にも設定される
+        detector = cls(threshold, window) if cls.parameter is None else cls(float(self.detector_param_input.text()))
+        return (frequency, amplitude, dc_offset), dict(window=window, method=method, threshold=threshold, detector=detector)
+
+    def update_time_axis(self):
+        """表示する点がそろうまでの横軸の幅（そろったあとは各点の時刻から決める）"""
+        span = self.avg_window / daq_sampling_frequency * data_buffer_size
+        for pane in self.panes:
+            pane.drawn_version = -1
+            pane.plot_widget.setXRange(-span, 0)
+
+    def start_station(self, pane):
+        try:
+            voltage, config = self.settings()
+        except ValueError:
+            QMessageBox.warning(self, "Error", "Invalid settings.")
+            return
+        if config['window'] != self.avg_window:
+            self.avg_window = config['window']
+            self.update_time_axis()
+        pane.station.configure(**config)
+        pane.station.start_etching(*voltage)
+        pane.status_label.setText("Etching")
+        pane.set_etching(True)
+        if self.live:
+            frequency, amplitude, dc_offset = voltage
+            self.live.publish_state(pane.station.index, name=pane.station.name, etching=True,
+                                    threshold=config['threshold'], avg_window=config['window'],
+                                    avg_method=config['method'], detector=config['detector'].name,
+                                    frequency=frequency, amplitude=amplitude, dc_offset=dc_offset)
+
+    def stop_station(self, pane):
+        pane.station.stop_etching()
+        pane.status_label.setText("Stopped (manual)")
+        pane.set_etching(False)
+        if self.live:
+            self.live.publish_state(pane.station.index, etching=False)
+
+    def toggle_station_logging(self, pane, checked):
+        if checked:
+            meta = {'avg_window': self.avg_window, 'avg_method': self.avg_method_combo.currentText(),
+                    'frequency': self.inputs['frequency'].text(), 'amplitude': self.inputs['amplitude'].text(),
+                    'dc_offset': self.inputs['dc_offset'].text(),
+                    'stop_current_mA': self.inputs['stop_current'].text(),
+                    'detector': self.detector_combo.currentText(),
+                    'detector_parameter': self.detector_param_input.text()}
+            pane.station.start_logging(self.log_dir, meta)
+        else:
+            pane.station.stop_logging()
+
+    def poll_stations(self):
+        readings, stops, recipe_ends = self.manager.poll()
+        for index, (times, values) in readings.items():
+            if len(values) == 0:
+                continue
+            pane = self.panes[index]
+            pane.values.extend(values)
+            pane.times.extend(times)
+            pane.filled = min(pane.filled + len(values), data_buffer_size)
+            pane.value_label.setText(f"Current Value: {values[-1]:.3f} V")
+            if self.live:
+                self.live.publish_samples(index, times, values / amp_gain)
+        for index, event in stops:
+            latency_ms = (event.cutoff_at - event.detected_at) * 1000
+            print(f"Station {index + 1}: stop detected by {event.detector} at {event.current:.6f} A; "
+                  f"latency {latency_ms:.3f} ms")
+            self.panes[index].status_label.setText(f"Stopped ({event.detector}, {latency_ms:.3f} ms)")
+            self.panes[index].set_etching(False)
+            if self.live:
+                self.live.publish_stop(index, event)
+        for index in recipe_ends:
+            print(f"Station {index + 1}: recipe finished")
+            self.panes[index].status_label.setText("Recipe finished")
+            self.panes[index].set_etching(False)
+        for pane in self.panes:
+            if pane.filled and pane.drawn_version != pane.values.version:
+                pane.drawn_version = pane.values.version
+                t0 = time.perf_counter()
+                n = pane.filled
+                times = pane.times.view()[-n:]
+                pane.plot_curve.setData(times - times[-1], pane.values.view()[-n:])
+                if n == data_buffer_size:
+                    pane.plot_widget.setXRange(times[0] - times[-1], 0, padding=0)
+                pane.metrics.render.observe(time.perf_counter() - t0)
+
+    def closeEvent(self, event):
+        self.timer.stop()
+        self.manager.close()
+        event.accept()
+
+
+def main(args, qt_args=()):
+    """GUI を起動する（tip.py から呼ばれる）"""
+    app = QApplication(sys.argv[:1] + list(qt_args))
+    app.setStyle('Fusion')
+    app.setStyleSheet("""
+        QMainWindow { background-color: #F0F0F0; }
+        QGroupBox { font-weight: bold; border: 1px solid #CCCCCC; border-radius: 5px; margin-top: 1ex; padding: 10px; }
+        QGroupBox::title { subcontrol-origin: margin; left: 10px; padding: 0 3px 0 3px; }
+        QPushButton { padding: 5px; border-radius: 3px; }
+        QLabel { padding: 2px; }
+    """)
+    if args.metrics_port:
+        try:
+            server = MetricsServer(args.metrics_port)
+        except OSError as e:
+            print(f"Metrics endpoint disabled: {str(e)}")
+        else:
+            server.start()
+            print(f"Metrics: http://127.0.0.1:{server.port}/metrics")
+    live = None
+    if args.live_port:
+        live = LiveServer(args.live_port, args.live_host)
+        try:
+            live.start()
+            print(f"Live view: http://{args.live_host}:{live.port}/")
+        except OSError as e:
+            print(f"Live server disabled: {str(e)}")
+            live = None
+    if args.devices:
+        channels = tuple(int(c) for c in args.channels.split(','))
+        kind, options = ('sim', {'gain': amp_gain}) if args.sim else ('wfsdk', {})
+        try:
+            manager = StationManager([(kind, options, channels)] * args.devices, mode=args.mode,
+                                     guardian=args.guardian, watchdog_timeout=args.watchdog_timeout,
+                                     guardian_timeout=guardian_timeout,
+                                     gain=amp_gain, sampling_frequency=daq_sampling_frequency,
+                                     ring_seconds=daq_ring_seconds, avg_window=avg_number, avg_method=avg_method)
+        except DeviceError as e:
+            QMessageBox.critical(None, "Error", str(e))
+            sys.exit(1)
+        window = MultiStationWindow(manager, live)
+    else:
+        kind, options = ('sim', {'gain': amp_gain}) if args.sim else ('wfsdk', {})
+        window = AD2Monitor(SimulatedBackend(gain=amp_gain) if args.sim else None, live,
+                            watchdog_timeout=args.watchdog_timeout, guardian=(kind, options) if args.guardian else None)
+    window.show()
+    return app.exec_()
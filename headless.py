@@ -0,0 +1,183 @@
+import threading
+import time
+
+from backend import DeviceError, EtchModel, SimulatedBackend, WFSDKBackend
+from acquisition import REDUCERS
+from detectors import DETECTORS
+from station import StationHost
+from stop import beep
+from recipe import load_recipe
+from metrics import MetricsServer
+from live import LiveServer
+from config import amp_gain, daq_adaptive_rates, daq_sampling_frequency, daq_ring_seconds, guardian_timeout, log_dir
+
+
+# 終了コード
+EXIT_STOPPED = 0        # ドロップオフを検出して自動で止まった
+EXIT_ERROR = 1
+EXIT_TIMEOUT = 2        # timeout 秒たっても止まらなかった（出力は 0V にする）
+EXIT_RECIPE_END = 3     # 止まる前にレシピの最後のステップが終わった
+EXIT_WATCHDOG = 4       # 取得が止まるなどして、ウォッチドッグが出力を止めた
+EXIT_INTERRUPTED = 130  # Ctrl+C で止めた
+
+
+def make_detector(name, parameter=None):
+    """--detector と --param から検出方法を作る（しきい値の判定は StopEngine の設定を使う）"""
+    cls = DETECTORS[name]
+    if cls.parameter is None or parameter is None:
+        return cls()
+    return cls(parameter)
+
+
+def run(args):
+    """GUI なしで1本分のエッチングを行い、終了コードを返す"""
+    if args.sim:
+        device = SimulatedBackend(EtchModel(etch_time=args.sim_etch_time), gain=amp_gain)
+        guardian = ('sim', {'gain': amp_gain})
+    else:
+        device = WFSDKBackend()
+        guardian = ('wfsdk', {})
+    try:
+        recipe = load_recipe(args.recipe) if args.recipe else None
+    except (OSError, ValueError, TypeError) as e:
+        print(f"Invalid recipe: {str(e)}")
+        return EXIT_ERROR
+    stopped = threading.Event()
+    recipe_ended = threading.Event()
+    events = []
+
+    def on_stop(index, event):
+        events.append(event)
+        stopped.set()
+
+    try:
+        device.open()
+        host = StationHost(device, (1,), sampling_frequency=daq_sampling_frequency, ring_seconds=daq_ring_seconds,
+                           adaptive_rates=daq_adaptive_rates, adaptive=args.adaptive,
+                           watchdog_timeout=args.watchdog_timeout, guardian=guardian if args.guardian else None,
+                           guardian_timeout=guardian_timeout,
+                           gain=amp_gain, avg_window=args.avg, avg_method=args.method,
+                           threshold=args.stop_current * 0.001, detector=make_detector(args.detector, args.param),
+                           on_stop=on_stop, on_recipe_end=lambda index: recipe_ended.set(),
+                           alert=None if args.quiet else beep)
+    except DeviceError as e:
+        print(f"Error: {str(e)}")
+        return EXIT_ERROR
+    print(f"Connected to: {device.name}")
+    station = host.stations[0]
+    if args.metrics_port:
+        try:
+            server = MetricsServer(args.metrics_port)
+        except OSError as e:
+            print(f"Metrics endpoint disabled: {str(e)}")
+        else:
+            server.start()
+            print(f"Metrics: http://127.0.0.1:{server.port}/metrics")
+    live = None
+    if args.live_port:
+        live = LiveServer(args.live_port, args.live_host)
+        try:
+            live.start()
+            print(f"Live view: http://{args.live_host}:{live.port}/")
+        except OSError as e:
+            print(f"Live server disabled: {str(e)}")
+            live = None
+    code = EXIT_TIMEOUT
+    try:
+        host.start()
+        if args.log:
+            path = station.start_logging(args.log_dir, meta={
+                'avg_window': args.avg, 'avg_method': args.method, 'frequency': args.frequency,
+                'amplitude': args.amplitude, 'dc_offset': args.offset, 'stop_current_mA': args.stop_current,
+                'detector': args.detector, 'detector_parameter': args.param, 'headless': True,
+                'recipe': args.recipe, 'adaptive_rates': daq_adaptive_rates if args.adaptive else None,
+            }, raw=args.raw, suffix='.bin')
+            print(f"Logging to: {path}")
+        if recipe:
+            try:
+                station.start_recipe(recipe)
+            except ValueError as e:
+                print(f"Invalid recipe: {str(e)}")
+                return EXIT_ERROR
+            print(f"Recipe started: {len(recipe)} steps, stop at {args.stop_current} mA ({args.detector})")
+        else:
+            station.start_etching(args.frequency, args.amplitude, args.offset)
+            print(f"Etching started: {args.offset} V DC + {args.amplitude} V at {args.frequency} Hz, "
+                  f"stop at {args.stop_current} mA ({args.detector})")
+        if live:
+            live.publish_state(0, name=device.name, etching=True, threshold=args.stop_current * 0.001,
+                               avg_window=args.avg, avg_method=args.method, detector=args.detector,
+                               frequency=args.frequency, amplitude=args.amplitude, dc_offset=args.offset,
+                               recipe=args.recipe)
+        start = time.monotonic()
+        last_print = start
+        step = 0
+        rate = host.worker.sampling_frequency
+        while not stopped.wait(0.1):
+            times, values = station.poll()
+            if live:
+                live.publish_samples(0, times, values / amp_gain)
+            now = time.monotonic()
+            if len(values) and now - last_print >= args.print_interval:
+                last_print = now
+                print(f"{now - start:8.1f} s  {values[-1] / amp_gain * 1000:8.3f} mA")
+            if host.worker.sampling_frequency != rate:
+                rate = host.worker.sampling_frequency
+                print(f"{now - start:8.1f} s  sampling {rate / 1000:g} kHz")
+            runner = station.recipe
+            if runner is not None and runner.index != step:
+                step = runner.index
+                print(f"{now - start:8.1f} s  step {step + 1}: {runner.steps[step]}")
+            if recipe_ended.is_set():
+                print("Recipe finished before drop-off; output set to 0 V")
+                code = EXIT_RECIPE_END
+                break
+            if args.timeout and now - start >= args.timeout:
+                station.stop_etching()
+                print(f"Timeout after {args.timeout} s; output set to 0 V")
+                break
+        else:
+            event = events[0]
+            if live:
+                live.publish_stop(0, event)
+            print("Stop detected by {} at {:.6f} A after {:.1f} s; stop latency {:.3f} ms".format(
+                event.detector, event.current, time.monotonic() - start, (event.cutoff_at - event.detected_at) * 1000))
+            code = EXIT_WATCHDOG if event.detector == 'watchdog' else EXIT_STOPPED
+    except KeyboardInterrupt:
+        station.stop_etching()
+        print("Interrupted; output set to 0 V")
+        code = EXIT_INTERRUPTED
+    finally:
+        if live:
+            live.publish_state(0, etching=False)
+            live.stop()
+        try:
+            host.close()
+        except DeviceError as e:
+            print(f"Close error: {str(e)}")
+            code = EXIT_ERROR
+    return code
+
+
+def add_arguments(parser):
+    """tip.py の引数に GUI なしのエッチング用の引数を追加する"""
+    group = parser.add_argument_group('headless etching (--headless)')
+    group.add_argument('--frequency', type=float, default=1000.0, help='CH1 の周波数 [Hz]')
+    group.add_argument('--amplitude', type=float, default=0.0, help='CH1 の振幅 [V]')
+    group.add_argument('--offset', type=float, default=5.0, help='CH1 の DC オフセット [V]')
+    group.add_argument('--stop-current', type=float, default=0.0, help='Stop current [mA]')
+    group.add_argument('--avg', type=int, default=1000, help='平均化するサンプル数')
+    group.add_argument('--method', default='|mean|', choices=sorted(REDUCERS) + ['lock-in', 'band'],
+                       help='平均化の方法')
+    group.add_argument('--detector', default='threshold', choices=list(DETECTORS))
+    group.add_argument('--param', type=float, help='検出方法のパラメータ（threshold 以外）')
+    group.add_argument('--recipe', help='レシピ（JSON）で電圧を変えながらエッチングする')
+    group.add_argument('--adaptive', action='store_true',
+                       help='ドロップオフが近づいたら取得の周波数を上げ、安定しているときは下げる（config.daq_adaptive_rates）')
+    group.add_argument('--timeout', type=float, default=0, help='この秒数で止まらなければ出力を止める（0: なし）')
+    group.add_argument('--log', action='store_true', help='ログを保存する')
+    group.add_argument('--raw', action='store_true', help='平均化前のデータもログに保存する')
+    group.add_argument('--log-dir', default=log_dir)
+    group.add_argument('--print-interval', type=float, default=1.0, help='電流を表示する間隔 [s]')
+    group.add_argument('--quiet', action='store_true', help='停止時にビープ音を鳴らさない')
+    group.add_argument('--sim-etch-time', type=float, default=60.0, help='シミュレータのドロップオフまでの時間 [s]')
@@ -0,0 +1,326 @@
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from metrics import REGISTRY
+
+
+# サンプルのメッセージ（バイナリフレーム、リトルエンディアン）
+# ヘッダー: 種類 (u8, 1), ステーション番号 (u8), 予約 (u16), サンプル数 n (u32), 最初のサンプルの日時 t0 (f64, UNIX 秒)
+# 続けて t0 からの時間 [s] (f32 × n)、電流 [A] (f32 × n)
+SAMPLES = 1
+SAMPLE_HEADER = struct.Struct('<BBHId')
+
+_WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+_MAX_CLIENT_PAYLOAD = 1 << 16
+
+# ブラウザで開いたときの簡単な表示（/ で返す）
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Tip Etcher live</title>
+<style>body{font-family:sans-serif;margin:10px}canvas{border:1px solid #ccc;width:100%;height:300px}</style>
+</head><body><div id="status">connecting...</div><canvas id="plot" width="1200" height="300"></canvas><pre id="log"></pre>
+<script>
+const series = {}, states = {}, span = 60;
+const status = document.getElementById('status'), log = document.getElementById('log');
+const ws = new WebSocket(`ws://${location.host}/ws`);
+ws.binaryType = 'arraybuffer';
+ws.onmessage = (e) => {
+  if (typeof e.data === 'string') {
+    const m = JSON.parse(e.data);
+    if (m.type === 'state') states[m.station] = m;
+    if (m.type === 'stop') log.textContent = `station ${m.station + 1}: stopped by ${m.detector} at ${m.current} A\\n` + log.textContent;
+    status.textContent = Object.values(states).map(s => `station ${s.station + 1}: ${s.etching ? 'etching' : 'idle'}`).join(' | ');
+    return;
+  }
+  const v = new DataView(e.data), station = v.getUint8(1), n = v.getUint32(4, true), t0 = v.getFloat64(8, true);
+  const dt = new Float32Array(e.data, 16, n), current = new Float32Array(e.data, 16 + 4 * n, n);
+  const s = series[station] = series[station] || [];
+  for (let i = 0; i < n; i++) s.push([t0 + dt[i], current[i]]);
+  while (s.length && s[0][0] < s[s.length - 1][0] - span) s.shift();
+};
+ws.onclose = () => status.textContent = 'disconnected';
+const colors = ['#0000ff', '#d00000', '#008000', '#ff8000', '#800080', '#008080'];
+function draw() {
+  const c = document.getElementById('plot'), g = c.getContext('2d');
+  g.clearRect(0, 0, c.width, c.height);
+  const all = Object.values(series).flat();
+  if (all.length) {
+    const now = Math.max(...all.map(p => p[0])), ys = all.map(p => p[1]);
+    const lo = Math.min(...ys), hi = Math.max(...ys), range = (hi - lo) || 1e-6;
+    g.fillText(`${(hi * 1000).toFixed(3)} mA`, 2, 10); g.fillText(`${(lo * 1000).toFixed(3)} mA`, 2, c.height - 2);
+    for (const [k, s] of Object.entries(series)) {
+      g.strokeStyle = colors[k % colors.length]; g.beginPath();
+      s.forEach(([t, y], i) => {
+        const x = c.width * (1 + (t - now) / span), py = c.height * (1 - (y - lo) / range);
+        i ? g.lineTo(x, py) : g.moveTo(x, py);
+      });
+      g.stroke();
+    }
+  }
+  requestAnimationFrame(draw);
+}
+draw();
+</script></body></html>
+"""
+
+
+def encode_samples(station, times, currents, clock_offset):
+    """サンプルのブロックをバイナリのメッセージにする（times は perf_counter 基準）"""
+    n = len(currents)
+    t0 = float(times[0]) + clock_offset
+    header = SAMPLE_HEADER.pack(SAMPLES, station, 0, n, t0)
+    offsets = (np.asarray(times) - times[0]).astype('<f4')
+    return header + offsets.tobytes() + np.asarray(currents, dtype='<f4').tobytes()
+
+
+def _accept_key(key):
+    """Sec-WebSocket-Key に対する Sec-WebSocket-Accept の値（RFC 6455 4.2.2）"""
+    return base64.b64encode(hashlib.sha1((key + _WS_GUID).encode()).digest()).decode()
+
+
+def _frame(opcode, payload):
+    """サーバーからクライアントへの WebSocket フレーム（マスクなし、分割なし）"""
+    n = len(payload)
+    if n < 126:
+        header = struct.pack('!BB', 0x80 | opcode, n)
+    elif n < 1 << 16:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, n)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, n)
+    return header + payload
+
+
+class _Client:
+    """接続中のクライアント1つ分の送信待ちのメッセージ
+
+    サンプルは queue_size 個までで、いっぱいになったら古いものから捨てる（遅いクライアントが
+    取得や他のクライアントを待たせないように）。状態や停止のメッセージは別に持ち、先に送る。
+    """
+
+    def __init__(self, writer, queue_size):
+        self.writer = writer
+        self.samples = deque(maxlen=queue_size)
+        self.messages = deque(maxlen=1024)
+        self.ready = asyncio.Event()
+        self.dropped = 0
+
+    def push(self, frame, control):
+        queue = self.messages if control else self.samples
+        if len(queue) == queue.maxlen:
+            self.dropped += 1
+        queue.append(frame)
+        self.ready.set()
+
+
+class LiveServer:
+    """エッチングの様子を WebSocket でブラウザやスクリプトに配信する（読み取り専用）
+
+    asyncio のイベントループを別スレッドで動かし、publish_* は GUI などのスレッドから呼ぶ
+    （メッセージを作ってループに渡すだけで、送信を待たない）。
+    ws://host:port/ws に接続すると、最初に各ステーションの状態を受け取り、その後は
+    平均化した電流をバイナリのメッセージ（SAMPLE_HEADER）で、状態の変化と停止を JSON で受け取る。
+    クライアントから送られたデータは読み捨てる。http://host:port/ では簡単な表示のページを返す。
+    """
+
+    def __init__(self, port=8765, host='127.0.0.1', queue_size=64):
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        # perf_counter の時刻を UNIX 時刻に直すための差
+        self.clock_offset = time.time() - time.perf_counter()
+        self.states = {}
+        self._states_lock = threading.Lock()    # states は呼び出し側のスレッドで書き、イベントループで読む
+        self._clients = set()
+        self._loop = None
+        self._server = None
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self.dropped = REGISTRY.counter('tipetch_live_dropped_messages_total',
+                                        'Live stream messages dropped for slow clients')
+
+    def start(self):
+        """サーバーを開始する（ポートを開けなければ OSError）"""
+        self._thread.start()
+        self._started.wait()
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        self._error = None
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            self._server = loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+        except OSError as e:
+            self._error = e
+            self._started.set()
+            loop.close()
+            return
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._loop = loop
+        self._started.set()
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    def stop(self):
+        loop = self._loop
+        if loop is None:
+            return
+
+        async def shutdown():
+            self._server.close()
+            # 送信待ちの停止などのメッセージは少しだけ待って送る
+            deadline = loop.time() + 0.5
+            while any(client.messages for client in self._clients) and loop.time() < deadline:
+                await asyncio.sleep(0.01)
+            for client in list(self._clients):
+                client.writer.close()
+            tasks = [task for task in asyncio.all_tasks(loop) if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            loop.stop()
+        asyncio.run_coroutine_threadsafe(shutdown(), loop)
+        self._thread.join(timeout=2.0)
+        self._loop = None
+
+    @property
+    def clients(self):
+        return len(self._clients)
+
+    # ---- 配信（呼び出し側のスレッド） ----
+
+    def publish_samples(self, station, times, currents):
+        """平均化した電流 [A] を配信する（接続がなければ何もしない）"""
+        if not self._clients or len(currents) == 0 or self._loop is None:
+            return
+        self._post(encode_samples(station, times, currents, self.clock_offset), False)
+
+    def publish_state(self, station, **state):
+        """ステーションの状態（etching, threshold, avg_window など）を配信する。新しいクライアントにも送る"""
+        with self._states_lock:
+            message = dict(self.states.get(station, {}), **state, type='state', station=station)
+            self.states[station] = message
+        self._post(json.dumps(message).encode(), True)
+
+    def publish_stop(self, station, event):
+        """停止（stop.StopEvent）を配信する"""
+        self.publish_state(station, etching=False)
+        self._post(json.dumps({
+            'type': 'stop', 'station': station, 'time': event.cutoff_at + self.clock_offset,
+            'sample_time': event.sample_time + self.clock_offset, 'current': event.current,
+            'threshold': event.threshold, 'detector': event.detector,
+            'latency_ms': (event.cutoff_at - event.detected_at) * 1000,
+        }).encode(), True)
+
+    def _post(self, payload, text):
+        loop = self._loop
+        if loop is None or not self._clients:
+            return
+        frame = _frame(0x1 if text else 0x2, payload)
+        try:
+            loop.call_soon_threadsafe(self._broadcast, frame, text)
+        except RuntimeError:
+            pass   # 終了処理中
+
+    # ---- イベントループ側 ----
+
+    def _broadcast(self, frame, control):
+        for client in self._clients:
+            before = client.dropped
+            client.push(frame, control)
+            if client.dropped != before:
+                self.dropped.inc()
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 10.0)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            writer.close()
+            return
+        lines = request.decode('latin-1').split('\r\n')
+        path = lines[0].split(' ')[1] if len(lines[0].split(' ')) > 1 else '/'
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+        if headers.get('upgrade', '').lower() != 'websocket':
+            if path.split('?')[0] in ('/', '/index.html'):
+                body = PAGE.encode()
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\n'
+                             b'Content-Length: %d\r\nConnection: close\r\n\r\n' % len(body) + body)
+            else:
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            await self._close(writer)
+            return
+        key = headers.get('sec-websocket-key')
+        if key is None:
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            await self._close(writer)
+            return
+        writer.write(('HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                      f'Sec-WebSocket-Accept: {_accept_key(key)}\r\n\r\n').encode())
+        client = _Client(writer, self.queue_size)
+        with self._states_lock:
+            states = list(self.states.values())
+        for state in states:
+            client.push(_frame(0x1, json.dumps(state).encode()), True)
+        self._clients.add(client)
+        sender = asyncio.ensure_future(self._send(client))
+        try:
+            await self._receive(reader, client)
+        finally:
+            self._clients.discard(client)
+            sender.cancel()
+            await self._close(writer)
+
+    async def _send(self, client):
+        try:
+            while True:
+                await client.ready.wait()
+                client.ready.clear()
+                while client.messages or client.samples:
+                    queue = client.messages if client.messages else client.samples
+                    client.writer.write(queue.popleft())
+                    await client.writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+    async def _receive(self, reader, client):
+        """クライアントからのフレームを読む（close と ping にだけ応える）"""
+        try:
+            while True:
+                head = await reader.readexactly(2)
+                opcode, n = head[0] & 0x0F, head[1] & 0x7F
+                if n == 126:
+                    n = struct.unpack('!H', await reader.readexactly(2))[0]
+                elif n == 127:
+                    n = struct.unpack('!Q', await reader.readexactly(8))[0]
+                if n > _MAX_CLIENT_PAYLOAD:
+                    return
+                mask = await reader.readexactly(4) if head[1] & 0x80 else b'\0\0\0\0'
+                data = bytes(b ^ mask[i % 4] for i, b in enumerate(await reader.readexactly(n)))
+                if opcode == 0x8:
+                    client.writer.write(_frame(0x8, data[:2]))
+                    return
+                if opcode == 0x9:
+                    client.push(_frame(0xA, data), True)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+
+    async def _close(self, writer):
+        try:
+            await writer.drain()
+            writer.close()
+        except ConnectionError:
+            pass
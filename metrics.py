@@ -0,0 +1,213 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+# 処理時間のヒストグラムの区切り [s]（1 µs から 10 s まで、1-2-5 刻み）
+TIME_BUCKETS = [m * 10.0 ** e for e in range(-6, 1) for m in (1, 2, 5)] + [10.0]
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+class Counter:
+    """増えるだけの値（取りこぼしたサンプル数など）"""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def render(self):
+        return [f"{self.name}{_label_text(self.labels)} {self.value}"]
+
+    @property
+    def used(self):
+        return self.value != 0
+
+
+class Histogram:
+    """処理時間などの分布
+
+    observe はバケツの二分探索と加算だけなので、取得スレッドなどの中で呼んでも負担にならない。
+    直近 recent 個の値も固定長の配列に残しておき、表示用の p50/p99 はそこから求める。
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=TIME_BUCKETS, recent=1024):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._recent = np.zeros(recent)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self._recent[self.count % len(self._recent)] = value
+        self.count += 1
+
+    def recent(self):
+        return self._recent[:min(self.count, len(self._recent))].copy()
+
+    def quantile(self, q):
+        """直近の値の分位点（値がなければ nan）"""
+        values = self.recent()
+        return float(np.quantile(values, q)) if len(values) else float('nan')
+
+    def render(self):
+        lines = []
+        cumulative = 0
+        for edge, count in zip(self.buckets + ['+Inf'], self.counts):
+            cumulative += count
+            le = edge if edge == '+Inf' else f"{edge:g}"
+            lines.append(f"{self.name}_bucket{_label_text(self.labels + (('le', le),))} {cumulative}")
+        lines.append(f"{self.name}_sum{_label_text(self.labels)} {self.sum:.9g}")
+        lines.append(f"{self.name}_count{_label_text(self.labels)} {self.count}")
+        return lines
+
+    @property
+    def used(self):
+        return self.count != 0
+
+
+class Registry:
+    """計測値の一覧（同じ名前とラベルなら同じものを返す）"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels):
+        labels = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            metric = self._metrics.get((name, labels))
+            if metric is None:
+                metric = self._metrics[(name, labels)] = cls(name, help, labels)
+            return metric
+
+    def counter(self, name, help, labels=None):
+        return self._get(Counter, name, help, labels)
+
+    def histogram(self, name, help, labels=None):
+        return self._get(Histogram, name, help, labels)
+
+    def render(self):
+        """Prometheus のテキスト形式にする（一度も使われていないものは省く）"""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: (m.name, m.labels))
+        lines = []
+        last_name = None
+        for metric in metrics:
+            if not metric.used:
+                continue
+            if metric.name != last_name:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.type}")
+                last_name = metric.name
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Metrics:
+    """1つのステーション（またはデバイス）の各段階の計測値
+
+    acquire: stream_read, listeners: 取得スレッドのリスナー全体, detect: 停止判定（縮約を含む）,
+    reduce: GUI 側の平均化, log_flush: ログの書き出し, render: グラフの再描画,
+    cutoff: 判定から出力停止まで, alert: ビープ音など（別スレッド）, timer_interval: data_timer の実際の間隔,
+    spectrum: スペクトルの計算（dsp.SpectrumWorker）, watchdog: 最後の心拍からウォッチドッグが出力を止めるまで,
+    rate_gap: サンプリング周波数を変えるときにストリームを開き直して途切れた時間。
+    """
+
+    def __init__(self, registry=None, **labels):
+        r = registry or REGISTRY
+        self.labels = labels
+
+        def histogram(name, help):
+            return r.histogram(f"tipetch_{name}_seconds", help, labels)
+
+        def counter(name, help):
+            return r.counter(f"tipetch_{name}_total", help, labels)
+
+        self.acquire = histogram('acquire', 'Time spent in stream_read')
+        self.listeners = histogram('listeners', 'Time spent in acquisition listeners per block')
+        self.detect = histogram('detect', 'Time spent in the stop engine per block')
+        self.reduce = histogram('reduce', 'Time spent reading the ring and averaging for display')
+        self.log_flush = histogram('log_flush', 'Time spent writing a batch of log records')
+        self.render = histogram('render', 'Time spent redrawing the plot')
+        self.cutoff = histogram('cutoff', 'Time from stop detection to output cutoff')
+        self.alert = histogram('alert', 'Duration of the stop alert')
+        self.timer_interval = histogram('timer_interval', 'Actual interval of the display data timer')
+        self.spectrum = histogram('spectrum', 'Time spent computing the live spectrum')
+        self.watchdog = histogram('watchdog', 'Time from the last heartbeat to the watchdog cutoff')
+        self.rate_gap = histogram('rate_gap', 'Duration in seconds of the sample gap while the stream restarts for a rate change')
+        self.samples = counter('samples', 'Samples acquired')
+        self.dropped = counter('dropped_samples', 'Samples lost by the device')
+        self.ring_overruns = counter('ring_overrun_samples', 'Samples overwritten before the display read them')
+        self.errors = counter('acquisition_errors', 'Acquisition errors')
+        self.timer_overruns = counter('timer_overruns', 'Data timer ticks later than 1.5x the interval')
+        self.log_bytes = counter('log_bytes', 'Bytes written to logs')
+
+    def summary(self):
+        """オーバーレイ表示用の短いまとめ"""
+        def ms(histogram, q=0.99):
+            return f"{histogram.quantile(q) * 1000:.2f}" if histogram.count else '-'
+        return (f"acquire p99 {ms(self.acquire)} ms | detect p99 {ms(self.detect)} ms | "
+                f"reduce p99 {ms(self.reduce)} ms | render p99 {ms(self.render)} ms\n"
+                f"log flush p99 {ms(self.log_flush)} ms | cutoff p99 {ms(self.cutoff)} ms | "
+                f"alert {ms(self.alert, 0.5)} ms | dropped {self.dropped.value} | "
+                f"ring overrun {self.ring_overruns.value} | timer overruns {self.timer_overruns.value}")
+
+
+class MetricsServer(threading.Thread):
+    """REGISTRY を http://host:port/metrics で Prometheus のテキスト形式として公開する"""
+
+    def __init__(self, port=9109, host='127.0.0.1', registry=None):
+        super().__init__(daemon=True)
+        registry = registry or REGISTRY
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def run(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
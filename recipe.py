@@ -0,0 +1,231 @@
+import json
+import math
+from collections import namedtuple
+
+import numpy as np
+
+
+# 1ステップ分の波形発生器の設定
+# kind: 'dc'（args = (電圧,)）, 'sine'（(周波数, 振幅, オフセット)）,
+#       'custom'（(データ, 繰り返し周波数, 振幅, オフセット, 繰り返し回数)）
+# resolution: カスタム波形の1サンプルの時間 [s]（パルスの幅などの精度）
+Waveform = namedtuple('Waveform', ['kind', 'args', 'resolution'])
+
+
+class Step:
+    """レシピの1ステップ
+
+    duration 秒たつか、電流が until_below [A] を下回るか、それまでのピークの until_fraction 倍を
+    下回ったら次のステップに進む（いずれも None なら停止判定で止まるまで続ける）。
+    ステップの中の波形は compile でカスタム波形などにして波形発生器に任せ、
+    ホストはステップの切り替えだけを行う。
+    """
+
+    type = ''
+
+    def __init__(self, duration=None, until_below=None, until_fraction=None):
+        self.duration = duration
+        self.until_below = until_below
+        self.until_fraction = until_fraction
+
+    def compile(self, buffer_size):
+        raise NotImplementedError
+
+    def to_dict(self):
+        return dict(vars(self), type=self.type)
+
+    def __repr__(self):
+        args = ', '.join(f"{k}={v}" for k, v in vars(self).items() if v is not None)
+        return f"{self.__class__.__name__}({args})"
+
+
+class DC(Step):
+    """一定の電圧"""
+
+    type = 'dc'
+
+    def __init__(self, voltage, **kwargs):
+        self.voltage = voltage
+        super().__init__(**kwargs)
+
+    def compile(self, buffer_size):
+        return Waveform('dc', (self.voltage,), 0.0)
+
+
+class AC(Step):
+    """DC オフセットつきの正弦波（従来の CH1 の出力）"""
+
+    type = 'ac'
+
+    def __init__(self, amplitude, frequency, offset=0.0, **kwargs):
+        self.amplitude = amplitude
+        self.frequency = frequency
+        self.offset = offset
+        super().__init__(**kwargs)
+
+    def compile(self, buffer_size):
+        return Waveform('sine', (self.frequency, self.amplitude, self.offset), 0.0)
+
+
+def _custom(voltages, frequency, repeat=0, offset=None):
+    """電圧の並びを、-1..1 のデータと振幅・オフセットにする"""
+    voltages = np.asarray(voltages, dtype=float)
+    if offset is None:
+        offset = (voltages.max() + voltages.min()) / 2
+    amplitude = float(np.max(np.abs(voltages - offset)))
+    data = (voltages - offset) / amplitude if amplitude > 0 else np.zeros(len(voltages))
+    return Waveform('custom', (data, frequency, amplitude, float(offset), repeat), 1.0 / (frequency * len(voltages)))
+
+
+class Pulse(Step):
+    """high を on_time 秒、low を off_time 秒の繰り返し"""
+
+    type = 'pulse'
+
+    def __init__(self, high, on_time, off_time, low=0.0, **kwargs):
+        self.high = high
+        self.low = low
+        self.on_time = on_time
+        self.off_time = off_time
+        super().__init__(**kwargs)
+
+    def compile(self, buffer_size):
+        period = self.on_time + self.off_time
+        on = int(round(self.on_time / period * buffer_size))
+        if on == 0 or on == buffer_size:
+            raise ValueError(f"Pulse on_time {self.on_time} s is below the resolution {period / buffer_size} s")
+        voltages = np.full(buffer_size, float(self.low))
+        voltages[:on] = self.high
+        return _custom(voltages, 1.0 / period)
+
+
+class Burst(Step):
+    """振幅 amplitude・周波数 frequency の正弦波を on_time 秒出し、off_time 秒休む繰り返し"""
+
+    type = 'burst'
+
+    # 1周期あたりこれより少ないサンプルでは正弦波にならない
+    min_samples_per_cycle = 8
+
+    def __init__(self, amplitude, frequency, on_time, off_time, offset=0.0, **kwargs):
+        self.amplitude = amplitude
+        self.frequency = frequency
+        self.on_time = on_time
+        self.off_time = off_time
+        self.offset = offset
+        super().__init__(**kwargs)
+
+    def compile(self, buffer_size):
+        period = self.on_time + self.off_time
+        if buffer_size / (period * self.frequency) < self.min_samples_per_cycle:
+            raise ValueError(f"Burst of {self.frequency} Hz over {period} s does not fit in {buffer_size} samples")
+        t = np.arange(buffer_size) * (period / buffer_size)
+        voltages = self.offset + np.where(t < self.on_time, self.amplitude * np.sin(2 * math.pi * self.frequency * t), 0.0)
+        return _custom(voltages, 1.0 / period, offset=self.offset)
+
+
+class Ramp(Step):
+    """duration 秒で start から stop まで直線的に変える（1回だけ再生し、終わったら stop を保つ）"""
+
+    type = 'ramp'
+
+    def __init__(self, start, stop, duration, **kwargs):
+        self.start = start
+        self.stop = stop
+        super().__init__(duration=duration, **kwargs)
+
+    def compile(self, buffer_size):
+        # 再生が終わると波形発生器はオフセットの電圧になるので、オフセットを stop にしておく
+        voltages = np.linspace(self.start, self.stop, buffer_size)
+        return _custom(voltages, 1.0 / self.duration, repeat=1, offset=self.stop)
+
+
+STEPS = {cls.type: cls for cls in (DC, AC, Pulse, Burst, Ramp)}
+
+
+def parse_recipe(steps):
+    """[{'type': 'dc', 'voltage': 5, 'duration': 10}, ...] をステップのリストにする"""
+    recipe = []
+    for step in steps:
+        step = dict(step)
+        try:
+            cls = STEPS[step.pop('type')]
+        except KeyError as e:
+            raise ValueError(f"Unknown recipe step: {e}")
+        recipe.append(cls(**step))
+    return recipe
+
+
+def load_recipe(path):
+    """JSON ファイルからレシピを読み込む"""
+    with open(path) as f:
+        return parse_recipe(json.load(f))
+
+
+def apply_waveform(device, channel, waveform):
+    """コンパイルしたステップを波形発生器に設定する"""
+    if waveform.kind == 'dc':
+        device.wavegen_dc(channel, *waveform.args)
+    elif waveform.kind == 'sine':
+        device.wavegen_sine(channel, *waveform.args)
+    else:
+        device.wavegen_custom(channel, *waveform.args)
+
+
+class RecipeRunner:
+    """レシピのステップを順に波形発生器に設定する
+
+    波形は開始前にすべてコンパイルしておき、切り替えのときは設定するだけにする。
+    process は取得スレッドから電流 [A] のブロックごとに呼ばれ、切り替えの条件を調べる
+    （ステップの時間はサンプルの時刻で、電流の条件は averager で縮約した値で判定する）。
+    on_step は (ステップ番号, ステップ) を受け取る。最後のステップの条件を満たすと finished になる。
+    """
+
+    def __init__(self, device, steps, averager, channel=1, on_step=None):
+        if not steps:
+            raise ValueError("Empty recipe")
+        self.device = device
+        self.steps = list(steps)
+        self.averager = averager       # 電流の条件は平均化した値で判定する
+        self.channel = channel
+        self.on_step = on_step
+        buffer_size = device.wavegen_buffer_size(channel)
+        self.waveforms = [step.compile(buffer_size) for step in self.steps]
+        self.index = -1
+        self.finished = False
+
+    def start(self, t=None):
+        self.peak = 0.0
+        self._advance(t)
+
+    def _advance(self, t):
+        self.index += 1
+        if self.index >= len(self.steps):
+            self.finished = True
+            return
+        self.step_started = t
+        self.averager.reset()
+        apply_waveform(self.device, self.channel, self.waveforms[self.index])
+        if self.on_step is not None:
+            self.on_step(self.index, self.steps[self.index])
+
+    def process(self, times, currents):
+        if self.finished or len(times) == 0:
+            return
+        step = self.steps[self.index]
+        if self.step_started is None:
+            self.step_started = times[0]
+        if step.duration is not None and times[-1] - self.step_started >= step.duration:
+            self._advance(times[-1])
+            return
+        if step.until_below is None and step.until_fraction is None:
+            return
+        _, readings = self.averager.feed(times, currents)
+        if len(readings) == 0:
+            return
+        level = np.abs(readings)
+        self.peak = max(self.peak, float(level.max()))
+        if step.until_below is not None and level.min() < step.until_below:
+            self._advance(times[-1])
+        elif step.until_fraction is not None and level.min() < step.until_fraction * self.peak:
+            self._advance(times[-1])
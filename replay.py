@@ -0,0 +1,234 @@
+import argparse
+import glob
+import json
+import os
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+
+from acquisition import REDUCERS
+from datalog import read_log, read_meta, raw_path
+
+
+# values * scale が電流 [A]。values はメモリマップのままにして、縮約したあとで scale を掛ける
+# start: エッチング開始時刻（停止判定はこれ以降のサンプルで行う）, dropoff: 実際のドロップオフ時刻
+# per_record: 1レコードが何サンプルを平均化したものか（平均化前のデータなら 1、わからなければ None）
+Session = namedtuple('Session', ['name', 'times', 'values', 'scale', 'start', 'dropoff', 'per_record'])
+
+
+def find_dropoff(times, currents, window=10, min_ratio=0.5):
+    """電流が最も急に落ちた時刻を返す（落ち方が小さければ None）
+
+    直前 window サンプルの平均と直後 window サンプルの平均を比べ、
+    その比が min_ratio を下回る中で最も落差の大きい位置をドロップオフとする。
+    自動停止したログは停止の直後で終わるので、直後の区間はデータの終わりで短くなってもよい
+    （ただし window // 10 サンプル、最低1サンプルは必要）。
+    """
+    x = np.abs(np.asarray(currents, dtype=float))
+    n = len(x)
+    min_after = max(window // 10, 1)
+    if n < window + min_after:
+        return None
+    c = np.concatenate(([0.0], np.cumsum(x)))
+    i = np.arange(window, n - min_after + 1)      # 落ちた直後のサンプルの位置の候補
+    count = np.minimum(window, n - i)
+    before = (c[i] - c[i - window]) / window
+    after = (c[i + count] - c[i]) / count
+    drop = before - after
+    k = int(np.argmax(drop))
+    if before[k] <= 0 or after[k] / before[k] > min_ratio:
+        return None
+    return float(times[i[k]])
+
+
+def _events(meta, name):
+    return [e['t'] for e in meta.get('events', []) if e.get('name') == name]
+
+
+def _samples(times, seconds):
+    """seconds 秒に相当するサンプル数"""
+    if len(times) < 2:
+        return 1
+    dt = float(np.median(np.diff(times[:1000])))
+    return max(int(round(seconds / dt)), 1) if dt > 0 else 1
+
+
+def load_session(path, dropoff_seconds=0.05):
+    """ログを読み込む（.bin はメモリマップ、.log は従来の CSV）"""
+    name = os.path.basename(path)
+    if path.endswith('.log'):
+        times, currents = _read_legacy_csv(path)
+        # 従来の CSV には平均化の幅が記録されていないので、1行を1サンプルとして扱う
+        return Session(name, times, currents, 1.0, times[0] if len(times) else 0.0,
+                       find_dropoff(times, currents, _samples(times, dropoff_seconds)), 1)
+    meta = read_meta(path)
+    if os.path.exists(raw_path(path)) and meta.get('raw_samples'):
+        # 平均化前のデータがあれば、平均化の幅を自由に変えられる
+        records, scale, per_record = read_log(path, raw=True), 1.0 / meta.get('gain', 1.0), 1
+    else:
+        records, scale, per_record = read_log(path), 1.0, _avg_window(meta)
+    times, values = records['t'], records['value']
+    starts = _events(meta, 'start')
+    start = starts[0] if starts else (times[0] if len(times) else 0.0)
+    i = np.searchsorted(times, start)
+    # 出力を止めたあとの電流の低下をドロップオフと取り違えないよう、止めた時刻までで探す
+    ends = sorted(t for name in ('stop', 'manual_stop', 'recipe_end') for t in _events(meta, name) if t >= start)
+    j = np.searchsorted(times, ends[0], side='right') if ends else len(times)
+    dropoff = find_dropoff(times[i:j], values[i:j] * scale, _samples(times, dropoff_seconds))
+    return Session(name, times, values, scale, start, dropoff, per_record)
+
+
+def _avg_window(meta):
+    """ログのヘッダーの avg_window（古いログでは文字列のこともある。なければ None）"""
+    try:
+        window = int(float(meta['avg_window']))
+    except (KeyError, TypeError, ValueError):
+        return None
+    return window if window >= 1 else None
+
+
+def _read_legacy_csv(path):
+    """従来の Timestamp,Voltage 形式（値は電流 [A]）のログを読む"""
+    times, values = [], []
+    with open(path) as f:
+        next(f, None)
+        for line in f:
+            stamp, _, value = line.strip().partition(',')
+            if not value:
+                continue
+            times.append(datetime.strptime(stamp, '%Y-%m-%d %H:%M:%S.%f').timestamp())
+            values.append(float(value))
+    return np.array(times), np.array(values)
+
+
+def readings(session, window, method='|mean|'):
+    """ライブと同じく、開始時刻から window サンプルごとに縮約した (時刻, 電流 [A]) を返す
+
+    window はライブと同じく取得したサンプルの数。平均化したログでは window // per_record レコードずつ
+    縮約するので、window は per_record の倍数でなければならない（そうでなければ ValueError）。
+    """
+    if session.per_record is None:
+        raise ValueError(f"{session.name}: averaged log without avg_window in its header; "
+                         "cannot convert the window to records")
+    if window % session.per_record:
+        raise ValueError(f"{session.name}: window {window} is not a multiple of the log's averaging "
+                         f"({session.per_record} samples per record)")
+    window //= session.per_record
+    i = np.searchsorted(session.times, session.start)
+    values = session.values[i:]
+    blocks = len(values) // window
+    if blocks == 0:
+        return np.empty(0), np.empty(0)
+    reduced = REDUCERS[method](np.asarray(values[:blocks * window]).reshape(blocks, window))
+    return session.times[i + window - 1:i + blocks * window:window], reduced * session.scale
+
+
+def first_crossings(reading_times, currents, thresholds):
+    """各しきい値について、電流が初めてしきい値を下回る時刻を返す（下回らなければ nan）
+
+    停止判定（current < threshold）が最初に成立する位置は、累積最小値が初めてしきい値を
+    下回る位置と同じなので、累積最小値に対する二分探索でまとめて求められる。
+    """
+    thresholds = np.asarray(thresholds, dtype=float)
+    if len(currents) == 0:
+        return np.full(thresholds.shape, np.nan)
+    running_min = np.minimum.accumulate(currents)
+    index = np.searchsorted(-running_min, -thresholds, side='right')
+    fired = index < len(currents)
+    result = np.full(thresholds.shape, np.nan)
+    result[fired] = reading_times[index[fired]]
+    return result
+
+
+def sweep(sessions, windows, thresholds, method='|mean|'):
+    """平均化の幅としきい値の組み合わせごとに、停止時刻 − ドロップオフ時刻 [s] を求める
+
+    戻り値は (セッション数, len(windows), len(thresholds)) の配列。
+    負の値はドロップオフ前に止まってしまうこと、nan は止まらないか、ドロップオフが見つからないことを表す。
+    """
+    delays = np.full((len(sessions), len(windows), len(thresholds)), np.nan)
+    for s, session in enumerate(sessions):
+        if session.dropoff is None:
+            continue
+        for w, window in enumerate(windows):
+            t, currents = readings(session, window, method)
+            delays[s, w] = first_crossings(t, currents, thresholds) - session.dropoff
+    return delays
+
+
+def summarize(delays, windows, thresholds):
+    """組み合わせごとに、停止した数・早すぎた数・遅れの中央値と最大値をまとめる"""
+    rows = []
+    valid = ~np.all(np.isnan(delays), axis=(1, 2))
+    delays = delays[valid]
+    for w, window in enumerate(windows):
+        for k, threshold in enumerate(thresholds):
+            d = delays[:, w, k]
+            fired = d[~np.isnan(d)]
+            late = fired[fired >= 0]
+            rows.append({
+                'window': int(window),
+                'threshold_mA': float(threshold) * 1000,
+                'sessions': int(len(d)),
+                'fired': int(len(fired)),
+                'premature': int(np.sum(fired < 0)),
+                'median_delay_s': float(np.median(late)) if len(late) else None,
+                'max_delay_s': float(np.max(late)) if len(late) else None,
+            })
+    # 早すぎる停止がなく、すべて止まり、遅れが小さいものを先に並べる
+    rows.sort(key=lambda r: (r['premature'], r['sessions'] - r['fired'],
+                             r['median_delay_s'] if r['median_delay_s'] is not None else np.inf))
+    return rows
+
+
+def parse_range(text, dtype=float):
+    """'1,2,5' または 'start:stop:step' を配列にする"""
+    if ':' in text:
+        start, stop, step = (float(v) for v in text.split(':'))
+        return np.arange(start, stop + step / 2, step).astype(dtype)
+    return np.array([dtype(v) for v in text.split(',')])
+
+
+def find_logs(paths):
+    logs = []
+    for path in paths:
+        if os.path.isdir(path):
+            logs += sorted(p for p in glob.glob(os.path.join(path, '*.bin')) if not p.endswith('.raw.bin'))
+            logs += sorted(glob.glob(os.path.join(path, '*.log')))
+        else:
+            logs.append(path)
+    return logs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='過去のログを再生して停止条件を調べる')
+    parser.add_argument('logs', nargs='*', default=[os.path.join(os.path.dirname(os.path.abspath(__file__)), 'log')],
+                        help='ログファイルまたはフォルダ（既定: log/）')
+    parser.add_argument('--windows', default='1,10,100,1000', help='平均化するサンプル数（例: 100,1000 や 100:1000:100）。'
+                             '平均化前のデータがないログではログの avg_window の倍数にする')
+    parser.add_argument('--thresholds', default='0.1:5:0.1', help='Stop current [mA]（例: 0.5,1 や 0.1:5:0.1）')
+    parser.add_argument('--method', default='|mean|', choices=list(REDUCERS))
+    parser.add_argument('--top', type=int, default=20, help='表示する組み合わせの数')
+    parser.add_argument('--json', help='結果を JSON で保存する')
+    args = parser.parse_args()
+
+    windows = parse_range(args.windows, int)
+    thresholds = parse_range(args.thresholds) * 0.001
+    sessions = [load_session(path) for path in find_logs(args.logs)]
+    print(f"{len(sessions)} sessions, {sum(s.dropoff is not None for s in sessions)} with drop-off, "
+          f"{len(windows) * len(thresholds)} settings")
+    try:
+        delays = sweep(sessions, windows, thresholds, args.method)
+    except ValueError as e:
+        parser.error(str(e))
+    rows = summarize(delays, windows, thresholds)
+    print(f"{'window':>8} {'stop[mA]':>9} {'fired':>7} {'early':>6} {'median[s]':>10} {'max[s]':>8}")
+    for r in rows[:args.top]:
+        median = f"{r['median_delay_s']:.3f}" if r['median_delay_s'] is not None else '-'
+        maximum = f"{r['max_delay_s']:.3f}" if r['max_delay_s'] is not None else '-'
+        print(f"{r['window']:>8} {r['threshold_mA']:>9.3f} {r['fired']:>3}/{r['sessions']:<3} "
+              f"{r['premature']:>6} {median:>10} {maximum:>8}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=1)
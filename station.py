@@ -0,0 +1,587 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from backend import DeviceError, open_backend
+from acquisition import SampleRing, AcquisitionWorker, Averager
+from stop import StopEngine, beep
+from dsp import LockIn, BandPower
+from datalog import LogWriter, new_log_path
+from catalog import record_session
+from recipe import RecipeRunner
+from adaptive import RateScheduler
+from metrics import Metrics
+from watchdog import WatchState, Watchdog, start_guardian
+from config import band_power_range
+
+
+class SharedDIO:
+    """同じデバイスの複数のステーションで共有する DIO の出力値"""
+
+    def __init__(self, device):
+        self.device = device
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def set_bits(self, mask, bits):
+        with self.lock:
+            self.value = (self.value & ~mask) | (bits & mask)
+            self.device.dio_set(self.value)
+
+
+class DeviceChannel:
+    """1台のデバイスの1チャンネルを、探針1本分のデバイスとして見せる
+
+    StopEngine などが使う CH1 と DIO の0番目を、それぞれ CH channel と DIO の channel-1 番目に振り替える。
+    """
+
+    def __init__(self, device, channel, dio):
+        self.device = device
+        self.channel = channel
+        self.dio = dio
+        self.bit = 1 << (channel - 1)
+        self.name = f"{device.name} CH{channel}"
+
+    def _channel(self, channel):
+        if channel != 1:
+            raise DeviceError(f"Station has only one channel (got CH{channel})")
+        return self.channel
+
+    def wavegen_dc(self, channel, offset):
+        self.device.wavegen_dc(self._channel(channel), offset)
+
+    def wavegen_sine(self, channel, frequency, amplitude, offset):
+        self.device.wavegen_sine(self._channel(channel), frequency, amplitude, offset)
+
+    def wavegen_custom(self, channel, data, frequency, amplitude, offset, repeat=0):
+        self.device.wavegen_custom(self._channel(channel), data, frequency, amplitude, offset, repeat)
+
+    def wavegen_buffer_size(self, channel):
+        return self.device.wavegen_buffer_size(self._channel(channel))
+
+    def dio_set(self, value):
+        self.dio.set_bits(self.bit, self.bit if value & 1 else 0)
+
+
+class EtchStation:
+    """探針1本分のエッチング: 停止判定・表示用の平均化・ログをまとめる
+
+    取得は StationHost の AcquisitionWorker が行い、process がそのスレッド上で呼ばれる。
+    row はデバイスが複数チャンネルを取得しているときの、このステーションの行。
+    adaptive_rates を渡すと、エッチング中は rate_scheduler（adaptive.RateScheduler）が
+    ドロップオフの近さから取得の周波数を選ぶ（実際に変えるのは StationHost）。
+    """
+
+    def __init__(self, device, ring, index=0, row=None, gain=100, sampling_frequency=10e3,
+                 avg_window=1000, avg_method='|mean|', threshold=0.0, detector=None, on_stop=None, alert=beep,
+                 adaptive_rates=None, on_recipe_end=None):
+        self.device = device
+        self.ring = ring
+        self.index = index
+        self.row = row
+        self.name = device.name
+        self.gain = gain
+        self.sampling_frequency = sampling_frequency
+        self.cursor = ring.head
+        self.on_stop = on_stop         # (index, StopEvent) を取得スレッドから受け取る
+        self.on_recipe_end = on_recipe_end  # (index) レシピが最後まで終わって出力を止めたときに取得スレッドから呼ばれる
+        self.log_writer = None
+        self.recipe = None             # 実行中の RecipeRunner
+        self.etching = False
+        self.metrics = Metrics(station=str(index))
+        # 'lock-in' では CH1 の励起周波数で復調した交流振幅を使う
+        self.lockin = LockIn(1000, sampling_frequency)
+        self.stop_lockin = LockIn(1000, sampling_frequency)
+        # 'band' では band_power_range [Hz] の成分の実効値（気泡などの雑音の大きさ）を使う
+        self.band = BandPower(*band_power_range, sampling_frequency)
+        self.stop_band = BandPower(*band_power_range, sampling_frequency)
+        self.method = avg_method       # Reduction の名前（averager.method は lock-in などでは関数になる）
+        # 取得スレッドで受け取り、GUI 側の lockin/band にまだ反映していない (新しいストリームの開始時刻, 周波数)
+        self._rate_changes = []
+        self._rate_lock = threading.Lock()
+        self.averager = Averager(avg_window, self.reduction(avg_method))
+        self.stop_engine = StopEngine(device, detector, avg_window, self.reduction(avg_method, stop=True),
+                                      gain, threshold, on_stop=self._stopped, alert=alert, metrics=self.metrics)
+        self.rate_scheduler = None
+        if adaptive_rates is not None:
+            self.rate_scheduler = RateScheduler(adaptive_rates, avg_window, self.reduction(avg_method, stop=True))
+
+    def reduction(self, name, stop=False):
+        """Reduction の名前を Averager に渡す縮約方法にする（停止判定用には別の状態を持つものを使う）"""
+        if name == 'lock-in':
+            return (self.stop_lockin if stop else self.lockin).reduce
+        if name == 'band':
+            return (self.stop_band if stop else self.band).reduce
+        return name
+
+    def configure(self, window=None, method=None, threshold=None, detector=None):
+        if window is not None:
+            self.averager.set_window(window)
+        if method is not None:
+            self.method = method
+            self.averager.set_method(self.reduction(method))
+        self.stop_engine.configure(window=window, threshold=threshold, detector=detector,
+                                   method=None if method is None else self.reduction(method, stop=True))
+        if self.rate_scheduler is not None:
+            self.rate_scheduler.configure(window, None if method is None else self.reduction(method, stop=True))
+
+    def set_sampling_frequency(self, start, sampling_frequency):
+        """取得の周波数が変わったときに取得スレッドから呼ばれる（start は新しいストリームの開始時刻）
+
+        停止判定用の縮約はここで変える。GUI 側の lockin/band は GUI スレッドが平均化している最中かもしれないので、
+        poll で start より前のサンプルを平均化してから変える。
+        """
+        self.sampling_frequency = sampling_frequency
+        for demodulator in (self.stop_lockin, self.stop_band):
+            demodulator.set_sampling_frequency(sampling_frequency)
+        with self._rate_lock:
+            self._rate_changes.append((start, sampling_frequency))
+        if self.log_writer:
+            self.log_writer.event('rate', t=start, sampling_frequency=sampling_frequency)
+
+    def set_voltage(self, frequency, amplitude, offset):
+        self.device.wavegen_sine(1, frequency, amplitude, offset)
+        # ロックインの基準周波数を出力に合わせる
+        self.lockin.set_frequency(frequency)
+        self.stop_lockin.set_frequency(frequency)
+
+    def start_etching(self, frequency, amplitude, offset):
+        self.set_voltage(frequency, amplitude, offset)
+        # 電圧を印加する前に取得したサンプルで停止判定しないよう読み飛ばす
+        self.cursor = self.ring.head
+        self.averager.reset()
+        self.device.dio_set(0)
+        self.stop_engine.arm()
+        self.etching = True
+        if self.log_writer:
+            self.log_writer.event('start')
+
+    def start_recipe(self, steps):
+        """レシピ（recipe.Step のリスト）でエッチングを始める
+
+        波形はここですべてコンパイルするので、設定できないレシピは開始前に ValueError になる。
+        ステップの切り替えは取得スレッドで行い、切り替えのたびに検出方法をリセットする
+        （電圧を下げたときの電流の変化で止まらないように）。
+        """
+        # レシピの電流の条件は取得スレッドで判定するので、GUI 側の lockin/band ではなく停止判定用の縮約を使う
+        runner = RecipeRunner(self.device, steps,
+                              Averager(self.averager.window, self.reduction(self.method, stop=True)),
+                              on_step=self._recipe_step)
+        self.cursor = self.ring.head
+        self.averager.reset()
+        self.device.dio_set(0)
+        self.recipe = None
+        if self.log_writer:
+            self.log_writer.event('start', recipe=[step.to_dict() for step in runner.steps])
+        runner.start(time.perf_counter())
+        self.stop_engine.arm()
+        self.etching = True
+        self.recipe = runner
+
+    def _recipe_step(self, index, step):
+        if index > 0:
+            self.stop_engine.arm()
+        if self.log_writer:
+            self.log_writer.event('recipe_step', index=index, step=step.type)
+
+    def stop_etching(self):
+        """手動で止める"""
+        self.recipe = None
+        self.stop_engine.disarm()
+        self.device.wavegen_dc(1, 0)
+        self.etching = False
+        if self.log_writer:
+            self.log_writer.event('manual_stop')
+
+    def _stopped(self, event):
+        self.recipe = None
+        self.etching = False
+        if self.log_writer:
+            self.log_writer.event('stop', t=event.cutoff_at, sample_time=event.sample_time,
+                                  current=event.current, threshold=event.threshold, detector=event.detector)
+        if self.on_stop is not None:
+            self.on_stop(self.index, event)
+
+    def process(self, times, values):
+        """取得スレッドから呼ばれる"""
+        if self.row is not None:
+            values = values[self.row]
+        self.stop_engine.process(times, values)
+        scheduler = self.rate_scheduler
+        if scheduler is not None:
+            if self.stop_engine.armed:
+                scheduler.process(times, values / self.gain, self.stop_engine.threshold)
+            elif scheduler.rate != scheduler.rates[1]:
+                scheduler.reset()
+        recipe = self.recipe
+        if recipe is not None and self.stop_engine.armed:
+            recipe.process(times, values / self.gain)
+            if recipe.finished:
+                # 最後のステップが終わったら出力を止める
+                self.recipe = None
+                self.stop_engine.disarm()
+                self.device.wavegen_dc(1, 0)
+                self.etching = False
+                if self.log_writer:
+                    self.log_writer.event('recipe_end')
+                if self.on_recipe_end is not None:
+                    self.on_recipe_end(self.index)
+        log_writer = self.log_writer
+        if log_writer is not None:
+            log_writer.put_raw(times, values)
+
+    def poll(self):
+        """前回以降のサンプルを平均化し、(時刻, 縮約した電圧 [V]) を返す（ログにも書き込む）"""
+        t0 = time.perf_counter()
+        times, values, self.cursor, lost = self.ring.read(self.cursor)
+        if lost:
+            self.metrics.ring_overruns.inc(lost)
+        if self._rate_changes:
+            avg_times, avg_values = self._feed_across_rates(times, values)
+        else:
+            avg_times, avg_values = self.averager.feed(times, values)
+        self.metrics.reduce.observe(time.perf_counter() - t0)
+        if len(avg_values) and self.log_writer:
+            self.log_writer.put(avg_times, avg_values / self.gain)
+        return avg_times, avg_values
+
+    def _feed_across_rates(self, times, values):
+        """周波数が変わる前後でサンプルを分けて平均化し、その間で GUI 側の lockin/band の周波数を変える"""
+        with self._rate_lock:
+            changes, self._rate_changes = self._rate_changes, []
+        parts = []
+        for start, sampling_frequency in changes:
+            k = np.searchsorted(times, start)
+            parts.append(self.averager.feed(times[:k], values[:k]))
+            times, values = times[k:], values[k:]
+            for demodulator in (self.lockin, self.band):
+                demodulator.set_sampling_frequency(sampling_frequency)
+        parts.append(self.averager.feed(times, values))
+        return tuple(np.concatenate(part) for part in zip(*parts))
+
+    def start_logging(self, log_dir, meta=None, raw=False, suffix=None):
+        """ログを開始してファイルのパスを返す
+
+        suffix を指定しない場合は、同じ時刻に開始した他のステーションのログと名前が重ならないよう
+        ステーション番号をつける（yyMMddHHmm_s1.bin）。
+        """
+        meta = dict(meta or {}, gain=self.gain, sampling_frequency=self.sampling_frequency,
+                    station=self.index, device=self.device.name)
+        os.makedirs(log_dir, exist_ok=True)
+        suffix = suffix or f"_s{self.index + 1}.bin"
+        self.log_writer = LogWriter(new_log_path(log_dir, suffix), meta=meta, raw=raw, metrics=self.metrics)
+        self.log_writer.start()
+        return self.log_writer.path
+
+    def stop_logging(self):
+        log_writer, self.log_writer = self.log_writer, None
+        if log_writer:
+            log_writer.close()
+            # 測定条件と結果をログの一覧（catalog.sqlite3）に登録する。ログ全体を読み直すので、
+            # 呼び出し側（GUI スレッド）を待たせないよう別スレッドで行う（終了時は登録し終えるまで待つ）
+            threading.Thread(target=record_session, args=(log_writer.path,)).start()
+
+    def close(self):
+        self.stop_engine.disarm()
+        self.stop_logging()
+        self.device.wavegen_dc(1, 0)
+
+
+class StationHost:
+    """1台のデバイスと、そのチャンネルごとの EtchStation をまとめて動かす
+
+    取得スレッドはデバイスごとに1つで、使うチャンネルを同時に連続取得する。
+    停止判定はこのスレッド上で各ステーションごとに行うので、別のデバイスのステーションを
+    増やしてもその停止経路には影響しない（同じデバイスの2チャンネルは同じブロックを順に判定する）。
+    adaptive_rates（(安定時, 通常, ドロップオフ直前) の周波数）を渡し、adaptive を True にすると、
+    エッチング中のステーションが選んだ周波数のうち最も高いものでデバイスの取得を行う。
+    watchdog_timeout を指定すると、取得スレッドの心拍が途切れたときに別のスレッド（watchdog.Watchdog）が
+    出力を止める。guardian に (バックエンド名, 引数) を渡すと、このプロセスが落ちたり固まったりしたときに
+    別プロセスからデバイスを開き直して出力を止める（guardian_timeout 秒で判定する）。
+    """
+
+    def __init__(self, device, channels=(1,), first_index=0, sampling_frequency=10e3, ring_seconds=10,
+                 on_stop=None, adaptive_rates=None, adaptive=False, watchdog_timeout=0.0, guardian=None,
+                 guardian_timeout=2.0, **station_options):
+        self.device = device
+        self.channels = tuple(channels)
+        self.sampling_frequency = sampling_frequency
+        self.adaptive_rates = adaptive_rates
+        self.adaptive = adaptive
+        self.guardian = guardian
+        self.guardian_timeout = guardian_timeout
+        device.scope_open(amplitude_range=10.0)
+        mask = 0
+        for channel in self.channels:
+            mask |= 1 << (channel - 1)
+        device.dio_enable(mask)
+        self.dio = SharedDIO(device)
+        self.dio.set_bits(mask, 0)
+        for channel in self.channels:
+            device.wavegen_dc(channel, 0)
+        # 周波数を上げても ring_seconds 秒分を保持できるようにする
+        max_rate = max(adaptive_rates) if adaptive_rates else sampling_frequency
+        self.rings = [SampleRing(int(max(max_rate, sampling_frequency) * ring_seconds)) for _ in self.channels]
+        self.stations = [
+            EtchStation(DeviceChannel(device, channel, self.dio), ring, first_index + k, k,
+                        sampling_frequency=sampling_frequency, on_stop=on_stop, adaptive_rates=adaptive_rates,
+                        **station_options)
+            for k, (channel, ring) in enumerate(zip(self.channels, self.rings))
+        ]
+        # 取得はデバイス単位なので、複数チャンネルのときはステーション番号を並べたラベルで記録する
+        if len(self.stations) == 1:
+            metrics = self.stations[0].metrics
+        else:
+            metrics = Metrics(station=','.join(str(station.index) for station in self.stations))
+        self.worker = AcquisitionWorker(device, self.rings, sampling_frequency=sampling_frequency,
+                                        channel=self.channels, metrics=metrics)
+        for station in self.stations:
+            self.worker.add_listener(station.process)
+            self.worker.rate_listeners.append(station.set_sampling_frequency)
+        if adaptive_rates is not None:
+            self.worker.add_listener(self._update_rate)
+        self.watch = self.watchdog = self.guardian_process = None
+        if watchdog_timeout or guardian:
+            self.watch = WatchState(len(self.stations))
+            self.worker.add_listener(self._heartbeat)
+            self.watchdog = Watchdog(self.watch, self.stations, timeout=watchdog_timeout or guardian_timeout / 2)
+
+    def set_adaptive(self, adaptive):
+        """取得の周波数の自動切り替えをオン・オフする（オフにすると sampling_frequency に戻す）"""
+        self.adaptive = adaptive
+
+    def _update_rate(self, times, values):
+        rate = self.sampling_frequency
+        if self.adaptive:
+            rates = [s.rate_scheduler.rate for s in self.stations if s.stop_engine.armed]
+            if rates:
+                rate = max(rates)
+        if rate != self.worker.sampling_frequency:
+            self.worker.set_sampling_frequency(rate)
+
+    def _heartbeat(self, times, values):
+        now = time.perf_counter()
+        for k, station in enumerate(self.stations):
+            row = values[station.row] if station.row is not None else values
+            self.watch.beat(k, now, float(np.abs(row).mean()) / station.gain)
+
+    def start(self):
+        if self.watch is not None:
+            # 取得を始める前の心拍の時刻を今にしておく
+            self.watch.slots['beat'] = time.perf_counter()
+            self.watchdog.start()
+            if self.guardian:
+                kind, kwargs = self.guardian
+                self.guardian_process = start_guardian(self.watch, (kind, kwargs, self.channels),
+                                                       timeout=self.guardian_timeout)
+        self.worker.start()
+
+    def close(self):
+        if self.watchdog is not None:
+            self.watchdog.stop()
+        self.worker.stop()
+        try:
+            for station in self.stations:
+                station.close()
+            self.dio.set_bits(0xFFFF, 0)
+        finally:
+            self.device.close()
+            if self.watch is not None:
+                # 正常に閉じたのでガーディアンは不要
+                self.watch.slots['armed'] = 0
+                if self.guardian_process is not None:
+                    self.guardian_process.terminate()
+                    self.guardian_process.join()
+                self.watch.close()
+
+
+class RemoteStation:
+    """別プロセスで動いている EtchStation の操作をコマンドとして送る"""
+
+    def __init__(self, commands, index, name):
+        self.commands = commands
+        self.index = index
+        self.name = name
+
+    def _send(self, command, *args, **kwargs):
+        self.commands.put((command, self.index, args, kwargs))
+
+    def configure(self, **config):
+        self._send('configure', **config)
+
+    def start_etching(self, frequency, amplitude, offset):
+        self._send('start_etching', frequency, amplitude, offset)
+
+    def start_recipe(self, steps):
+        self._send('start_recipe', steps)
+
+    def stop_etching(self):
+        self._send('stop_etching')
+
+    def start_logging(self, log_dir, meta=None, raw=False, suffix=None):
+        self._send('start_logging', log_dir, meta, raw, suffix)
+
+    def stop_logging(self):
+        self._send('stop_logging')
+
+
+def _host_process(spec, first_index, options, commands, results, poll_interval):
+    """子プロセスで1台分の StationHost を動かし、平均化した値と停止（レシピの終了を含む）を results に送る"""
+    kind, kwargs, channels = spec
+    try:
+        device = open_backend(kind, **kwargs)
+        host = StationHost(device, channels, first_index,
+                           on_stop=lambda index, event: results.put(('stop', index, event)),
+                           on_recipe_end=lambda index: results.put(('recipe_end', index, None)), **options)
+    except DeviceError as e:
+        results.put(('error', first_index, str(e)))
+        return
+    stations = {station.index: station for station in host.stations}
+    results.put(('ready', first_index, [s.device.name for s in host.stations]))
+    host.start()
+    try:
+        while True:
+            try:
+                method, index, args, kwargs = commands.get(timeout=poll_interval)
+                if method == 'close':
+                    break
+                result = getattr(stations[index], method)(*args, **kwargs)
+                if method == 'start_logging':
+                    results.put(('log', index, result))
+            except queue.Empty:
+                pass
+            except DeviceError as e:
+                results.put(('error', index, str(e)))
+            for index, station in stations.items():
+                times, values = station.poll()
+                if len(values):
+                    results.put(('reading', index, (times, values)))
+    finally:
+        host.close()
+
+
+class StationManager:
+    """複数のデバイス（と各デバイスのチャンネル）をステーションとして並行に動かす
+
+    devices は (バックエンド名, バックエンドの引数, 使うチャンネル) のリスト。
+    mode='thread' ではデバイスごとの取得スレッドをこのプロセスで動かし、
+    mode='process' ではデバイスごとに子プロセスを起動する（GIL を共有しないので台数が多いとき向け）。
+    どちらの場合も stations の操作と poll は GUI スレッドから行う。
+    guardian=True のときは、mode='thread' の各デバイスに StationHost のガーディアンをつける。
+    """
+
+    def __init__(self, devices, mode='thread', poll_interval=0.1, guardian=False, **options):
+        self.mode = mode
+        self.hosts = []
+        self.processes = []
+        self.stations = []
+        self._stops = queue.SimpleQueue() if mode == 'thread' else None
+        self._recipe_ends = queue.SimpleQueue() if mode == 'thread' else None
+        self._readings = {}
+        self.log_paths = {}
+        self.errors = []
+        first_index = 0
+        if mode == 'thread':
+            try:
+                for kind, kwargs, channels in devices:
+                    # WF_SDK は使用中でない最初のデバイスを開くので、順に開けば別々のデバイスになる
+                    host = StationHost(open_backend(kind, **kwargs), channels, first_index,
+                                       on_stop=lambda index, event: self._stops.put((index, event)),
+                                       on_recipe_end=self._recipe_ends.put,
+                                       guardian=(kind, kwargs) if guardian else None, **options)
+                    self.hosts.append(host)
+                    self.stations += host.stations
+                    first_index += len(host.stations)
+            except DeviceError:
+                self.close()
+                raise
+            for host in self.hosts:
+                host.start()
+        elif mode == 'process':
+            if guardian:
+                # デーモンの子プロセスはさらに子プロセスを持てないので、各プロセスのウォッチドッグだけを使う
+                print("Guardian is not available in process mode")
+            # Qt のスレッドを持ったまま fork しないよう、子プロセスは spawn で起動する
+            context = multiprocessing.get_context('spawn')
+            self._results = context.Queue()
+            for spec in devices:
+                commands = context.Queue()
+                process = context.Process(target=_host_process, daemon=True,
+                                          args=(spec, first_index, options, commands, self._results, poll_interval))
+                process.start()
+                self.processes.append((process, commands))
+                self.stations += [RemoteStation(commands, first_index + k, '') for k in range(len(spec[2]))]
+                first_index += len(spec[2])
+            self._wait_ready()
+        else:
+            raise ValueError(f"Unknown mode: {mode}")
+
+    def _wait_ready(self, timeout=30.0):
+        waiting = len(self.processes)
+        deadline = time.monotonic() + timeout
+        while waiting:
+            try:
+                kind, index, payload = self._results.get(timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Empty:
+                self.close()
+                raise DeviceError("Station process did not start")
+            if kind == 'ready':
+                for k, name in enumerate(payload):
+                    self.stations[index + k].name = name
+            elif kind == 'error':
+                self.close()
+                raise DeviceError(payload)
+            waiting -= 1
+
+    def poll(self):
+        """前回以降の {ステーション番号: (時刻, 縮約した電圧 [V])}, [(ステーション番号, StopEvent)],
+        [レシピが最後まで終わったステーション番号] を返す
+        """
+        stops, recipe_ends = [], []
+        if self.mode == 'thread':
+            readings = {station.index: station.poll() for station in self.stations}
+            for source, target in ((self._stops, stops), (self._recipe_ends, recipe_ends)):
+                while True:
+                    try:
+                        target.append(source.get_nowait())
+                    except queue.Empty:
+                        break
+            return readings, stops, recipe_ends
+        readings = {}
+        while True:
+            try:
+                kind, index, payload = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'reading':
+                readings.setdefault(index, []).append(payload)
+            elif kind == 'stop':
+                stops.append((index, payload))
+            elif kind == 'recipe_end':
+                recipe_ends.append(index)
+            elif kind == 'log':
+                self.log_paths[index] = payload
+            elif kind == 'error':
+                print(f"Station {index} error: {payload}")
+                self.errors.append((index, payload))
+        for index, blocks in readings.items():
+            readings[index] = (np.concatenate([t for t, _ in blocks]), np.concatenate([v for _, v in blocks]))
+        return readings, stops, recipe_ends
+
+    def close(self):
+        for host in self.hosts:
+            try:
+                host.close()
+            except DeviceError as e:
+                print(f"Close error: {str(e)}")
+        for process, commands in self.processes:
+            commands.put(('close', None, (), {}))
+        for process, commands in self.processes:
+            process.join(timeout=5.0)
+            if process.is_alive():
+                process.terminate()
+        self.hosts, self.processes = [], []
@@ -0,0 +1,164 @@
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from backend import DeviceError
+from acquisition import Averager
+from detectors import ThresholdDetector
+from metrics import Metrics
+
+
+# sample_time: 停止条件を満たしたサンプル（または区間の最後のサンプル）の時刻
+# detected_at: 判定した時刻, cutoff_at: 出力を止め終わった時刻（いずれも time.perf_counter 基準）
+# detector: 停止を判定した Detector の名前
+StopEvent = namedtuple('StopEvent', ['sample_time', 'detected_at', 'cutoff_at', 'current', 'threshold', 'detector'])
+
+
+def beep(frequency=3000, duration_ms=3000):
+    """停止を知らせるビープ音（Windows 以外ではターミナルのベル）"""
+    try:
+        import winsound
+    except ImportError:
+        print('\a', end='', flush=True)
+        return
+    winsound.Beep(frequency, duration_ms)
+
+
+class StopEngine:
+    """取得スレッド上で停止判定を行い、ドロップオフを検出したら即座に出力を止める
+
+    AcquisitionWorker のリスナーとして登録すると、取得したブロックごとに process が呼ばれ、
+    電流 [A] に換算したサンプルを detector（detectors.Detector）に渡す。
+    method に dsp.LockIn.reduce などの関数を指定した場合は、平均化を持たない検出方法にも
+    window サンプルごとに縮約した値（交流振幅など）を渡す。
+    停止時は CH1 を 0V にして DIO の0番目をセットしたあとで、ビープ音などの通知を別スレッドで行う。
+    判定（縮約を含む）・出力停止・通知の時間は metrics（metrics.Metrics）に記録する。
+    """
+
+    def __init__(self, device, detector=None, window=1, method='|mean|', gain=100, threshold=0.0,
+                 on_stop=None, alert=beep, metrics=None):
+        self.device = device
+        self.gain = gain
+        # 平均化としきい値の設定は、検出方法を切り替えても引き継ぐ
+        self.window = window
+        self.method = method
+        self.threshold = threshold     # しきい値 [A]（入力欄の編集時にだけ更新する）
+        self.detector = detector if detector is not None else ThresholdDetector(threshold, window, method)
+        self._reducer = None           # 検出の前段の縮約（method が関数のときだけ使う）
+        self.on_stop = on_stop         # 停止後に取得スレッドから呼ばれる（StopEvent を受け取る）
+        self.alert = alert
+        self.metrics = metrics or Metrics()
+        self.armed = False
+        self.events = []               # 停止のたびに StopEvent を記録する
+        self._arm_requested = False
+        self._armed_since = 0.0
+        # 渡された detector にも平均化としきい値の設定を反映する
+        self._pending_config = {'detector': self.detector}
+        self._config_lock = threading.Lock()
+        # trip は取得スレッドとウォッチドッグのスレッドから呼ばれる
+        self._trip_lock = threading.Lock()
+
+    def set_threshold(self, threshold):
+        self.configure(threshold=threshold)
+
+    def set_detector(self, detector):
+        self.configure(detector=detector)
+
+    def configure(self, **config):
+        """window, method, threshold, detector を変更する。実際の変更は取得スレッド側で次のブロックの前に行う"""
+        with self._config_lock:
+            self._pending_config.update((k, v) for k, v in config.items() if v is not None)
+
+    def _apply_config(self):
+        with self._config_lock:
+            config, self._pending_config = self._pending_config, {}
+        if 'detector' in config:
+            self.detector = config['detector']
+            self.detector.reset()
+        self.window = config.get('window', self.window)
+        self.method = config.get('method', self.method)
+        self.threshold = config.get('threshold', self.threshold)
+        detector = self.detector
+        if hasattr(detector, 'set_window') and ('window' in config or 'detector' in config):
+            detector.set_window(self.window)
+        if hasattr(detector, 'set_method') and ('method' in config or 'detector' in config):
+            detector.set_method(self.method)
+        if hasattr(detector, 'threshold'):
+            detector.threshold = self.threshold
+        if callable(self.method) and not hasattr(detector, 'set_window'):
+            if self._reducer is None or {'window', 'method', 'detector'} & set(config):
+                self._reducer = Averager(self.window, self.method)
+        else:
+            self._reducer = None
+
+    def arm(self):
+        """エッチング開始時に呼ぶ。それ以前のサンプルは判定に使わない"""
+        self._armed_since = time.perf_counter()
+        self._arm_requested = True
+
+    def disarm(self):
+        self._arm_requested = False
+        self.armed = False
+
+    def process(self, times, values):
+        if self._pending_config:
+            self._apply_config()
+        if self._arm_requested:
+            self._arm_requested = False
+            self.detector.reset()
+            if self._reducer is not None:
+                self._reducer.reset()
+            self.armed = True
+            # 開始前に取得したサンプルを捨てる
+            start = np.searchsorted(times, self._armed_since)
+            times, values = times[start:], values[start:]
+        if not self.armed or len(values) == 0:
+            return
+        t0 = time.perf_counter()
+        try:
+            if self._reducer is not None:
+                times, values = self._reducer.feed(times, values)
+            hit = self.detector.process(times, values / self.gain)
+        except Exception:
+            # 停止判定が動かないまま電圧をかけ続けないよう、先に出力を止めてから取得スレッドに知らせる
+            self.trip(detector='error')
+            raise
+        self.metrics.detect.observe(time.perf_counter() - t0)
+        if hit is not None:
+            self.trip(*hit)
+
+    def trip(self, sample_time=None, current=float('nan'), detector=None):
+        """出力を止める。通知は後回しにする（detector は StopEvent に記録する名前。既定は検出方法の名前）
+
+        すでに止まっている（arm されていない）ときは何もせず None を返す。
+        """
+        with self._trip_lock:
+            if not (self.armed or self._arm_requested):
+                return None
+            detected_at = time.perf_counter()
+            self.armed = self._arm_requested = False
+            try:
+                self.device.wavegen_dc(1, 0)
+                self.device.dio_set(1 << 0)
+            except DeviceError:
+                # 出力が止まっていないかもしれないので、もう一度 trip できるようにしておく
+                self.armed = True
+                raise
+            cutoff_at = time.perf_counter()
+        event = StopEvent(detected_at if sample_time is None else sample_time,
+                          detected_at, cutoff_at, current,
+                          getattr(self.detector, 'threshold', float('nan')), detector or self.detector.name)
+        self.events.append(event)
+        self.metrics.cutoff.observe(cutoff_at - detected_at)
+        if self.alert is not None:
+            threading.Thread(target=self._alert, daemon=True).start()
+        if self.on_stop is not None:
+            self.on_stop(event)
+        return event
+
+    def _alert(self):
+        t0 = time.perf_counter()
+        self.alert()
+        self.metrics.alert.observe(time.perf_counter() - t0)
@@ -0,0 +1,102 @@
+import time
+
+import numpy as np
+
+from acquisition import SampleRing, AcquisitionWorker
+from backend import SimulatedBackend, EtchModel
+from detectors import ThresholdDetector
+from metrics import Metrics, Registry
+from stop import StopEngine
+
+
+def _block(start, n):
+    times = np.arange(start, start + n, dtype=float)
+    return times, times * 10
+
+
+def test_ring_wraparound():
+    ring = SampleRing(10)
+    cursor = 0
+    for start in range(0, 40, 7):
+        ring.write(*_block(start, 7))
+        times, values, cursor, lost = ring.read(cursor)
+        np.testing.assert_array_equal(times, np.arange(start, start + 7))
+        np.testing.assert_array_equal(values, times * 10)
+        assert lost == 0
+    assert cursor == ring.head == 42
+    np.testing.assert_array_equal(ring.latest(10)[0], np.arange(32, 42))
+
+
+def test_ring_reports_overwritten_samples():
+    ring = SampleRing(10)
+    ring.write(*_block(0, 25))
+    times, values, cursor, lost = ring.read(0)
+    assert lost == 15
+    np.testing.assert_array_equal(times, np.arange(15, 25))
+    assert cursor == 25
+
+
+class RacingRing(SampleRing):
+    """コピーの途中で書き込み側が追い越す"""
+
+    def _copy(self, start, stop):
+        copied = super()._copy(start, stop)
+        self.write(*_block(self.head, 4))
+        return copied
+
+
+def test_ring_drops_samples_overwritten_while_copying():
+    ring = RacingRing(10)
+    ring.write(*_block(0, 10))
+    times, values, cursor, lost = ring.read(0)
+    assert lost == 4
+    np.testing.assert_array_equal(times, np.arange(4, 10))
+    assert cursor == 10
+
+
+def _worker(device):
+    return AcquisitionWorker(device, SampleRing(1 << 16), sampling_frequency=10e3, metrics=Metrics(Registry()))
+
+
+def test_listener_error_keeps_acquiring():
+    worker = _worker(SimulatedBackend(EtchModel(seed=0), gain=100))
+    blocks = []
+
+    def broken(times, values):
+        raise ValueError("broken listener")
+
+    worker.add_listener(broken)
+    worker.add_listener(lambda times, values: blocks.append(len(values)))
+    worker.start()
+    try:
+        time.sleep(0.2)
+        count = len(blocks)
+        time.sleep(0.1)
+    finally:
+        worker.stop()
+    assert count > 0 and len(blocks) > count
+    assert worker.errors >= count
+    assert worker.metrics.errors.value == worker.errors
+
+
+class BrokenDetector(ThresholdDetector):
+    def process(self, times, currents):
+        raise RuntimeError("broken detector")
+
+
+def test_stop_engine_error_cuts_output():
+    device = SimulatedBackend(EtchModel(seed=0), gain=100)
+    device.wavegen_dc(1, 5.0)
+    engine = StopEngine(device, BrokenDetector(1e-3), window=10, gain=100, alert=None)
+    engine.arm()
+    worker = _worker(device)
+    worker.add_listener(engine.process)
+    worker.start()
+    try:
+        time.sleep(0.2)
+        assert worker.is_alive()
+    finally:
+        worker.stop()
+    assert [event.detector for event in engine.events] == ['error']
+    assert device.output[1] == (0.0, 0.0, 0.0)
+    assert device.dio & 1
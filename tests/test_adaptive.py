@@ -0,0 +1,26 @@
+import numpy as np
+
+from adaptive import RateScheduler
+
+
+def _feed(scheduler, t0, level, seconds=1.0, fs=1000.0, threshold=1.0):
+    times = t0 + np.arange(int(seconds * fs)) / fs
+    return scheduler.process(times, np.full(len(times), level), threshold)
+
+
+def test_near_threshold_rate_is_kept_until_reset():
+    scheduler = RateScheduler(rates=(2e3, 10e3, 50e3), window=100, hold=0.5)
+    assert _feed(scheduler, 0.0, 1.2) == 50e3
+    # しきい値から離れても、ドロップオフ直前の周波数のまま
+    t = 1.0
+    for _ in range(5):
+        assert _feed(scheduler, t, 5.0) == 50e3
+        t += 1.0
+    scheduler.reset()
+    assert scheduler.rate == 10e3
+
+
+def test_far_from_threshold_slows_down_after_hold():
+    scheduler = RateScheduler(rates=(2e3, 10e3, 50e3), window=100, hold=0.5)
+    assert _feed(scheduler, 0.0, 5.0, seconds=0.3) == 10e3
+    assert _feed(scheduler, 0.3, 5.0) == 2e3
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from acquisition import Averager, REDUCERS
+
+
+EXPECTED = {
+    '|mean|': lambda x: np.abs(np.mean(x)),
+    'mean': np.mean,
+    'rms': lambda x: np.sqrt(np.mean(x ** 2)),
+    'median': np.median,
+    'min': np.min,
+    'max': np.max,
+}
+
+
+def test_expected_covers_reducers():
+    assert set(EXPECTED) == set(REDUCERS)
+
+
+@pytest.mark.parametrize('method', sorted(REDUCERS))
+@pytest.mark.parametrize('window,block', [(100, 1000), (7, 100), (300, 128), (64, 64)])
+def test_reducer_matches_numpy_across_blocks(method, window, block):
+    rng = np.random.default_rng(0)
+    times = np.arange(5000) / 1000
+    values = rng.normal(0.5, 1.0, len(times))
+    averager = Averager(window, method)
+    parts = [averager.feed(times[i:i + block], values[i:i + block]) for i in range(0, len(times), block)]
+    out_times = np.concatenate([p[0] for p in parts])
+    out_values = np.concatenate([p[1] for p in parts])
+    count = len(times) // window
+    assert len(out_values) == count
+    np.testing.assert_array_equal(out_times, times[window - 1:count * window:window])
+    expected = [EXPECTED[method](values[k * window:(k + 1) * window]) for k in range(count)]
+    np.testing.assert_allclose(out_values, expected, rtol=1e-12, atol=1e-12)
+
+
+def test_reset_drops_partial_window():
+    averager = Averager(10)
+    averager.feed(np.arange(5.0), np.ones(5))
+    averager.reset()
+    t, v = averager.feed(np.arange(5.0, 15.0), np.full(10, 2.0))
+    np.testing.assert_array_equal(t, [14.0])
+    np.testing.assert_array_equal(v, [2.0])
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        Averager(10, 'rms2')
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from backend import BACKENDS, DeviceError, EtchModel, SimulatedBackend, open_backend
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _backend(etch_time=10.0):
+    clock = FakeClock()
+    device = SimulatedBackend(EtchModel(etch_time=etch_time, noise=0.0, seed=0), gain=100, clock=clock)
+    device.open()
+    return device, clock
+
+
+def _stream_until(device, clock, seconds, fs=1000.0, step=0.1):
+    start = device.stream_start(fs)
+    values = []
+    while clock.now < seconds:
+        clock.now += step
+        v, lost = device.stream_read()
+        assert lost == 0
+        values.append(v)
+    values = np.concatenate(values)
+    return start + np.arange(len(values)) / fs, values / device.gain
+
+
+@pytest.mark.parametrize('voltage,expected', [(5.0, 10.0), (2.5, 20.0)])
+def test_current_drops_below_threshold_on_time(voltage, expected):
+    device, clock = _backend()
+    device.wavegen_dc(1, voltage)
+    times, currents = _stream_until(device, clock, 25.0)
+    # ドロップオフ直前は初期電流の 40 %、後は 5 %
+    assert currents[0] == pytest.approx(2e-3 * voltage)
+    below = np.flatnonzero(currents < 0.2 * currents[0])
+    assert times[below[0]] == pytest.approx(expected, abs=2e-3)
+    assert device.model.dropped_at == pytest.approx(expected, abs=1e-9)
+    assert np.all(currents[:below[0]] >= 0.4 * currents[0] - 1e-12)
+    assert currents[-1] == pytest.approx(0.05 * currents[0])
+
+
+def test_ac_drive_progresses_by_mean_absolute_voltage():
+    device, clock = _backend()
+    device.wavegen_sine(1, 1000.0, 5.0, 0.0)
+    clock.now = 1.0
+    device.wavegen_dc(1, 0)
+    # |sin| の平均は 2/π なので、1 秒で 5V DC の 2/π 秒分進む
+    assert device.model.progress == pytest.approx(2 / np.pi / 10.0, rel=1e-3)
+
+
+def test_cutoff_is_recorded_and_stops_etching():
+    device, clock = _backend()
+    device.wavegen_dc(1, 5.0)
+    clock.now = 3.0
+    device.wavegen_dc(1, 0)
+    assert device.output[1] == (0.0, 0.0, 0.0)
+    assert device.output_changed_at == 3.0
+    progress = device.model.progress
+    clock.now = 30.0
+    device.stream_start(1000.0)
+    clock.now = 31.0
+    values, _ = device.stream_read()
+    assert np.all(values == 0)
+    assert device.model.progress == progress and device.model.dropped_at is None
+
+
+def test_dio_set_is_recorded():
+    device, clock = _backend()
+    clock.now = 2.0
+    device.dio_set(0b101)
+    assert device.dio == 0b101 and device.dio_changed_at == 2.0
+    device.dio_enable(0b001)
+    device.dio_set(0b111)
+    assert device.dio == 0b001
+
+
+def test_two_channels_are_independent():
+    clock = FakeClock()
+    device = SimulatedBackend(EtchModel(etch_time=10.0, noise=0.0), gain=100, clock=clock,
+                              model2=EtchModel(etch_time=20.0, noise=0.0))
+    device.open()
+    device.wavegen_dc(1, 5.0)
+    device.wavegen_dc(2, 5.0)
+    clock.now = 15.0
+    device.wavegen_dc(1, 5.0)
+    assert device.models[1].dropped_at == pytest.approx(10.0)
+    assert device.models[2].dropped_at is None
+
+
+def test_open_backend_unknown():
+    assert 'sim' in BACKENDS
+    with pytest.raises((DeviceError, KeyError, ValueError)):
+        open_backend('nope')
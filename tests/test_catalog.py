@@ -0,0 +1,31 @@
+import numpy as np
+
+from catalog import summarize
+from datalog import LogWriter
+from test_replay import FS, GAIN, write_stopped_log
+
+
+def test_stop_latency_from_stop_event(tmp_path):
+    path = tmp_path / 'stopped.bin'
+    write_stopped_log(path, raw=True)
+    row = summarize(str(path))
+    assert row['outcome'] == 'stop'
+    assert abs(row['dropoff_s'] - 5.0) < 1e-3
+    assert abs(row['stop_latency_s'] - 0.02) < 1e-3
+    assert row['cutoff_s'] == 0.0
+
+
+def test_stop_latency_without_dropoff(tmp_path):
+    # 電流が下がらないまま止めたログでは、停止条件を満たしたサンプルから数える
+    times = 100.0 + np.arange(2 * FS) / FS
+    path = tmp_path / 'flat.bin'
+    writer = LogWriter(str(path), meta={'gain': GAIN}, raw=True)
+    writer.start()
+    writer.event('start', t=100.0)
+    writer.put_raw(times, np.full(len(times), 10e-3 * GAIN))
+    writer.put(times[99::100], np.full(len(times) // 100, 10e-3))
+    writer.event('stop', t=times[-1] + 0.002, sample_time=times[-1])
+    writer.close()
+    row = summarize(str(path))
+    assert row['dropoff_s'] is None
+    assert abs(row['stop_latency_s'] - 0.002) < 1e-9
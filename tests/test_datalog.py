@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from datalog import LOG_DTYPE, LOG_FORMAT_VERSION, LogWriter, export_csv, read_log, read_meta, raw_path
+
+
+def _blocks(count, size, start=100.0, fs=1000.0, seed=0):
+    rng = np.random.default_rng(seed)
+    times = start + np.arange(count * size) / fs
+    values = rng.normal(size=count * size)
+    return [(times[k:k + size], values[k:k + size]) for k in range(0, count * size, size)], times, values
+
+
+@pytest.mark.parametrize('flush_bytes', [1 << 20, 256])
+def test_round_trip(tmp_path, flush_bytes):
+    path = str(tmp_path / 'session.bin')
+    averaged, avg_times, avg_values = _blocks(20, 7, seed=1)
+    raw, raw_times, raw_values = _blocks(50, 100, seed=2)
+    writer = LogWriter(path, meta={'gain': 100, 'station': 0}, raw=True, flush_bytes=flush_bytes)
+    writer.start()
+    writer.event('start', t=100.0)
+    for (t, v), (rt, rv) in zip(averaged, raw):
+        writer.put(t, v)
+        writer.put_raw(rt, rv)
+    for rt, rv in raw[len(averaged):]:
+        writer.put_raw(rt, rv)
+    writer.event('stop', t=105.0, current=1e-4)
+    writer.close(note='done')
+
+    records = read_log(path)
+    assert isinstance(records, np.memmap) and records.dtype == LOG_DTYPE
+    np.testing.assert_array_equal(records['t'], avg_times)
+    np.testing.assert_array_equal(records['value'], avg_values)
+    raw_records = read_log(path, raw=True)
+    np.testing.assert_array_equal(raw_records['t'], raw_times)
+    np.testing.assert_array_equal(raw_records['value'], raw_values)
+
+    meta = read_meta(path)
+    assert meta['format_version'] == LOG_FORMAT_VERSION
+    assert np.dtype([tuple(field) for field in meta['dtype']]) == LOG_DTYPE
+    assert meta['samples'] == len(avg_values) and meta['raw_samples'] == len(raw_values)
+    assert meta['gain'] == 100 and meta['station'] == 0 and meta['note'] == 'done'
+    assert [e['name'] for e in meta['events']] == ['start', 'stop']
+    assert meta['events'][1]['current'] == 1e-4
+    assert meta['wall_end'] >= meta['wall_start']
+    assert writer.bytes_written == (len(avg_values) + len(raw_values)) * LOG_DTYPE.itemsize
+
+
+def test_raw_disabled(tmp_path):
+    path = str(tmp_path / 'session.bin')
+    writer = LogWriter(path)
+    writer.start()
+    writer.put_raw(np.arange(10.0), np.ones(10))
+    writer.close()
+    assert len(read_log(path)) == 0
+    assert not (tmp_path / 'session.raw.bin').exists()
+    assert raw_path(path) == str(tmp_path / 'session.raw.bin')
+
+
+def test_export_csv(tmp_path):
+    path = str(tmp_path / 'session.bin')
+    writer = LogWriter(path)
+    writer.start()
+    writer.put(np.array([1.0, 2.0]), np.array([0.5, -0.25]))
+    writer.close()
+    with open(export_csv(path)) as f:
+        lines = f.read().splitlines()
+    assert lines[0] == 'Timestamp,Current'
+    assert [line.split(',')[1] for line in lines[1:]] == ['0.500000', '-0.250000']
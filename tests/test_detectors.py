@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from detectors import (DETECTORS, CusumDetector, DropRateDetector, RelativeDropDetector, RunningMedianDetector,
+                       ThresholdDetector)
+
+
+FS = 10000
+DROP = 1.0
+
+
+def _signal(seed=0, drop=DROP):
+    """10 mA から時定数 2 ms で 0.1 mA に落ちる電流（雑音 0.1 mA）"""
+    t = np.arange(2 * FS) / FS
+    rng = np.random.default_rng(seed)
+    clean = np.where(t < drop, 10e-3, 10e-3 * np.exp(-np.maximum(t - drop, 0) / 0.002) + 0.1e-3)
+    return t, clean + rng.normal(0, 0.1e-3, len(t))
+
+
+def _run(detector, t, x, block=1000):
+    detector.reset()
+    for i in range(0, len(t), block):
+        hit = detector.process(t[i:i + block], x[i:i + block])
+        if hit is not None:
+            return hit
+    return None
+
+
+# (検出方法, 止まるはずの時刻の範囲, 返す電流の上限)
+CASES = [
+    # 10 サンプルの |mean| が 3 mA を下回るのは 2.5 ms 後の少しあと
+    (lambda: ThresholdDetector(3e-3, 10), (1.0025, 1.005), 3e-3),
+    # 減少率 20 /s はドロップオフの直後に超える
+    (lambda: DropRateDetector(), (1.0, 1.004), 10e-3),
+    # 時定数 5 ms で平滑化した値がピークの 20 % を下回るまで
+    (lambda: RelativeDropDetector(), (1.005, 1.015), 2e-3),
+    (lambda: CusumDetector(), (1.0, 1.004), 10e-3),
+    # 生の値が 2 mA を下回る 3.3 ms 後から、15 サンプルの中央値が追いつくまで
+    (lambda: RunningMedianDetector(), (1.0033, 1.0050), 2e-3),
+]
+
+
+@pytest.mark.parametrize('make,window,limit', CASES)
+def test_detects_dropoff(make, window, limit):
+    t, x = _signal()
+    hit = _run(make(), t, x)
+    assert hit is not None
+    assert window[0] <= hit[0] <= window[1]
+    assert abs(hit[1]) < limit
+
+
+@pytest.mark.parametrize('make,window,limit', CASES)
+def test_no_stop_without_dropoff(make, window, limit):
+    t, x = _signal(drop=10.0)
+    assert _run(make(), t, x) is None
+
+
+@pytest.mark.parametrize('make,window,limit', CASES)
+def test_block_size_does_not_change_hit(make, window, limit):
+    t, x = _signal(seed=1)
+    hits = {_run(make(), t, x, block) for block in (1, 37, 1000)}
+    assert len(hits) == 1
+
+
+def test_holdoff_ignores_early_drop():
+    t, x = _signal(drop=0.2)
+    assert _run(RelativeDropDetector(holdoff=0.5), t, x) is None
+
+
+def test_running_median_matches_numpy():
+    rng = np.random.default_rng(2)
+    x = rng.integers(0, 5, 2000).astype(float)
+    for window in (1, 4, 15):
+        detector = RunningMedianDetector(percent=0.0, window=window, holdoff=0.0)
+        for i, value in enumerate(x):
+            detector.update(i, value)
+            if i + 1 >= window:
+                assert detector._sorted[window // 2] == np.sort(x[i + 1 - window:i + 1])[window // 2]
+
+
+def test_registry_names():
+    assert all(cls.name == name for name, cls in DETECTORS.items())
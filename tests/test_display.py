@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from display import MinMaxPyramid, ScrollBuffer
+
+
+DT = 0.001
+
+
+def _pyramid(n, seed=0, **kwargs):
+    rng = np.random.default_rng(seed)
+    values = rng.normal(size=n)
+    times = np.arange(n) * DT
+    pyramid = MinMaxPyramid(**kwargs)
+    k = 0
+    while k < n:
+        # ブロックの長さは factor の倍数にそろえない
+        block = int(rng.integers(1, 700))
+        pyramid.extend(times[k:k + block], values[k:k + block])
+        k += block
+    return pyramid, values
+
+
+def _check(pyramid, values, t0, t1, max_points):
+    """query の結果を、元の値から直接求めた最小値・最大値と比べる"""
+    times, out = pyramid.query(t0, t1, max_points)
+    i, j = int(np.ceil(t0 / DT)), min(int(np.floor(t1 / DT)) + 1, len(values))
+    if len(out) == len(times) and np.allclose(np.diff(times), DT):
+        # 0段目: 値そのもの（範囲の前後の1点ずつを含む）
+        first = int(round(times[0] / DT))
+        np.testing.assert_array_equal(out, values[first:first + len(out)])
+        assert first <= i and first + len(out) >= j
+        return times, out
+    # 区間ごとに (最初の時刻, 最小値), (最初の時刻, 最大値) の2点
+    first = np.rint(times[::2] / DT).astype(int)
+    lo, hi = out[::2], out[1::2]
+    assert np.all(np.diff(first) > 0) and first[0] <= i
+    # 区間は隙間なく並ぶので、最後以外は次の区間の手前までの最小値・最大値になる
+    for a, b, low, high in zip(first[:-1], first[1:], lo[:-1], hi[:-1]):
+        assert low == values[a:b].min()
+        assert high == values[a:b].max()
+    # 最後の区間は範囲の終わりを含む
+    assert lo[-1] <= values[first[-1]:max(j, first[-1] + 1)].min()
+    assert hi[-1] >= values[first[-1]:max(j, first[-1] + 1)].max()
+    return times, out
+
+
+@pytest.mark.parametrize('t0,t1', [(0.0, 99.999), (12.3456, 12.9871), (50.0007, 50.1003), (3.3, 77.7),
+                                   (99.5, 99.9995), (0.0005, 0.0013)])
+def test_query_matches_brute_force(t0, t1):
+    pyramid, values = _pyramid(100000)
+    for max_points in (50, 500, 2000, 10 ** 6):
+        times, out = _check(pyramid, values, t0, t1, max_points)
+        i, j = int(np.ceil(t0 / DT)), int(np.floor(t1 / DT)) + 1
+        # 範囲内の最小値・最大値は必ず表示される
+        assert out.min() <= values[i:j].min() and out.max() >= values[i:j].max()
+
+
+def test_query_after_fine_levels_wrapped():
+    # 0段目は最新の 4096 点しか残らないので、古い範囲は粗い段から出す
+    pyramid, values = _pyramid(100000, capacity=1 << 12, levels=8, min_capacity=256)
+    assert pyramid.levels[0].first > 0
+    for t0, t1 in ((0.0, 10.0007), (20.001, 20.5), (97.0, 99.999)):
+        _check(pyramid, values, t0, t1, 2000)
+
+
+def test_level_capacity():
+    pyramid = MinMaxPyramid(factor=4, capacity=1 << 12, levels=8, min_capacity=64)
+    assert [level.capacity for level in pyramid.levels] == [4096, 1024, 256, 64, 64, 64, 64, 64]
+
+
+def test_scroll_buffer_view():
+    buffer = ScrollBuffer(5, scale=2.0)
+    buffer.extend(np.arange(3.0))
+    buffer.extend(np.arange(3.0, 8.0))
+    np.testing.assert_array_equal(buffer.view(), np.arange(3.0, 8.0) * 2)
+    assert not buffer.view().flags.writeable
+
+
+def test_start_of_last_follows_timestamps():
+    pyramid = MinMaxPyramid(capacity=1 << 10, levels=4, min_capacity=16)
+    # 途中で点の間隔が 0.1 s から 0.5 s に変わる
+    times = np.concatenate((np.arange(100) * 0.1, 10.0 + np.arange(100) * 0.5))
+    pyramid.extend(times, np.ones(len(times)))
+    assert pyramid.start_of_last(50) == times[-50]
+    assert pyramid.start_of_last(150) == times[-150]
+    assert pyramid.start_of_last(10 ** 6) == times[0]
@@ -0,0 +1,86 @@
+import numpy as np
+
+import pytest
+
+from dsp import BandPower, Spectrum, SpectrumWorker, WINDOWS
+
+
+def _worker(fs=1000.0):
+    return SpectrumWorker(None, Spectrum(fs, nfft=256, segments=4), history=10)
+
+
+def _frame(worker, fs, t0=0.0):
+    n = worker.spectrum.samples
+    times = t0 + np.arange(n) / fs
+    return times, np.sin(2 * np.pi * 50 * times)
+
+
+def test_update_adds_row():
+    worker = _worker()
+    worker.update(*_frame(worker, 1000.0))
+    _, psd, spectrogram = worker.snapshot()
+    assert worker.rows == 1
+    assert np.isfinite(spectrogram[-1]).all()
+    assert psd.max() > 0
+
+
+def test_mixed_rate_frame_leaves_spectrogram_unchanged():
+    worker = _worker()
+    worker.update(*_frame(worker, 1000.0))
+    _, psd, spectrogram = worker.snapshot()
+    # 途中で周波数が 1 kHz から 2 kHz に変わったフレーム
+    times, values = _frame(worker, 1000.0)
+    half = len(times) // 2
+    times[half:] = times[half] + np.arange(len(times) - half) / 2000.0
+    worker.update(times, values)
+    _, psd_after, spectrogram_after = worker.snapshot()
+    assert worker.rows == 1
+    np.testing.assert_array_equal(psd_after, psd)
+    np.testing.assert_array_equal(spectrogram_after, spectrogram)
+
+
+def test_rate_change_rebuilds_spectrum():
+    worker = _worker()
+    worker.update(*_frame(worker, 1000.0))
+    worker.update(*_frame(worker, 2000.0))
+    assert worker.spectrum.sampling_frequency == 2000
+    assert worker.rows == 1
+    _, psd, spectrogram = worker.snapshot()
+    assert np.isnan(spectrogram).all()
+    worker.update(*_frame(worker, 2000.0))
+    assert worker.rows == 2
+
+
+# 振幅 A の正弦波の電力は A²/2（ビンの上と、ビンの間の周波数の両方）
+@pytest.mark.parametrize('window', sorted(WINDOWS))
+@pytest.mark.parametrize('frequency', [50.0, 50.37])
+def test_band_power_of_sine(window, frequency):
+    fs, n, amplitude = 1000.0, 1000, 0.3
+    times = np.arange(4 * n).reshape(4, n) / fs
+    values = 2.0 + amplitude * np.sin(2 * np.pi * frequency * times + 0.4)
+    band = BandPower(30.0, 70.0, fs, window)
+    rms = band.reduce(values, times)
+    # 矩形窓はビンの間だと漏れが帯域の外まで広がるので少し甘くする
+    rel = 2e-2 if window == 'rect' and frequency % 1 else 2e-3
+    np.testing.assert_allclose(rms ** 2, amplitude ** 2 / 2, rtol=rel)
+    # 帯域の外の正弦波はほとんど入らない
+    assert BandPower(200.0, 300.0, fs, window).reduce(values, times).max() < 0.05 * amplitude
+
+
+@pytest.mark.parametrize('window', ['hann', 'hamming', 'blackman'])
+@pytest.mark.parametrize('frequency', [50.0, 50.37])
+def test_spectrum_band_power_of_sine(window, frequency):
+    fs, amplitude = 1000.0, 0.3
+    spectrum = Spectrum(fs, nfft=1000, segments=4, window=window)
+    times = np.arange(spectrum.samples) / fs
+    spectrum.compute(1.0 + amplitude * np.sin(2 * np.pi * frequency * times))
+    assert spectrum.band_power(30.0, 70.0) == pytest.approx(amplitude ** 2 / 2, rel=2e-3)
+
+
+def test_spectrum_white_noise_level():
+    # 分散 σ² の白色雑音の片側 PSD は 2σ²/fs で、全帯域の積分は σ²
+    fs, sigma = 1000.0, 0.1
+    spectrum = Spectrum(fs, nfft=256, segments=200)
+    psd = spectrum.compute(np.random.default_rng(0).normal(0.0, sigma, spectrum.samples))
+    assert np.mean(psd[1:-1]) == pytest.approx(2 * sigma ** 2 / fs, rel=0.05)
+    assert spectrum.band_power(0.0, fs / 2) == pytest.approx(sigma ** 2, rel=0.05)
@@ -0,0 +1,75 @@
+import socket
+import struct
+
+import numpy as np
+import pytest
+
+from live import SAMPLE_HEADER, SAMPLES, LiveServer, _accept_key, _frame, encode_samples
+
+
+def _parse_frame(data):
+    """サーバーのフレームを (fin, opcode, payload, 残り) にする（マスクなしのはず）"""
+    fin, opcode = data[0] >> 7, data[0] & 0x0F
+    assert data[1] & 0x80 == 0
+    n, offset = data[1] & 0x7F, 2
+    if n == 126:
+        n, offset = struct.unpack('!H', data[2:4])[0], 4
+    elif n == 127:
+        n, offset = struct.unpack('!Q', data[2:10])[0], 10
+    return fin, opcode, data[offset:offset + n], data[offset + n:]
+
+
+def test_accept_key_rfc6455_sample():
+    # RFC 6455 1.3 の例
+    assert _accept_key('dGhlIHNhbXBsZSBub25jZQ==') == 's3pPLMBiTxaQ9kYGzzhZRbK+xOo='
+
+
+@pytest.mark.parametrize('n,header_size', [(0, 2), (125, 2), (126, 4), (65535, 4), (65536, 10)])
+def test_frame_length_encoding(n, header_size):
+    payload = bytes(range(256)) * (n // 256) + bytes(range(n % 256))
+    frame = _frame(0x2, payload)
+    assert len(frame) == header_size + n
+    fin, opcode, data, rest = _parse_frame(frame)
+    assert (fin, opcode, data, rest) == (1, 0x2, payload, b'')
+
+
+def test_encode_samples():
+    times = np.array([10.0, 10.5, 11.0])
+    currents = np.array([1e-3, 2e-3, 3e-3])
+    message = encode_samples(2, times, currents, 100.0)
+    kind, station, _, n, t0 = SAMPLE_HEADER.unpack_from(message)
+    assert (kind, station, n, t0) == (SAMPLES, 2, 3, 110.0)
+    body = np.frombuffer(message, '<f4', offset=SAMPLE_HEADER.size)
+    np.testing.assert_allclose(body[:3], [0.0, 0.5, 1.0])
+    np.testing.assert_allclose(body[3:], currents, rtol=1e-6)
+
+
+def _recv_until(sock, marker):
+    data = b''
+    while marker not in data:
+        chunk = sock.recv(4096)
+        assert chunk
+        data += chunk
+    return data
+
+
+def test_handshake_and_state_over_socket():
+    server = LiveServer(port=0)
+    server.publish_state(0, etching=True)
+    server.start()
+    try:
+        with socket.create_connection(('127.0.0.1', server.port), timeout=5) as sock:
+            sock.sendall(b'GET /ws HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                         b'Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\nSec-WebSocket-Version: 13\r\n\r\n')
+            data = _recv_until(sock, b'\r\n\r\n')
+            response, rest = data.split(b'\r\n\r\n', 1)
+            assert response.startswith(b'HTTP/1.1 101 ')
+            assert b'Sec-WebSocket-Accept: s3pPLMBiTxaQ9kYGzzhZRbK+xOo=' in response.split(b'\r\n')
+            # 接続直後に今の状態がテキストフレームで届く
+            while len(rest) < 2 or len(rest) < 2 + (rest[1] & 0x7F):
+                rest += sock.recv(4096)
+            _, opcode, payload, _ = _parse_frame(rest)
+            assert opcode == 0x1
+            assert b'"etching": true' in payload
+    finally:
+        server.stop()
@@ -0,0 +1,73 @@
+import time
+
+import numpy as np
+import pytest
+
+from backend import SimulatedBackend, EtchModel
+from dsp import LockIn
+from stop import StopEngine
+
+
+FS = 10000.0
+F = 1000.0
+
+
+def _signal(t, amplitude, phase, dc=0.0, noise=0.0, seed=0):
+    rng = np.random.default_rng(seed)
+    return dc + amplitude * np.cos(2 * np.pi * F * t + phase) + rng.normal(0, noise, len(t))
+
+
+@pytest.mark.parametrize('n', [1000, 1234])
+@pytest.mark.parametrize('phase', [0.0, 0.7, -2.5])
+def test_recovers_amplitude_and_phase(n, phase):
+    blocks = 20
+    t = 12.3 + np.arange(blocks * n) / FS
+    x = _signal(t, 2.0, phase, dc=0.5, noise=0.2)
+    dc, amplitude, recovered = LockIn(F, FS).demodulate(x.reshape(blocks, n), t.reshape(blocks, n))
+    # 雑音 0.2 で n サンプルなら振幅の誤差はおよそ 0.2 * sqrt(2/n)
+    tolerance = 5 * 0.2 * np.sqrt(2.0 / n)
+    np.testing.assert_allclose(amplitude, 2.0, atol=tolerance)
+    np.testing.assert_allclose(dc, 0.5, atol=tolerance)
+    np.testing.assert_allclose(np.angle(np.exp(1j * (recovered - phase))), 0.0, atol=tolerance / 2.0)
+
+
+def test_reduce_keeps_phase_and_dc():
+    n = 1000
+    t = np.arange(4 * n) / FS
+    lockin = LockIn(F, FS)
+    amplitude = lockin.reduce(_signal(t, 1.5, 0.3, dc=-0.2).reshape(4, n), t.reshape(4, n))
+    np.testing.assert_allclose(amplitude, 1.5, atol=1e-9)
+    np.testing.assert_allclose(lockin.phase, 0.3, atol=1e-9)
+    np.testing.assert_allclose(lockin.dc, -0.2, atol=1e-9)
+
+
+def test_sampling_frequency_change():
+    n = 500
+    t = np.arange(4 * n) / 50000.0
+    lockin = LockIn(F, FS)
+    lockin.reduce(np.zeros((1, 1000)), np.zeros((1, 1000)))
+    lockin.set_sampling_frequency(50000.0)
+    amplitude = lockin.reduce(_signal(t, 1.0, 0.0).reshape(4, n), t.reshape(4, n))
+    np.testing.assert_allclose(amplitude, 1.0, atol=1e-9)
+
+
+def test_stop_engine_with_lockin_reduce():
+    # 直流は 5 mA のまま、交流の振幅だけが 10 mA から 0.1 mA に落ちる
+    gain = 100
+    device = SimulatedBackend(EtchModel(seed=0), gain=gain)
+    lockin = LockIn(F, FS)
+    engine = StopEngine(device, window=1000, method=lockin.reduce, gain=gain, threshold=1e-3, alert=None)
+    engine.arm()
+    start = time.perf_counter() + 0.01
+    t = start + np.arange(20000) / FS
+    drop = start + 1.05
+    amplitude = np.where(t < drop, 10e-3, 0.1e-3)
+    currents = 5e-3 + amplitude * np.cos(2 * np.pi * F * t)
+    for k in range(0, len(t), 500):
+        engine.process(t[k:k + 500], currents[k:k + 500] * gain)
+    assert len(engine.events) == 1
+    event = engine.events[0]
+    # 1.05 s を含む区間はまだ振幅が大きいので、その次の区間 (1.2 s) で止まる
+    assert event.sample_time == pytest.approx(t[11999])
+    assert event.current == pytest.approx(0.1e-3, rel=1e-6)
+    assert device.output[1] == (0.0, 0.0, 0.0)
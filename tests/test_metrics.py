@@ -0,0 +1,88 @@
+import re
+import urllib.request
+
+import pytest
+
+from metrics import Metrics, MetricsServer, Registry
+
+
+# Prometheus のテキスト形式の 1 行: 名前{ラベル} 値
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[a-zA-Z_][a-zA-Z0-9_]*="[^"]*"(,[a-zA-Z_][a-zA-Z0-9_]*="[^"]*")*\})? (\S+)$')
+
+
+def _parse(text):
+    """サンプル行を {(名前, ラベル): 値}、コメント行をリストにして返す"""
+    assert text.endswith('\n')
+    samples, comments = {}, []
+    for line in text.splitlines():
+        if line.startswith('#'):
+            comments.append(line)
+            continue
+        m = SAMPLE.match(line)
+        assert m, line
+        samples[(m.group(1), m.group(2) or '')] = float(m.group(4))
+    return samples, comments
+
+
+def test_histogram_buckets_sum_count():
+    registry = Registry()
+    h = registry.histogram('tipetch_x_seconds', 'X time', {'station': '1'})
+    for value in (1e-6, 3e-6, 0.5, 20.0):
+        h.observe(value)
+    samples, comments = _parse(registry.render())
+    assert comments == ['# HELP tipetch_x_seconds X time', '# TYPE tipetch_x_seconds histogram']
+    bucket = lambda le: samples[('tipetch_x_seconds_bucket', f'{{station="1",le="{le}"}}')]
+    # le は「以下」なので境界上の値はそのバケツに入る（累積）
+    assert bucket('1e-06') == 1
+    assert bucket('2e-06') == 1
+    assert bucket('5e-06') == 2
+    assert bucket('0.5') == 3
+    assert bucket('10') == 3
+    assert bucket('+Inf') == 4
+    assert samples[('tipetch_x_seconds_count', '{station="1"}')] == 4
+    assert samples[('tipetch_x_seconds_sum', '{station="1"}')] == pytest.approx(20.500004)
+    # 累積なので単調増加
+    counts = [v for (name, _), v in samples.items() if name.endswith('_bucket')]
+    assert counts == sorted(counts)
+
+
+def test_help_and_type_once_per_name_and_unused_omitted():
+    registry = Registry()
+    a = Metrics(registry, station='1')
+    b = Metrics(registry, station='2')
+    a.samples.inc(10)
+    b.samples.inc(5)
+    a.acquire.observe(1e-3)
+    text = registry.render()
+    samples, comments = _parse(text)
+    assert comments.count('# HELP tipetch_samples_total Samples acquired') == 1
+    assert comments.count('# TYPE tipetch_samples_total counter') == 1
+    assert comments.count('# TYPE tipetch_acquire_seconds histogram') == 1
+    assert samples[('tipetch_samples_total', '{station="1"}')] == 10
+    assert samples[('tipetch_samples_total', '{station="2"}')] == 5
+    # 一度も使われていないものは出さない
+    assert 'tipetch_dropped_samples_total' not in text
+    assert ('tipetch_acquire_seconds_count', '{station="2"}') not in samples
+    # HELP/TYPE はその名前のサンプルの直前に来る
+    lines = text.splitlines()
+    i = lines.index('# TYPE tipetch_samples_total counter')
+    assert lines[i - 1] == '# HELP tipetch_samples_total Samples acquired'
+    assert lines[i + 1].startswith('tipetch_samples_total{')
+
+
+def test_same_name_and_labels_share_metric():
+    registry = Registry()
+    assert registry.counter('c_total', 'C', {'a': '1', 'b': '2'}) is registry.counter('c_total', 'C', {'b': '2', 'a': '1'})
+
+
+def test_server_serves_render():
+    registry = Registry()
+    registry.counter('c_total', 'C').inc(3)
+    server = MetricsServer(port=0, registry=registry)
+    server.start()
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{server.port}/metrics', timeout=5) as response:
+            assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            assert response.read().decode() == registry.render()
+    finally:
+        server.stop()
@@ -0,0 +1,118 @@
+import time
+
+import numpy as np
+import pytest
+
+from acquisition import Averager, SampleRing
+from backend import SimulatedBackend, EtchModel
+from recipe import AC, DC, Burst, Pulse, Ramp, RecipeRunner, parse_recipe
+from station import EtchStation
+
+
+def _device():
+    return SimulatedBackend(EtchModel(seed=0), gain=100)
+
+
+def test_compile_dc_and_ac():
+    assert DC(5.0).compile(4096) == ('dc', (5.0,), 0.0)
+    assert AC(1.0, 1000.0, offset=2.0).compile(4096) == ('sine', (1000.0, 1.0, 2.0), 0.0)
+
+
+def test_compile_pulse_duty_cycle():
+    kind, (data, frequency, amplitude, offset, repeat), resolution = Pulse(5.0, 0.001, 0.003).compile(4096)
+    assert kind == 'custom' and repeat == 0
+    assert frequency == pytest.approx(250.0)
+    voltages = offset + amplitude * data
+    assert np.count_nonzero(np.isclose(voltages, 5.0)) == 1024
+    assert np.allclose(voltages[1024:], 0.0)
+    assert resolution == pytest.approx(0.004 / 4096)
+
+
+def test_compile_pulse_below_resolution():
+    with pytest.raises(ValueError):
+        Pulse(5.0, 1e-7, 1.0).compile(4096)
+
+
+def test_compile_burst():
+    kind, (data, frequency, amplitude, offset, repeat), _ = Burst(2.0, 1000.0, 0.002, 0.002, offset=1.0).compile(4096)
+    voltages = offset + amplitude * data
+    assert offset == 1.0 and amplitude == pytest.approx(2.0, rel=1e-3)
+    assert np.allclose(voltages[2048:], 1.0)
+    with pytest.raises(ValueError):
+        Burst(2.0, 1e6, 0.002, 0.002).compile(4096)
+
+
+def test_compile_ramp_holds_stop_voltage():
+    kind, (data, frequency, amplitude, offset, repeat), _ = Ramp(0.0, 5.0, 2.0).compile(4096)
+    voltages = offset + amplitude * data
+    assert repeat == 1 and offset == 5.0 and frequency == pytest.approx(0.5)
+    assert voltages[0] == pytest.approx(0.0) and voltages[-1] == pytest.approx(5.0)
+
+
+def test_parse_unknown_step():
+    with pytest.raises(ValueError):
+        parse_recipe([{'type': 'square'}])
+
+
+def test_runner_steps_by_duration():
+    device = _device()
+    steps = parse_recipe([{'type': 'dc', 'voltage': 5, 'duration': 1.0},
+                          {'type': 'ac', 'amplitude': 1, 'frequency': 500, 'offset': 2, 'duration': 0.5}])
+    started = []
+    runner = RecipeRunner(device, steps, Averager(10), on_step=lambda index, step: started.append((index, step.type)))
+    runner.start(0.0)
+    assert device.output[1] == (5.0, 0.0, 0.0)
+    times = np.arange(0, 2.0, 0.01)
+    for k in range(0, len(times), 10):
+        runner.process(times[k:k + 10], np.full(10, 1e-3))
+    assert started == [(0, 'dc'), (1, 'ac')]
+    assert device.output[1] == (2.0, 1.0, 500.0)
+    assert runner.finished
+
+
+def test_runner_advances_on_current_events():
+    device = _device()
+    steps = [DC(5.0, until_below=2e-3), DC(3.0, until_fraction=0.5)]
+    runner = RecipeRunner(device, steps, Averager(10))
+    runner.start(0.0)
+    times = np.arange(100) / 1000
+    runner.process(times, np.full(100, 5e-3))
+    assert runner.index == 0
+    runner.process(times + 0.1, np.full(100, 1e-3))
+    assert runner.index == 1 and device.output[1] == (3.0, 0.0, 0.0)
+    runner.process(times + 0.2, np.full(100, 4e-3))
+    assert not runner.finished
+    runner.process(times + 0.3, np.full(100, 1.5e-3))
+    assert runner.finished
+
+
+def test_empty_recipe():
+    with pytest.raises(ValueError):
+        RecipeRunner(_device(), [], Averager(10))
+
+
+def test_stop_event_ends_recipe():
+    device = _device()
+    ends = []
+    station = EtchStation(device, SampleRing(1 << 16), avg_window=10, threshold=2e-3, alert=None,
+                          on_recipe_end=ends.append)
+    station.start_recipe([DC(5.0, duration=10.0)])
+    times = time.perf_counter() + 0.01 + np.arange(1000) / 10000
+    station.process(times, np.full(1000, 5e-3 * 100))
+    assert station.recipe is not None
+    station.process(times + 0.1, np.full(1000, 1e-3 * 100))
+    assert station.recipe is None and not station.etching
+    assert [event.detector for event in station.stop_engine.events] == ['threshold']
+    assert device.output[1] == (0.0, 0.0, 0.0)
+    assert ends == []
+
+
+def test_recipe_end_reported():
+    device = _device()
+    ends = []
+    station = EtchStation(device, SampleRing(1 << 16), index=3, avg_window=10, alert=None, on_recipe_end=ends.append)
+    station.start_recipe([DC(5.0, duration=0.05)])
+    times = time.perf_counter() + 0.01 + np.arange(1000) / 10000
+    station.process(times, np.full(1000, 5e-3 * 100))
+    assert ends == [3]
+    assert station.recipe is None and device.output[1] == (0.0, 0.0, 0.0)
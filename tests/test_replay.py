@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from datalog import LogWriter
+from replay import find_dropoff, load_session, readings
+
+
+FS = 10000
+GAIN = 100
+
+
+def write_stopped_log(path, raw, meta={'avg_window': 100}):
+    """5 s でドロップオフし、その 20 ms 後に自動停止して、停止の直後で終わるログを書く"""
+    times = 100.0 + np.arange(int(5.02 * FS) + 1) / FS
+    currents = np.where(times < 105.0, 10e-3, 0.1e-3)
+    writer = LogWriter(str(path), meta=dict(meta, gain=GAIN), raw=raw)
+    writer.start()
+    writer.event('start', t=100.0)
+    if raw:
+        writer.put_raw(times, currents * GAIN)
+    # 平均化したログ（100 サンプルごと）
+    n = len(currents) // 100 * 100
+    writer.put(times[99:n:100], currents[:n].reshape(-1, 100).mean(axis=1))
+    writer.event('stop', t=times[-1], sample_time=times[-1])
+    writer.close()
+
+
+def test_find_dropoff_truncated_after_window():
+    times = np.arange(1000) / 1000
+    currents = np.where(times < 0.995, 1.0, 0.0)
+    assert find_dropoff(times, currents, window=50) == times[995]
+
+
+def test_find_dropoff_without_drop():
+    times = np.arange(1000) / 1000
+    assert find_dropoff(times, np.ones(1000), window=50) is None
+
+
+def test_dropoff_in_raw_log_ending_at_stop(tmp_path):
+    path = tmp_path / 'stopped.bin'
+    write_stopped_log(path, raw=True)
+    session = load_session(str(path))
+    assert session.dropoff is not None
+    assert abs(session.dropoff - 105.0) < 1e-3
+
+
+def test_dropoff_in_averaged_log_ending_at_stop(tmp_path):
+    path = tmp_path / 'stopped.bin'
+    write_stopped_log(path, raw=False)
+    session = load_session(str(path))
+    assert session.dropoff is not None
+    assert abs(session.dropoff - 105.0) < 0.02
+
+
+@pytest.mark.parametrize('window', [100, 1000])
+def test_averaged_log_window_counts_samples(tmp_path, window):
+    # 平均化したログでも window は生のサンプル数で、平均化前のデータと同じ時刻・電流になる
+    write_stopped_log(tmp_path / 'raw.bin', raw=True)
+    write_stopped_log(tmp_path / 'avg.bin', raw=False)
+    raw = load_session(str(tmp_path / 'raw.bin'))
+    averaged = load_session(str(tmp_path / 'avg.bin'))
+    assert (raw.per_record, averaged.per_record) == (1, 100)
+    raw_times, raw_currents = readings(raw, window)
+    times, currents = readings(averaged, window)
+    np.testing.assert_array_equal(times, raw_times)
+    np.testing.assert_allclose(currents, raw_currents, rtol=1e-5)
+
+
+def test_averaged_log_rejects_window_that_does_not_divide(tmp_path):
+    write_stopped_log(tmp_path / 'avg.bin', raw=False)
+    with pytest.raises(ValueError, match='multiple'):
+        readings(load_session(str(tmp_path / 'avg.bin')), 150)
+
+
+def test_averaged_log_without_avg_window_is_rejected(tmp_path):
+    write_stopped_log(tmp_path / 'avg.bin', raw=False, meta={})
+    session = load_session(str(tmp_path / 'avg.bin'))
+    assert session.per_record is None
+    with pytest.raises(ValueError, match='avg_window'):
+        readings(session, 100)
@@ -0,0 +1,55 @@
+import pytest
+
+from backend import DeviceError, EtchModel, SimulatedBackend
+from stop import StopEngine
+from station import DeviceChannel, SharedDIO
+
+
+def _channels():
+    device = SimulatedBackend(EtchModel(seed=0), gain=100, model2=EtchModel(seed=1))
+    device.open()
+    device.dio_enable(0b11)
+    dio = SharedDIO(device)
+    return device, DeviceChannel(device, 1, dio), DeviceChannel(device, 2, dio)
+
+
+def test_stations_keep_separate_dio_bits():
+    device, first, second = _channels()
+    first.dio_set(1)
+    assert device.dio == 0b01
+    second.dio_set(1)
+    assert device.dio == 0b11
+    # 一方を下げてももう一方のビットは残る
+    first.dio_set(0)
+    assert device.dio == 0b10
+    first.dio_set(1)
+    second.dio_set(0)
+    assert device.dio == 0b01
+    # 0番目のビット以外は無視する
+    second.dio_set(0b10)
+    assert device.dio == 0b01
+
+
+def test_outputs_are_routed_to_own_channel():
+    device, first, second = _channels()
+    first.wavegen_dc(1, 5.0)
+    second.wavegen_sine(1, 1000.0, 2.0, 1.0)
+    assert device.output[1] == (5.0, 0.0, 0.0)
+    assert device.output[2] == (1.0, 2.0, 1000.0)
+    with pytest.raises(DeviceError):
+        second.wavegen_dc(2, 0)
+
+
+def test_trip_stops_only_own_station():
+    device, first, second = _channels()
+    engines = [StopEngine(station, alert=None) for station in (first, second)]
+    for station, engine in zip((first, second), engines):
+        station.wavegen_dc(1, 5.0)
+        engine.arm()
+    assert engines[1].trip(detector='test') is not None
+    assert device.output[2] == (0.0, 0.0, 0.0)
+    assert device.output[1] == (5.0, 0.0, 0.0)
+    assert device.dio == 0b10
+    assert engines[0].trip(detector='test') is not None
+    assert device.output[1] == (0.0, 0.0, 0.0)
+    assert device.dio == 0b11
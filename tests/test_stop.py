@@ -0,0 +1,46 @@
+import threading
+
+from backend import SimulatedBackend, EtchModel
+from stop import StopEngine
+
+
+def _engine():
+    device = SimulatedBackend(EtchModel(seed=0), gain=100)
+    return StopEngine(device, window=10, gain=100, threshold=1e-3, alert=None)
+
+
+def test_trip_before_first_block_stops_output():
+    engine = _engine()
+    engine.arm()
+    event = engine.trip(detector='watchdog')
+    assert event is not None and event.detector == 'watchdog'
+    assert not engine.armed
+
+
+def test_trip_when_stopped_is_noop():
+    engine = _engine()
+    assert engine.trip() is None
+    engine.arm()
+    engine.trip()
+    assert engine.trip() is None
+    assert len(engine.events) == 1
+
+
+def test_concurrent_trips_stop_once():
+    engine = _engine()
+    stops = []
+    engine.on_stop = stops.append
+    engine.arm()
+    barrier = threading.Barrier(8)
+
+    def trip():
+        barrier.wait()
+        engine.trip()
+
+    threads = [threading.Thread(target=trip) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(stops) == 1
+    assert len(engine.events) == 1
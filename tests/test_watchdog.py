@@ -0,0 +1,44 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from backend import SimulatedBackend, EtchModel
+from detectors import DropRateDetector
+from metrics import Metrics, Registry
+from stop import StopEngine
+from watchdog import WatchState, Watchdog
+
+
+def _run(method='|mean|', detector=None, seconds=0.3):
+    """電流が Stop current の 1/10 のまま心拍を送り続け、ウォッチドッグが止めたかを返す"""
+    device = SimulatedBackend(EtchModel(seed=0), gain=100)
+    engine = StopEngine(device, detector, window=10, gain=100, threshold=1e-3, alert=None)
+    engine.arm()
+    station = SimpleNamespace(index=0, etching=True, method=method, stop_engine=engine,
+                              metrics=Metrics(Registry()))
+    state = WatchState(1)
+    watchdog = Watchdog(state, [station], timeout=1.0, interval=0.005, grace=0.05)
+    watchdog.start()
+    try:
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            state.beat(0, time.perf_counter(), 1e-4)
+            time.sleep(0.005)
+    finally:
+        watchdog.stop()
+        state.close()
+    return [event.detector for event in engine.events]
+
+
+def test_current_below_margin_trips_threshold_detector():
+    assert _run() == ['watchdog']
+
+
+@pytest.mark.parametrize('method', ['lock-in', 'band', 'max'])
+def test_current_not_compared_for_other_reductions(method):
+    assert _run(method=method) == []
+
+
+def test_current_not_compared_for_other_detectors():
+    assert _run(detector=DropRateDetector()) == []
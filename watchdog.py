@@ -0,0 +1,204 @@
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from backend import DeviceError, open_backend
+
+
+# 共有メモリ上の1ステーション分の状態（時刻は time.perf_counter 基準。OS 全体で共通の単調時計なので
+# 別プロセスからも比べられる）
+# beat: 取得スレッドが最後にブロックを処理した時刻, current: そのブロックの |電流| の平均 [A],
+# threshold: Stop current [A], armed: エッチング中か, tripped: ウォッチドッグが出力を止めたか
+WATCH_DTYPE = np.dtype([('beat', '<f8'), ('current', '<f8'), ('threshold', '<f8'),
+                        ('armed', 'u1'), ('tripped', 'u1')], align=True)
+
+# 心拍の電流（ブロックの |電流| の平均）を Stop current と比べてよい縮約。lock-in や band、min/max は
+# 停止判定が比べる値が電流の大きさと違うので、電流の下回りは見ない（心拍の途切れだけを見る）
+MARGIN_METHODS = ('|mean|', 'mean', 'rms', 'median')
+
+
+class WatchState:
+    """ウォッチドッグとガーディアンが読む、ステーションごとの心拍と電流（共有メモリ）
+
+    name を指定しなければ新しく作り、指定すればほかのプロセスが作ったものにつなぐ。
+    各値は 8 バイト境界の1回の書き込みなので、ロックなしで読んでも値が崩れることはない。
+    """
+
+    def __init__(self, count, name=None):
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=max(count, 1) * WATCH_DTYPE.itemsize)
+        self.slots = np.ndarray(count, dtype=WATCH_DTYPE, buffer=self.shm.buf)
+        if self.owner:
+            self.slots[:] = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def beat(self, index, t, current):
+        """取得スレッドから呼ばれる（電流を書いてから時刻を書く）"""
+        self.slots['current'][index] = current
+        self.slots['beat'][index] = t
+
+    def close(self):
+        self.slots = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class Watchdog(threading.Thread):
+    """取得スレッドの心拍と電流を見張り、異常があれば取得スレッドとは別に出力を止めるスレッド
+
+    エッチング中に心拍が timeout 秒途切れたとき（取得スレッドが止まった・デバイスの読み出しが
+    失敗し続けているなど）、または電流が Stop current の margin 倍を grace 秒下回り続けても
+    停止判定が止めないときに、StopEngine.trip で CH1 を 0V にして DIO の停止ビットをセットする。
+    電流の下回りは、しきい値の検出方法で MARGIN_METHODS の縮約を使っているステーションだけで見る。
+    最後の心拍から出力を止めるまでの時間は各ステーションの metrics.watchdog に記録する
+    （最悪でも timeout + interval + 出力を止める時間）。
+    """
+
+    def __init__(self, state, stations, timeout=0.5, interval=0.01, margin=0.5, grace=1.0):
+        super().__init__(daemon=True)
+        self.state = state
+        self.stations = stations
+        self.timeout = timeout
+        self.interval = interval
+        self.margin = margin
+        self.grace = grace
+        self._below_since = [None] * len(stations)
+        self._stop_event = threading.Event()
+
+    def run(self):
+        slots = self.state.slots
+        while not self._stop_event.wait(self.interval):
+            for k, station in enumerate(self.stations):
+                # GUI スレッドからの開始・停止もすぐに見えるよう、状態はここで共有メモリに写す
+                etching = station.etching
+                threshold = station.stop_engine.threshold
+                slots['threshold'][k] = threshold
+                slots['armed'][k] = etching
+                if not etching:
+                    slots['tripped'][k] = 0
+                    self._below_since[k] = None
+                    continue
+                beat, current = slots['beat'][k], slots['current'][k]
+                now = time.perf_counter()
+                reason = None
+                if now - beat > self.timeout:
+                    reason = f"no data for {now - beat:.3f} s"
+                elif threshold > 0 and self._checks_current(station) and current < self.margin * threshold:
+                    if self._below_since[k] is None:
+                        self._below_since[k] = now
+                    elif now - self._below_since[k] >= self.grace:
+                        reason = f"current {current:.6f} A stayed below {self.margin:g} x threshold"
+                else:
+                    self._below_since[k] = None
+                if reason is not None:
+                    self.trip(k, station, beat, current, reason)
+
+    def _checks_current(self, station):
+        """心拍の電流と Stop current を比べてよい設定か"""
+        return station.stop_engine.detector.name == 'threshold' and station.method in MARGIN_METHODS
+
+    def trip(self, index, station, beat, current, reason):
+        try:
+            event = station.stop_engine.trip(beat, current, detector='watchdog')
+        except DeviceError as e:
+            print(f"Watchdog: station {station.index + 1} cutoff failed: {str(e)}")
+            return
+        if event is None:
+            # 取得スレッドの停止判定が先に止めた
+            self._below_since[index] = None
+            return
+        self.state.slots['tripped'][index] = 1
+        self._below_since[index] = None
+        station.metrics.watchdog.observe(event.cutoff_at - beat)
+        print(f"Watchdog: station {station.index + 1} output set to 0 V ({reason}); "
+              f"{(event.cutoff_at - beat) * 1000:.1f} ms after the last heartbeat")
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+
+
+def _safe_outputs(kind, kwargs, channels):
+    """デバイスを開き、channels の CH を 0V にして DIO の停止ビットをセットする"""
+    if kind == 'wfsdk':
+        # 閉じたあとも 0V と停止ビットを保つ
+        kwargs = dict(kwargs, on_close=0)
+    device = open_backend(kind, **kwargs)
+    try:
+        mask = 0
+        for channel in channels:
+            device.wavegen_dc(channel, 0)
+            mask |= 1 << (channel - 1)
+        device.dio_enable(mask)
+        device.dio_set(mask)
+    finally:
+        device.close()
+
+
+def _guardian(name, count, spec, timeout, interval):
+    """ガーディアンのプロセス
+
+    親プロセスがエッチング中に終了したとき、または心拍が timeout 秒途切れてもウォッチドッグが止めない
+    （親プロセス全体が固まっている）ときは、親プロセスを終了させてデバイスを開き直し、出力を止める。
+    デバイスは同時に1つのプロセスしか開けないので、親が生きている間は開かない。
+    """
+    parent = multiprocessing.parent_process()
+    state = WatchState(count, name)
+    try:
+        while True:
+            parent.join(interval)
+            slots = state.slots.copy()
+            active = (slots['armed'] != 0) & (slots['tripped'] == 0)
+            if not parent.is_alive():
+                if not active.any():
+                    return
+                reason = 'parent process exited'
+                break
+            stale = active & (time.perf_counter() - slots['beat'] > timeout)
+            if stale.any():
+                reason = 'parent process stopped responding'
+                # SIGKILL は止まっている（SIGSTOP された）プロセスにも効く。Windows では TerminateProcess になる
+                os.kill(parent.pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+                parent.join(5.0)
+                break
+        last = float(slots['beat'][active].max())
+        kind, kwargs, channels = spec
+        for attempt in range(20):
+            try:
+                _safe_outputs(kind, kwargs, channels)
+                break
+            except DeviceError as e:
+                # 親が閉じたデバイスがまだ開けないことがあるので少し待って開き直す
+                error = e
+                time.sleep(0.1)
+        else:
+            print(f"Guardian: could not open the device: {str(error)}")
+            return
+        print(f"Guardian: output set to 0 V ({reason}); "
+              f"{(time.perf_counter() - last) * 1000:.0f} ms after the last heartbeat")
+    finally:
+        # 親が後片付けできなかった共有メモリはここで消す
+        state.owner = not parent.is_alive()
+        state.close()
+
+
+def start_guardian(state, spec, timeout=2.0, interval=0.05):
+    """ガーディアンのプロセスを起動する。spec は StationManager と同じ (バックエンド名, 引数, チャンネル)
+
+    timeout はウォッチドッグのスレッドより長くし、スレッドで止められなかったときだけ動くようにする。
+    """
+    context = multiprocessing.get_context('spawn')
+    process = context.Process(target=_guardian, args=(state.name, len(state.slots), spec, timeout, interval),
+                              daemon=True)
+    process.start()
+    return process